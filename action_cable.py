@@ -0,0 +1,243 @@
+"""
+Lightweight ActionCable client, used to receive timer updates pushed by the server.
+
+Without it, a press made on the website only reaches the device on the next REST poll, and every
+device polls the server every minute. The client keeps a WebSocket open to Config.WEBSOCKET_URI,
+subscribes to the device's timer channel and hands every pushed timer straight to the countdown.
+
+ActionCable sends a {"type": "ping"} message every few seconds, so if nothing has been received for
+Config.WEBSOCKET_STALE_SEC the socket is treated as dead. Reconnects back off exponentially with jitter.
+
+Example usage:
+
+    channel = TimerChannel(Config.WEBSOCKET_URI, short_code, device_id, on_timer_update)
+    asyncio.create_task(channel.run())
+    channel.connected  # True while the subscription is confirmed
+"""
+import uasyncio as asyncio
+import binascii
+import json
+import os
+import random
+import socket
+import ssl
+import sys
+from config import Config
+from network_worker import network_worker
+
+OP_CONTINUATION = 0x0
+OP_TEXT = 0x1
+OP_BINARY = 0x2
+OP_CLOSE = 0x8
+OP_PING = 0x9
+OP_PONG = 0xA
+
+class WebSocket:
+    """A minimal RFC 6455 client over uasyncio streams (client frames are masked, as the RFC requires)"""
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+
+    @staticmethod
+    async def connect(uri, origin=None):
+        scheme, rest = uri.split("://", 1)
+        host_port, _, path = rest.partition("/")
+        path = "/" + path
+        use_tls = scheme == "wss"
+        if ":" in host_port:
+            host, port = host_port.split(":")
+            port = int(port)
+        else:
+            host = host_port
+            port = 443 if use_tls else 80
+
+        # open_connection() resolves the host on the event loop, which blocks every task for the whole
+        # DNS timeout when the lookup can't get through, so it is resolved on the network worker instead
+        ip = await network_worker.call(WebSocket._resolve, host, port)
+        if use_tls:
+            context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+            context.verify_mode = ssl.CERT_NONE
+            reader, writer = await asyncio.open_connection(ip, port, ssl=context, server_hostname=host)
+        else:
+            reader, writer = await asyncio.open_connection(ip, port)
+
+        key = binascii.b2a_base64(os.urandom(16))[:-1].decode()
+        request = (
+            f"GET {path} HTTP/1.1\r\n"
+            f"Host: {host}\r\n"
+            "Upgrade: websocket\r\n"
+            "Connection: Upgrade\r\n"
+            f"Sec-WebSocket-Key: {key}\r\n"
+            "Sec-WebSocket-Version: 13\r\n"
+            "Sec-WebSocket-Protocol: actioncable-v1-json\r\n"
+        )
+        if origin:
+            request += f"Origin: {origin}\r\n"
+        writer.write((request + "\r\n").encode())
+        await writer.drain()
+
+        status_line = await reader.readline()
+        if b" 101 " not in status_line:
+            writer.close()
+            raise OSError(f"WebSocket upgrade failed: {status_line}")
+        while True:
+            line = await reader.readline()
+            if not line or line == b"\r\n":
+                break
+        return WebSocket(reader, writer)
+
+    @staticmethod
+    def _resolve(host, port):
+        """The IP address of host, as a string (blocking, so it runs on the network worker)"""
+        return socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)[0][-1][0]
+
+    async def send(self, payload, opcode=OP_TEXT):
+        if isinstance(payload, str):
+            payload = payload.encode()
+        length = len(payload)
+        header = bytearray([0x80 | opcode])
+        if length < 126:
+            header.append(0x80 | length)
+        elif length < 65536:
+            header.append(0x80 | 126)
+            header.extend(length.to_bytes(2, "big"))
+        else:
+            header.append(0x80 | 127)
+            header.extend(length.to_bytes(8, "big"))
+        mask = os.urandom(4)
+        header.extend(mask)
+        masked = bytearray(payload)
+        for i in range(length):
+            masked[i] ^= mask[i & 3]
+        self.writer.write(header)
+        self.writer.write(masked)
+        await self.writer.drain()
+
+    async def receive(self):
+        """
+        Return the next (opcode, payload) message, reassembling fragmented messages.
+        Control frames are returned as they arrive.
+        """
+        message_opcode = None
+        message = None
+        while True:
+            header = await self.reader.readexactly(2)
+            fin = header[0] & 0x80
+            opcode = header[0] & 0x0F
+            length = header[1] & 0x7F
+            if length == 126:
+                length = int.from_bytes(await self.reader.readexactly(2), "big")
+            elif length == 127:
+                length = int.from_bytes(await self.reader.readexactly(8), "big")
+            mask = await self.reader.readexactly(4) if header[1] & 0x80 else None
+            payload = await self.reader.readexactly(length) if length else b""
+            if mask:
+                payload = bytearray(payload)
+                for i in range(length):
+                    payload[i] ^= mask[i & 3]
+
+            if opcode >= OP_CLOSE:
+                return opcode, payload
+            if opcode != OP_CONTINUATION:
+                message_opcode = opcode
+                message = payload
+            else:
+                message += payload
+            if fin:
+                return message_opcode, message
+
+    async def close(self):
+        try:
+            await self.send(b"", OP_CLOSE)
+        except Exception:
+            pass
+        self.writer.close()
+        try:
+            await self.writer.wait_closed()
+        except Exception:
+            pass
+
+class TimerChannel:
+    def __init__(self, uri, short_code, device_id, on_timer_update, on_connected=None):
+        """
+        Args:
+          uri (str): The ActionCable endpoint, e.g. Config.WEBSOCKET_URI
+          short_code (str): The device short code the timer channel is keyed on
+          device_id (str): This device's ID
+          on_timer_update (callable): Called with the timer dict whenever the server pushes one
+          on_connected (callable): Called each time the subscription is confirmed, so missed updates can be fetched
+        """
+        self.uri = uri
+        self.identifier = json.dumps({
+            "channel": Config.WEBSOCKET_TIMER_CHANNEL,
+            "short_code": short_code.upper(),
+            "device_id": device_id,
+        })
+        self.on_timer_update = on_timer_update
+        self.on_connected = on_connected
+        self.connected = False
+        self.backoff_sec = Config.WEBSOCKET_MIN_BACKOFF_SEC
+        self.updates_received = 0
+        self.reconnects = 0
+
+    async def run(self):
+        """Keep the channel connected forever, backing off between failed attempts"""
+        while True:
+            try:
+                await self._connect_and_listen()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"[CABLE] Connection lost: {repr(e)}")
+            self.connected = False
+            self.reconnects += 1
+            delay = self.backoff_sec * (0.5 + random.random() / 2)
+            print(f"[CABLE] Reconnecting in {delay:.1f}s")
+            await asyncio.sleep(delay)
+            self.backoff_sec = min(self.backoff_sec * 2, Config.WEBSOCKET_MAX_BACKOFF_SEC)
+
+    async def _connect_and_listen(self):
+        print(f"[CABLE] Connecting to {self.uri}")
+        websocket = await asyncio.wait_for(WebSocket.connect(self.uri, Config.API_BASE_URL), Config.WEBSOCKET_STALE_SEC)
+        try:
+            while True:
+                opcode, payload = await asyncio.wait_for(websocket.receive(), Config.WEBSOCKET_STALE_SEC)
+                if opcode == OP_PING:
+                    await websocket.send(payload, OP_PONG)
+                elif opcode == OP_CLOSE:
+                    print("[CABLE] Server closed the connection")
+                    return
+                elif opcode == OP_TEXT:
+                    await self._handle_message(websocket, json.loads(payload))
+        finally:
+            self.connected = False
+            await websocket.close()
+
+    async def _handle_message(self, websocket, message):
+        message_type = message.get("type")
+        if message_type == "ping":
+            return
+        if message_type == "welcome":
+            await websocket.send(json.dumps({"command": "subscribe", "identifier": self.identifier}))
+        elif message_type == "confirm_subscription":
+            print("[CABLE] Subscribed to timer channel")
+            self.connected = True
+            self.backoff_sec = Config.WEBSOCKET_MIN_BACKOFF_SEC
+            if self.on_connected:
+                self.on_connected()
+        elif message_type == "reject_subscription":
+            raise OSError("timer channel subscription rejected")
+        elif message_type == "disconnect":
+            raise OSError(f"server requested disconnect: {message.get('reason')}")
+        elif "message" in message:
+            # Pushed timers arrive either bare or wrapped as {"timer": {...}}
+            timer_data = message["message"]
+            timer_data = timer_data.get("timer", timer_data)
+            if "end_time" in timer_data:
+                self.updates_received += 1
+                print(f"[CABLE] Timer pushed: {timer_data}")
+                try:
+                    self.on_timer_update(timer_data)
+                except Exception as e:
+                    print(f"[CABLE] Error applying pushed timer: {e}")
+                    sys.print_exception(e)
@@ -1,110 +1,375 @@
-from urequests import get, post
 import json
 import utime
 import time
-import os
 import sys
+import socket
+import ssl
 from config import Config
-import ntptime
+import network
+from time_sync import time_sync
+from press_journal import press_journal
+from timer_cache import timer_cache
 from memory import print_memory_usage
 
+# 4xx statuses that mean "try again later" rather than "this request will never succeed"
+_TRANSIENT_STATUSES = (408, 429)
+
+class HttpResponse:
+    """The parts of a urequests-style response that the API uses"""
+    def __init__(self, status_code, headers, content):
+        self.status_code = status_code
+        self.headers = headers
+        # A memoryview into the client's receive buffer: only valid until the next request
+        self.content = content
+
+    def header(self, name):
+        """Case-insensitive header lookup"""
+        name = name.lower()
+        for key in self.headers:
+            if key.lower() == name:
+                return self.headers[key]
+        return None
+
+    @property
+    def text(self):
+        return str(bytes(self.content), "utf-8")
+
+    def json(self):
+        return json.loads(bytes(self.content))
+
+class HttpClient:
+    """
+    Minimal HTTP/1.1 client that keeps one keep-alive connection to the API server open across polls.
+
+    Opening a connection means DNS, TCP and a full TLS handshake, which takes several hundred ms and
+    tens of KB of heap on the ESP32, so the socket is reused for as long as the server keeps it open.
+    When it has to be reopened, the TLS session is resumed if the ssl module supports it.
+    Response bodies are read into one preallocated buffer.
+    """
+    def __init__(self, base_url):
+        scheme, host_port = base_url.split("://", 1)
+        host_port = host_port.split("/", 1)[0]
+        self.use_tls = scheme == "https"
+        if ":" in host_port:
+            self.host, port = host_port.split(":")
+            self.port = int(port)
+        else:
+            self.host = host_port
+            self.port = 443 if self.use_tls else 80
+        self.sock = None
+        self.address = None
+        self.tls_context = None
+        self.tls_session = None
+        self.buffer = bytearray(Config.HTTP_RECV_BUFFER_SIZE)
+        self.buffer_view = memoryview(self.buffer)
+        self.metrics = {
+            "requests": 0,
+            "bytes_sent": 0,
+            "bytes_received": 0,
+            "connections": 0,
+            "full_handshakes": 0,
+            "resumed_handshakes": 0,
+            "handshakes_avoided": 0,
+            "total_latency_ms": 0,
+            "max_latency_ms": 0,
+            "last_latency_ms": 0,
+        }
+
+    def get(self, path, headers=None):
+        """GET path on the API server. Retries once on a fresh connection if the kept-alive one has gone stale."""
+        return self.request("GET", path, headers)
+
+    def post(self, path, body, headers=None):
+        """
+        POST body to path. body is either bytes, or a function returning an iterator of byte chunks
+        which is sent with chunked transfer encoding (so large bodies never have to be built in memory).
+        """
+        return self.request("POST", path, headers, body)
+
+    def request(self, method, path, headers=None, body=None):
+        start = utime.ticks_ms()
+        reused = self.sock is not None
+        try:
+            response = self._request(method, path, headers, body)
+        except Exception as e:
+            # Whatever went wrong, the socket may be partway through a response, so it can't be reused
+            self.close()
+            if not reused or not isinstance(e, OSError):
+                raise
+            print(f"[HTTP] Kept-alive connection failed ({e}), reconnecting")
+            reused = False
+            try:
+                response = self._request(method, path, headers, body)
+            except Exception:
+                self.close()
+                raise
+
+        latency = utime.ticks_diff(utime.ticks_ms(), start)
+        metrics = self.metrics
+        metrics["requests"] += 1
+        if reused:
+            metrics["handshakes_avoided"] += 1
+        metrics["last_latency_ms"] = latency
+        metrics["total_latency_ms"] += latency
+        if latency > metrics["max_latency_ms"]:
+            metrics["max_latency_ms"] = latency
+        return response
+
+    def close(self):
+        if self.sock:
+            try:
+                self.sock.close()
+            except OSError:
+                pass
+            self.sock = None
+
+    def _connect(self):
+        if self.address is None:
+            self.address = socket.getaddrinfo(self.host, self.port, 0, socket.SOCK_STREAM)[0][-1]
+        sock = socket.socket()
+        sock.settimeout(Config.HTTP_TIMEOUT_SEC)
+        try:
+            sock.connect(self.address)
+        except OSError:
+            # The server may have moved, resolve it again next time
+            self.address = None
+            sock.close()
+            raise
+        if self.use_tls:
+            sock = self._wrap_tls(sock)
+        self.sock = sock
+        self.metrics["connections"] += 1
+
+    def _wrap_tls(self, sock):
+        if self.tls_context is None:
+            self.tls_context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+            self.tls_context.verify_mode = ssl.CERT_NONE
+        context = self.tls_context
+        if self.tls_session is not None:
+            try:
+                tls_sock = context.wrap_socket(sock, server_hostname=self.host, session=self.tls_session)
+                self.metrics["resumed_handshakes"] += 1
+                return tls_sock
+            except TypeError:
+                # This ssl module can't resume sessions
+                self.tls_session = None
+        tls_sock = context.wrap_socket(sock, server_hostname=self.host)
+        self.metrics["full_handshakes"] += 1
+        self.tls_session = getattr(tls_sock, "session", None)
+        return tls_sock
+
+    def _request(self, method, path, request_headers=None, body=None):
+        if self.sock is None:
+            self._connect()
+        sock = self.sock
+        request = f"{method} {path} HTTP/1.1\r\nHost: {self.host}\r\nConnection: keep-alive\r\n"
+        if request_headers:
+            for name, value in request_headers.items():
+                request += f"{name}: {value}\r\n"
+        if body is None:
+            pass
+        elif callable(body):
+            request += "Transfer-Encoding: chunked\r\n"
+        else:
+            request += f"Content-Length: {len(body)}\r\n"
+        request = (request + "\r\n").encode()
+        sock.write(request)
+        sent = len(request)
+        if body is None:
+            pass
+        elif callable(body):
+            for chunk in body():
+                if chunk:
+                    size_line = b"%x\r\n" % len(chunk)
+                    sock.write(size_line)
+                    sock.write(chunk)
+                    sock.write(b"\r\n")
+                    sent += len(size_line) + len(chunk) + 2
+            sock.write(b"0\r\n\r\n")
+            sent += 5
+        else:
+            sock.write(body)
+            sent += len(body)
+        self.metrics["bytes_sent"] += sent
+
+        status_line = sock.readline()
+        if not status_line:
+            raise OSError("connection closed by server")
+        received = len(status_line)
+        status_code = int(status_line.split(None, 2)[1])
+
+        headers = {}
+        while True:
+            line = sock.readline()
+            received += len(line)
+            if not line or line == b"\r\n":
+                break
+            name, _, value = str(line, "utf-8").partition(":")
+            headers[name.strip()] = value.strip()
+
+        lower_headers = {name.lower(): value for name, value in headers.items()}
+        if status_code // 100 == 1 or status_code in (204, 304):
+            # Never has a body, although a 304 may carry the Content-Length of the full representation
+            content = self.buffer_view[:0]
+        elif lower_headers.get("transfer-encoding", "").lower() == "chunked":
+            content = self._read_chunked(sock)
+        else:
+            content = self._read_exact(sock, int(lower_headers.get("content-length", 0)))
+
+        self.metrics["bytes_received"] += received + len(content)
+
+        if lower_headers.get("connection", "").lower() == "close":
+            self.close()
+        return HttpResponse(status_code, headers, content)
+
+    def _read_into(self, sock, view):
+        """Fill view completely from the socket"""
+        read = 0
+        while read < len(view):
+            count = sock.readinto(view[read:])
+            if not count:
+                raise OSError("connection closed mid-body")
+            read += count
+
+    def _read_exact(self, sock, length):
+        if length <= len(self.buffer):
+            view = self.buffer_view[:length]
+            self._read_into(sock, view)
+            return view
+        # Larger than the preallocated buffer: fall back to a one-off allocation
+        content = bytearray(length)
+        self._read_into(sock, memoryview(content))
+        return memoryview(content)
+
+    def _read_chunked(self, sock):
+        content = self.buffer
+        length = 0
+        while True:
+            size = int(sock.readline().split(b";")[0].strip(), 16)
+            if size == 0:
+                # Skip any trailers up to the blank line
+                while sock.readline() not in (b"\r\n", b""):
+                    pass
+                return memoryview(content)[:length]
+            if length + size > len(content):
+                grown = bytearray(length + size)
+                grown[:length] = content[:length]
+                content = grown
+            self._read_into(sock, memoryview(content)[length:length + size])
+            length += size
+            sock.readline()
+
+    def print_metrics(self):
+        m = self.metrics
+        average = m["total_latency_ms"] // m["requests"] if m["requests"] else 0
+        print(f"[HTTP] requests={m['requests']} sent={m['bytes_sent']}B received={m['bytes_received']}B connections={m['connections']} full handshakes={m['full_handshakes']} resumed={m['resumed_handshakes']} handshakes avoided={m['handshakes_avoided']} latency avg={average}ms max={m['max_latency_ms']}ms last={m['last_latency_ms']}ms")
+
+# Shared by every API instance so the kept-alive connection outlives them
+http_client = HttpClient(Config.API_BASE_URL)
+
 class API:
     def __init__(self):
         self.base_url = Config.API_BASE_URL
-        self.timer_cache_file = Config.TIMER_JSON_FILE
-        self.offline_presses_file = Config.OFFLINE_PRESSES_FILE
+        self.http = http_client
+        self.not_modified_count = 0
+        self.timer_writes_avoided = 0
+        # Set while the server is turning the press batch down, to when it may be sent again
+        self.press_sync_retry_ticks = None
+        self.press_sync_backoff_sec = Config.PRESS_SYNC_MIN_BACKOFF_SEC
 
     def register_device(self, device_id, short_code):
         """
         Register a device with the API using a short code.
         Returns True if registration successful, False otherwise.
         """
-        # Save the short code to the file
+        # Save the short code straight to flash, provisioning may be followed by a reset
         self.save_timer_data({"short_code": short_code}, preserve_token=False)
+        timer_cache.flush()
         return True
 
     @staticmethod
     def clear_cache():
         """Clear the timer data from the API"""
-        try:
-            os.remove(Config.TIMER_JSON_FILE)
-        except:
-            pass
+        timer_cache.clear()
 
     def timer_pressed(self, short_code):
-        """Handle timer press events, storing offline if no connection"""
+        """
+        Send a timer press to the server, storing it offline if there is no connection or the request fails.
+        The cached timer has already been restarted locally by the countdown.
+        """
         try:    
             print(f"[API] Timer pressed for {short_code}")
             
             # Check if we have internet connection
-            if not self._sync_time():
+            if not self.is_online():
                 print("[API] No internet connection - storing press offline")
                 self._store_offline_press()
-                
-                # Update local timer data
-                current_timer = self.get_cached_timer() or {}
-                current_timer['start_time'] = time.time()
-                self.save_timer_data(current_timer, preserve_token=True)
                 return
                 
             # If we have connection, process normally
-            url = f"{self.base_url}/api/device/restart/{short_code.upper()}"
-            print(f"[API] URL: {url}")
-            response = get(url)
+            path = f"/api/device/restart/{short_code.upper()}"
+            print(f"[API] URL: {self.base_url}{path}")
+            response = self.http.get(path)
+            self._apply_server_time(response)
             print(f"[API] Response: {response.text}")
+            if response.status_code >= 500 or response.status_code in _TRANSIENT_STATUSES:
+                print("[API] Server error - storing press offline")
+                self._store_offline_press()
+            elif response.status_code >= 400:
+                # Retrying would only be turned down again
+                print(f"[API] Press rejected ({response.status_code}), not retrying")
             
         except Exception as e:
             print(f"[API] Error handling timer press: {e}")
             sys.print_exception(e)
+            self._store_offline_press()
 
     def _store_offline_press(self):
-        """Store the current time in the offline presses file"""
+        """Append the current time to the offline press journal"""
         try:
-            current_time = time.time()
-            offline_presses = self._load_offline_presses()
-            offline_presses.append(current_time)
-            
-            with open(self.offline_presses_file, 'w') as f:
-                json.dump(offline_presses, f)
-                
+            seq = press_journal.append(time.time())
+            print(f"[API] Stored offline press #{seq} ({len(press_journal)} waiting to sync)")
         except Exception as e:
             print(f"[API] Error storing offline press: {e}")
             sys.print_exception(e)
 
-    def _load_offline_presses(self):
-        """Load the list of offline presses from file"""
-        try:
-            with open(self.offline_presses_file, 'r') as f:
-                return json.load(f)
-        except:
-            return []
-
     def _sync_offline_presses(self, short_code):
-        """Sync any stored offline presses with the API"""
-        return
-        try:
-            if not os.stat(self.offline_presses_file):
-                return
-        except OSError:
-            return False
-        
+        """
+        Upload every press in the offline journal in one batched request, then drop them from the journal.
+        The journal is only truncated once the server has acknowledged the batch with a 2xx.
+
+        Returns False if the upload failed in a way that may clear up (no connection, a 5xx, 408 or 429),
+        so the caller keeps the locally restarted timer. Any other 4xx keeps the presses and backs off
+        before sending them again; meanwhile this returns True so polling carries on with the server's timer.
+        """
+        last_seq = press_journal.last_seq()
+        if last_seq is None:
+            return True
+        if self.press_sync_retry_ticks is not None:
+            if utime.ticks_diff(self.press_sync_retry_ticks, utime.ticks_ms()) > 0:
+                return True
+            self.press_sync_retry_ticks = None
+
         try:
-            offline_presses = self._load_offline_presses()
-            if not offline_presses:
-                return
-                
-            print(f"[API] Syncing {len(offline_presses)} offline presses")
-            
-            for press_time in offline_presses:
-                url = f"{self.base_url}/api/device/restart/{short_code}?time={press_time}"
-                print(f"[API] Syncing offline press: {url}")
-                response = get(url)
-                if response.status_code != 200:
-                    print(f"[API] Error syncing offline press: {response.text}")
-                    return False
-                    
-            # All presses synced successfully, remove the file
-            os.remove(self.offline_presses_file)
+            print(f"[API] Syncing {len(press_journal)} offline presses")
+            path = f"/api/device/{short_code.upper()}/presses"
+            response = self.http.post(path, self._offline_presses_body, {"Content-Type": "application/json"})
+            self._apply_server_time(response)
+            if 400 <= response.status_code < 500 and response.status_code not in _TRANSIENT_STATUSES:
+                print(f"[API] Offline presses rejected: {response.status_code}, keeping them and retrying in {self.press_sync_backoff_sec}s")
+                self.press_sync_retry_ticks = utime.ticks_add(utime.ticks_ms(), self.press_sync_backoff_sec * 1000)
+                self.press_sync_backoff_sec = min(self.press_sync_backoff_sec * 2, Config.PRESS_SYNC_MAX_BACKOFF_SEC)
+                return True
+            if response.status_code not in (200, 201, 204):
+                print(f"[API] Error syncing offline presses: {response.status_code} {response.text}")
+                return False
+
+            # The server may acknowledge fewer presses than were sent
+            if response.status_code != 204 and len(response.content):
+                last_seq = min(last_seq, response.json().get("last_seq", last_seq))
+            press_journal.acknowledge(last_seq)
+            self.press_sync_backoff_sec = Config.PRESS_SYNC_MIN_BACKOFF_SEC
+            print(f"[API] Offline presses synced up to #{last_seq}")
             return True
             
         except Exception as e:
@@ -112,6 +377,26 @@ class API:
             sys.print_exception(e)
             return False
 
+    def _offline_presses_body(self):
+        """
+        Stream the journal as {"presses": [{"seq": 0, "time": "2024-11-16T10:33:20Z"}, ...]}
+        a batch of records at a time, so thousands of presses never sit in memory at once.
+        """
+        yield b'{"presses":['
+        batch = []
+        first = True
+        for seq, timestamp in press_journal.records():
+            t = utime.gmtime(timestamp)
+            batch.append('%s{"seq":%d,"time":"%04d-%02d-%02dT%02d:%02d:%02dZ"}' % (
+                "" if first else ",", seq, t[0], t[1], t[2], t[3], t[4], t[5]))
+            first = False
+            if len(batch) >= Config.PRESS_SYNC_CHUNK_RECORDS:
+                yield "".join(batch).encode()
+                batch = []
+        if batch:
+            yield "".join(batch).encode()
+        yield b"]}"
+
     def get_timer_for_device(self, device_id, short_code):
         """
         Fetch timer details from the API for the given device ID.
@@ -120,23 +405,40 @@ class API:
         Example JSON response from API:
 
         {"timer_id":1,"name":"Tablet Reminder","start_time":"2024-11-16T09:44:50Z","end_time":"2024-11-17T05:44:50Z"}
+
+        The request is conditional on the ETag/Last-Modified validators stored with the cached timer.
+        On a 304 the cached timer is returned without parsing any JSON or writing to flash.
         """
         print(f"[API] Fetching timer for device {short_code}")
-        if not self._sync_time():
+        if not self.is_online():
             print("[API] No internet connection - cannot fetch timer")
             return None
+        time_sync.sync_if_needed()
             
         try:
             # First sync any offline presses
-            self._sync_offline_presses(short_code)
+            cached_timer = self.get_cached_timer() or {}
+            if not self._sync_offline_presses(short_code) and cached_timer:
+                # The server's timer doesn't include those presses yet, so the local restart still wins
+                # until the sync gets through
+                print("[API] Offline presses not synced - using cached timer")
+                return cached_timer
             
-            url = f"{self.base_url}/api/device/{short_code.upper()}?device_id={device_id}"
-            print(f"[API] URL: {url}")
-            response = get(url)
+            path = f"/api/device/{short_code.upper()}?device_id={device_id}"
+            print(f"[API] URL: {self.base_url}{path}")
+            response = self.http.get(path, self._conditional_headers(cached_timer))
+            self._apply_server_time(response)
+            self.http.print_metrics()
             
-            if response.status_code == 200:
+            if response.status_code == 304:
+                self.not_modified_count += 1
+                self.timer_writes_avoided += 1
+                print(f"[API] Timer not modified ({self.not_modified_count} unchanged responses, {self.timer_writes_avoided} flash writes avoided)")
+                return cached_timer
+            elif response.status_code == 200:
                 timer_data = response.json()
                 print(f"[API] JSON response: {timer_data}")
+                self._store_validators(timer_data, response)
                 self.save_timer_data(timer_data, preserve_token=True)
                 return timer_data
             elif response.status_code == 404:
@@ -151,40 +453,42 @@ class API:
             print_memory_usage()
             return None
     
-    def _sync_time(self):
-        """
-        Synchronize ESP32's time with NTP server.
-        Returns True if successful, False if failed.
-        """
-        try:
-            ntptime.settime()
-            return True
-        except Exception as e:
-            print(f"[API] Failed to sync time: {e}")
-            return False
+    def is_online(self):
+        """Cheap connectivity check: is the WiFi station connected? (Time sync is handled by time_sync.)"""
+        return network.WLAN(network.STA_IF).isconnected()
+
+    def _apply_server_time(self, response):
+        """Feed the server's Date header to the time sync service, saving an NTP round trip"""
+        time_sync.apply_http_date(response.header("Date"))
+
+    def _conditional_headers(self, cached_timer):
+        """If-None-Match / If-Modified-Since headers for the cached timer, if we have a complete one"""
+        headers = {}
+        if "end_time" not in cached_timer:
+            return headers
+        if "etag" in cached_timer:
+            headers["If-None-Match"] = cached_timer["etag"]
+        if "last_modified" in cached_timer:
+            headers["If-Modified-Since"] = cached_timer["last_modified"]
+        return headers
+
+    def _store_validators(self, timer_data, response):
+        """Keep the response's validators with the timer so the next poll can be conditional"""
+        etag = response.header("ETag")
+        if etag:
+            timer_data["etag"] = etag
+        last_modified = response.header("Last-Modified")
+        if last_modified:
+            timer_data["last_modified"] = last_modified
     
     def save_timer_data(self, timer_data, preserve_token=False):
         """
-        Store timer data in local cache file
+        Store timer data in the local cache. It is written to flash later, and only if it changed.
         If preserve_token is True, existing token will be preserved
         """
-        try:
-            if preserve_token:
-                existing_data = self.get_cached_timer() or {}
-                if 'short_code' in existing_data:
-                    timer_data['short_code'] = existing_data['short_code']
-
+        if timer_cache.update(timer_data, preserve_short_code=preserve_token):
             print(f"[API] Saving timer data: {timer_data}")
-                
-            with open(self.timer_cache_file, 'w') as f:
-                json.dump(timer_data, f)
-        except Exception as e:
-            print(f"[API] Error caching timer data: {e}")
     
     def get_cached_timer(self):
         """Retrieve timer data from local cache"""
-        try:
-            with open(self.timer_cache_file, 'r') as f:
-                return json.load(f)
-        except:
-            return None 
+        return timer_cache.get()
@@ -1,4 +1,4 @@
-import time
+import uasyncio as asyncio
 from ble_device import BLEDevice
 from button import Button
 from wifi_connection import WifiConnection
@@ -9,7 +9,9 @@ from countdown_timer import CountdownTimer
 from device_id import DeviceID
 from api import API
 from soft_ap_provisioning import SoftAPProvisioning
+from timer_cache import timer_cache
 import gc
+import time
 from memory import print_memory_usage
 
 class Application:
@@ -19,9 +21,11 @@ class Application:
 
     def __init__(self):
         self.button = Button(Config.BUTTON_PIN, self._on_button_pressed)
-        self.wifi = WifiConnection(Config.WIFI_CREDENTIALS_FILE)
+        self.wifi = WifiConnection()
         self.led_controller = LedController()
         self.provisioning_mode = Config.DEFAULT_PROVISIONING_MODE
+        # Set by a soft or factory reset; a soft reset keeps the saved networks, so they can't tell us
+        self.provisioning_requested = False
         self._subscribe()
     
     def _subscribe(self):
@@ -31,38 +35,55 @@ class Application:
         """
         Main entry point that handles the application's connection flow:
         
-        1. Check if WiFi credentials exist
-        2. If credentials exist, attempt connection and start main loop regardless of result
-        3. If no credentials exist, enter provisioning mode
+        1. Check if WiFi credentials exist and no reset has asked for provisioning
+        2. If so, attempt connection and start main loop regardless of result
+        3. Otherwise, enter provisioning mode
         """
         while True:
             print_memory_usage()
-            if self.wifi.has_saved_credentials():
-                self.wifi.connect_and_monitor_connection()
-                self._start_countdown_timer()
+            if self.wifi.has_saved_credentials() and not self.provisioning_requested:
+                asyncio.run(self._run_countdown_timer())
+                asyncio.new_event_loop()
             else:
                 self._enter_wifi_provisioning_mode()
+                self.provisioning_requested = False
             gc.collect()
 
     def _on_button_pressed(self, duration):
+        """Called from the button IRQ, so events are only queued here and delivered by the main loop"""
         if duration > Config.FACTORY_RESET_DURATION_MS:
             print("[APP] Button is pressed! Factory reset! Entering Bluetooth provisioning mode")
             self.provisioning_mode = Config.PROVISIONING_MODE_BLE
-            event_bus.publish(Events.FACTORY_RESET_BUTTON_PRESSED)
+            self.provisioning_requested = True
+            event_bus.publish_deferred(Events.FACTORY_RESET_BUTTON_PRESSED)
             return
 
         if duration > Config.SOFT_RESET_DURATION_MS:
             print("[APP] Button is pressed! Soft reset! Entering SoftAP/Wifi provisioning mode")
             self.provisioning_mode = Config.PROVISIONING_MODE_SOFTAP
-            event_bus.publish(Events.SOFT_RESET_BUTTON_PRESSED)
+            self.provisioning_requested = True
+            event_bus.publish_deferred(Events.SOFT_RESET_BUTTON_PRESSED)
             return
 
         if duration < Config.BUTTON_TAP_DURATION_MS:
-            event_bus.publish(Events.BUTTON_TAPPED)
+            # Carries the release time so the tap-to-display latency can be measured
+            event_bus.publish_deferred(Events.BUTTON_TAPPED, time.ticks_ms())
 
-    def _start_countdown_timer(self):
+    async def _run_countdown_timer(self):
+        """
+        Run the countdown timer alongside the WiFi connection monitor until the timer is aborted
+        (e.g. by a WiFi reset). Both run as uasyncio tasks, so neither blocks the other.
+        """
         countdown_timer = CountdownTimer(DeviceID.get_id())
-        countdown_timer.start()
+        dispatcher_task = asyncio.create_task(event_bus.run_dispatcher())
+        wifi_task = asyncio.create_task(self.wifi.connect_and_monitor_connection())
+        flusher_task = asyncio.create_task(timer_cache.run_flusher())
+        try:
+            await countdown_timer.run()
+        finally:
+            flusher_task.cancel()
+            wifi_task.cancel()
+            dispatcher_task.cancel()
 
     def _enter_wifi_provisioning_mode(self):
         """
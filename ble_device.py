@@ -29,15 +29,19 @@ class BLEDevice:
 
     def __subscribe(self):
         # After sending wifi credentials, the user must tap the button to confirm within 10 seconds
-        event_bus.subscribe(Events.BUTTON_TAPPED, self._handle_button_tap)
+        self.button_tap_subscription = event_bus.subscribe(Events.BUTTON_TAPPED, self._handle_button_tap)
 
     def __unsubscribe(self):
-        event_bus.unsubscribe(Events.BUTTON_TAPPED, self._handle_button_tap)
+        event_bus.unsubscribe(self.button_tap_subscription)
     
     def await_wifi_credentials_then_disconnect(self):
+        last_status_time = time.ticks_ms()
         while not self.wifi_connected:
-            time.sleep(3)
-            self.show_status()
+            event_bus.dispatch_pending()
+            time.sleep_ms(100)
+            if time.ticks_diff(time.ticks_ms(), last_status_time) >= 3000:
+                last_status_time = time.ticks_ms()
+                self.show_status()
         print("[BLE] wifi connection established, disconnecting bluetooth...")
         time.sleep(1)
         self.disconnect()
@@ -50,7 +54,7 @@ class BLEDevice:
         event_bus.publish(Events.EXITING_PAIRING_MODE)
         print("[BLE] disconnected")
 
-    def _handle_button_tap(self):
+    def _handle_button_tap(self, pressed_ticks=None):
         if self.wifi_handler.handle_button_tap(self.handle_wifi_credentials):
             self.wifi_connected = True
         self.received_data = bytearray()
@@ -0,0 +1,50 @@
+"""
+Records how long each stage of boot takes, so time-to-first-frame can be tracked.
+
+Milestones are stamped with ticks_ms (milliseconds since reset). Each milestone is only recorded
+the first time it is reached. Once the first API refresh is done, the breakdown is printed:
+
+    [BOOT] imports                    +812ms    812ms
+    [BOOT] first frame                 +64ms    876ms
+    ...
+
+Example usage:
+
+    boot_timeline.mark("first frame")
+    boot_timeline.print_breakdown()
+"""
+import utime
+
+class BootTimeline:
+    def __init__(self):
+        self.marks = []
+        self.printed = False
+
+    def mark(self, name):
+        """Record a milestone, unless it has been recorded already or the breakdown has been printed"""
+        if self.printed:
+            return
+        for marked, _ in self.marks:
+            if marked == name:
+                return
+        self.marks.append((name, utime.ticks_ms()))
+
+    def elapsed(self, name):
+        """ms since reset at which a milestone was reached, or None"""
+        for marked, ticks in self.marks:
+            if marked == name:
+                return ticks
+        return None
+
+    def print_breakdown(self):
+        """Print every milestone with the time since the previous one. Only prints once."""
+        if self.printed:
+            return
+        self.printed = True
+        previous = 0
+        for name, ticks in sorted(self.marks, key=lambda mark: mark[1]):
+            print("[BOOT] %-24s %+6dms %6dms" % (name, utime.ticks_diff(ticks, previous), ticks))
+            previous = ticks
+
+# Global boot timeline
+boot_timeline = BootTimeline()
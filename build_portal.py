@@ -0,0 +1,124 @@
+"""
+Renders the captive portal pages in portal/ into portal_pages.py, gzip-compressed, so the device serves
+them straight from static byte strings. Runs on the computer, not the device: deploy.sh runs it before
+copying the code.
+
+Templates can use {{style}}, which becomes the versioned URL of portal/portal.css. Any other {{name}}
+is a slot filled in on the device for each response. The text between slots is compressed into separate
+deflate segments, each ending on a byte boundary, so the device can insert a value as a stored
+(uncompressed) block without recompressing anything. Each segment after a slot comes with a table that
+lets the device carry the gzip CRC32 across it without having the uncompressed text.
+
+Example usage:
+
+    python3 build_portal.py
+"""
+import binascii
+import os
+import re
+import struct
+import zlib
+
+SOURCE_DIR = "portal"
+OUTPUT_FILE = "portal_pages.py"
+
+# mtime 0 so builds are reproducible, XFL 2 (maximum compression), OS 255 (unknown)
+GZIP_HEADER = b"\x1f\x8b\x08\x00\x00\x00\x00\x00\x02\xff"
+SLOT = re.compile(r"{{(\w+)}}")
+
+HTML_HEAD = b"HTTP/1.1 200 OK\r\nContent-Type: text/html; charset=utf-8\r\nContent-Encoding: gzip\r\nVary: Accept-Encoding\r\nCache-Control: no-store\r\nConnection: close\r\n"
+# The stylesheet URL changes whenever its content does, so browsers can keep it for good
+STYLE_HEAD = b"HTTP/1.1 200 OK\r\nContent-Type: text/css\r\nContent-Encoding: gzip\r\nVary: Accept-Encoding\r\nCache-Control: public, max-age=31536000, immutable\r\nConnection: close\r\n"
+
+PAGES = (
+    # (constant name, template, response head)
+    ("CONFIG_PAGE", "config.html", HTML_HEAD),
+    ("SUCCESS_PAGE", "success.html", HTML_HEAD),
+    ("ERROR_PAGE", "error.html", HTML_HEAD),
+)
+
+def read_template(name):
+    with open(os.path.join(SOURCE_DIR, name)) as f:
+        lines = [line.strip() for line in f]
+    # Indentation is only there for whoever edits the template
+    return "\n".join(line for line in lines if line) + "\n"
+
+def deflate(data, last):
+    compressor = zlib.compressobj(9, zlib.DEFLATED, -15, 9)
+    return compressor.compress(data) + compressor.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+
+def crc_fold(data):
+    """
+    binascii.crc32(data, crc) is affine in crc, so it is the constant crc32(data, 0) XOR one column per
+    set bit of crc. The device uses these 33 numbers to run the CRC over data it doesn't have.
+    """
+    constant = binascii.crc32(data, 0)
+    return constant, tuple(binascii.crc32(data, 1 << bit) ^ constant for bit in range(32))
+
+def render(template, style_path):
+    """(segments, static size, CRC of the first segment, CRC folds, slot names) for the template"""
+    text = template.replace("{{style}}", style_path)
+    parts = SLOT.split(text)
+    static = [part.encode() for part in parts[0::2]]
+    slots = parts[1::2]
+    if not slots:
+        data = static[0]
+        member = GZIP_HEADER + deflate(data, True) + struct.pack("<II", binascii.crc32(data), len(data))
+        return (member,), len(data), 0, (), slots
+    segments = [GZIP_HEADER + deflate(static[0], False)]
+    for index, data in enumerate(static[1:], 1):
+        segments.append(deflate(data, index == len(static) - 1))
+    folds = tuple(crc_fold(data) for data in static[1:])
+    return tuple(segments), sum(len(data) for data in static), binascii.crc32(static[0]), folds, slots
+
+def bytes_literal(data, indent):
+    """A bytes literal split over lines of 32 bytes, so diffs of the generated file stay readable"""
+    if len(data) <= 32:
+        return repr(data)
+    lines = [repr(data[offset:offset + 32]) for offset in range(0, len(data), 32)]
+    return "(\n" + "".join(f"{indent}    {line}\n" for line in lines) + indent + ")"
+
+def page_source(name, head, rendered):
+    segments, size, crc, folds, slots = rendered
+    lines = [
+        "",
+        f"# Slots: {', '.join(slots) if slots else 'none'}",
+        f"{name} = (",
+        f"    {head!r},",
+        "    (",
+    ]
+    lines += [f"        {bytes_literal(segment, '        ')}," for segment in segments]
+    lines += ["    ),", f"    {size},", f"    {crc},"]
+    if folds:
+        lines.append("    (")
+        lines += [f"        ({constant}, {columns!r})," for constant, columns in folds]
+        lines.append("    ),")
+    else:
+        lines.append("    (),")
+    lines.append(")")
+    return lines
+
+def main():
+    style = read_template("portal.css")
+    style_path = f"/portal.css?v={binascii.crc32(style.encode()):08x}"
+
+    out = [
+        '"""',
+        "Captive portal pages, gzip-compressed. Generated by build_portal.py from portal/, do not edit.",
+        "",
+        "Each page is (response head, deflate segments, uncompressed static size, CRC32 of the first",
+        "segment, CRC folds for the segments after each slot). See SoftAPProvisioning._send_page.",
+        '"""',
+        "",
+        f"STYLE_PATH = {style_path.encode()!r}",
+    ]
+    out += page_source("STYLE", STYLE_HEAD, render(style, style_path))
+    for name, template, head in PAGES:
+        out += page_source(name, head, render(read_template(template), style_path))
+
+    with open(OUTPUT_FILE, "w") as f:
+        f.write("\n".join(out) + "\n")
+    print(f"Wrote {OUTPUT_FILE}")
+
+if __name__ == "__main__":
+    main()
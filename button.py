@@ -4,6 +4,7 @@ import time
 class Button:
     # This class is used to handle a button on the ESP32.
     # The on_press handler triggers when button is released, passing the duration held.
+    # on_press runs in IRQ context, so it must not block or allocate (use event_bus.publish_deferred).
     def __init__(self, pin, on_press):
         self.pin = Pin(pin, Pin.IN, Pin.PULL_DOWN)
         self.pin.irq(trigger=Pin.IRQ_FALLING | Pin.IRQ_RISING, handler=self._button_handler)
@@ -0,0 +1,129 @@
+"""
+DNS responder for the captive portal: every name resolves to the access point's own address.
+
+Phones fire a burst of lookups as soon as they join the access point, so every wakeup answers all the
+queries that are waiting (up to Config.SOFTAP_DNS_BURST). Each answer is built in a preallocated
+buffer: the query header and question are copied in, the flags and counts patched, and a precomputed
+record appended.
+
+A and ANY queries get an A record for the portal. Any other type (AAAA, HTTPS/SVCB...) gets an
+empty NOERROR answer with an SOA record, so the client caches the negative answer instead of
+retrying, and doesn't give up on the name the way it would after NXDOMAIN. Packets that aren't
+standard queries are answered with NOTIMP or FORMERR, and responses are dropped.
+
+Example usage:
+
+    dns = CaptiveDns(Config.SOFTAP_IP)
+    dns.open()
+    dns.handle_pending()        # whenever dns.sock is readable
+    dns.print_stats()
+"""
+import socket
+import struct
+from config import Config
+
+_HEADER_SIZE = 12
+_TYPE_A = 1
+_TYPE_ANY = 255
+_CLASS_IN = 1
+_RCODE_FORMERR = 1
+_RCODE_NOTIMP = 4
+
+class CaptiveDns:
+    def __init__(self, ip):
+        self.sock = None
+        ttl = Config.SOFTAP_DNS_TTL_SEC
+        # Answer records, with the owner name pointing back at the question's name (offset 12)
+        self._a_record = struct.pack(">HHHIH4B", 0xC00C, _TYPE_A, _CLASS_IN, ttl, 4, *map(int, ip.split(".")))
+        # Root MNAME and RNAME, then serial, refresh, retry, expire and the negative caching TTL
+        self._soa_record = struct.pack(">HHHIHBBIIIII", 0xC00C, 6, _CLASS_IN, ttl, 22, 0, 0, 1, ttl, ttl, ttl, ttl)
+        # Room for the largest query we read plus the record appended to it
+        self._buf = bytearray(Config.SOFTAP_DNS_BUFFER_BYTES + len(self._soa_record))
+        self._view = memoryview(self._buf)
+        self.queries = 0
+        self.answered = 0
+        self.empty = 0
+        self.rejected = 0
+
+    def open(self):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind(('0.0.0.0', 53))
+        self.sock.setblocking(False)
+
+    def close(self):
+        if self.sock:
+            self.sock.close()
+            self.sock = None
+
+    def handle_pending(self):
+        """Answer every query that is waiting, up to SOFTAP_DNS_BURST. Returns how many were read."""
+        count = 0
+        while count < Config.SOFTAP_DNS_BURST:
+            try:
+                data, addr = self.sock.recvfrom(Config.SOFTAP_DNS_BUFFER_BYTES)
+            except OSError:
+                # EAGAIN: nothing more waiting
+                break
+            count += 1
+            try:
+                length = self._build_response(data)
+                if length:
+                    self.sock.sendto(self._view[:length], addr)
+            except OSError as e:
+                print(f"[DNS] Error answering query: {e}")
+        return count
+
+    def _build_response(self, query):
+        """Build the response to query in the buffer. Returns its length, or 0 if nothing should be sent."""
+        length = len(query)
+        if length < _HEADER_SIZE or query[2] & 0x80:
+            # Too short to be a query, or a response
+            return 0
+        self.queries += 1
+        # The response starts as a copy of the query, with the header patched and a record appended
+        buf = self._buf
+        buf[0:length] = query
+        # QR and AA set, RD echoed, RA set (as clients expect of their resolver)
+        buf[2] = 0x84 | (query[2] & 0x01)
+        if (query[2] >> 3) & 0x0F:
+            return self._error(_RCODE_NOTIMP)
+        if query[4] or query[5] != 1:
+            return self._error(_RCODE_FORMERR)
+
+        # Walk the question's name, which must be plain labels (no compression in a question)
+        end = _HEADER_SIZE
+        while end < length and query[end]:
+            if query[end] & 0xC0:
+                return self._error(_RCODE_FORMERR)
+            end += query[end] + 1
+        end += 5
+        if end > length:
+            return self._error(_RCODE_FORMERR)
+        qtype = query[end - 4] << 8 | query[end - 3]
+        qclass = query[end - 2] << 8 | query[end - 1]
+
+        # Anything after the question (e.g. an EDNS record) is overwritten
+        if qclass == _CLASS_IN and (qtype == _TYPE_A or qtype == _TYPE_ANY):
+            self.answered += 1
+            return self._finish(end, self._a_record, 1, 0)
+        self.empty += 1
+        return self._finish(end, self._soa_record, 0, 1)
+
+    def _finish(self, end, record, answers, authorities):
+        buf = self._buf
+        buf[3] = 0x80
+        struct.pack_into(">HHHH", buf, 4, 1, answers, authorities, 0)
+        buf[end:end + len(record)] = record
+        return end + len(record)
+
+    def _error(self, rcode):
+        """A header-only response carrying rcode"""
+        self.rejected += 1
+        buf = self._buf
+        buf[3] = 0x80 | rcode
+        struct.pack_into(">HHHH", buf, 4, 0, 0, 0, 0)
+        return _HEADER_SIZE
+
+    def print_stats(self):
+        print(f"[DNS] queries={self.queries} answered={self.answered} empty={self.empty} rejected={self.rejected}")
@@ -5,12 +5,46 @@ class Config:
     # API settings
     API_BASE_URL = "https://timer.christopher-richards.net" if not DEVELOPMENT_MODE else "https://terrier-arriving-foal.ngrok-free.app"
     FETCH_TIMER_DATA_FROM_API_INTERVAL = 60
+    NETWORK_WORKER_STACK_SIZE = 16 * 1024
+    HTTP_RECV_BUFFER_SIZE = 2048
+    HTTP_TIMEOUT_SEC = 10
+
+    # Time sync settings
+    TIME_SYNC_MAX_ERROR_SEC = 2
+    TIME_SYNC_MAX_INTERVAL_SEC = 24 * 60 * 60
+    TIME_SYNC_RETRY_SEC = 30 * 60  # Wait after a failed NTP attempt, e.g. where UDP/123 is blocked
+    TIME_SYNC_DEFAULT_DRIFT_PPM = 50
+    TIME_SYNC_MIN_DRIFT_SAMPLE_SEC = 6 * 60 * 60
+    TIME_SYNC_NTP_ERROR_SEC = 0.5
+    TIME_SYNC_HTTP_DATE_ERROR_SEC = 1
+    TIME_SYNC_MIN_VALID_YEAR = 2024
+
+    # Countdown settings
+    COUNTDOWN_RESYNC_INTERVAL_MS = 60 * 60 * 1000
+    TICKER_EDGE_OFFSET_MS = 2
+    TICKER_REALIGN_INTERVAL_TICKS = 3600
+    TICKER_JITTER_SAMPLES = 256
+    TICKER_STATS_INTERVAL_TICKS = 600
     WEBSOCKET_URI = "wss://timer.christopher-richards.net/cable" if not DEVELOPMENT_MODE else "wss://terrier-arriving-foal.ngrok-free.app/cable"
+    WEBSOCKET_TIMER_CHANNEL = "DeviceTimerChannel"
+    WEBSOCKET_STALE_SEC = 15
+    WEBSOCKET_MIN_BACKOFF_SEC = 2
+    WEBSOCKET_MAX_BACKOFF_SEC = 300
     
     # WiFi settings
-    WIFI_RETRY_COUNT = 10
-    WIFI_RETRY_DELAY_SEC = 1
-    WIFI_CREDENTIALS_FILE = "wifi_credentials.json"
+    WIFI_CONNECT_TIMEOUT_MS = 15000
+    WIFI_FAST_CONNECT_TIMEOUT_MS = 4000
+    WIFI_POLL_INTERVAL_MS = 50
+    WIFI_MAX_NETWORKS = 5
+    WIFI_SCAN_CACHE_MS = 10000
+    # (ip, subnet, gateway, dns) to skip DHCP entirely, or None
+    WIFI_STATIC_IFCONFIG = None
+    # Reuse the last DHCP lease as a static address on the fast path. Saves the DHCP exchange, but can
+    # clash if the router has handed the address to someone else, so it is off by default.
+    WIFI_REUSE_DHCP_LEASE = False
+    WIFI_LINK_CHECK_INTERVAL_MS = 1000
+    WIFI_MIN_BACKOFF_MS = 1000
+    WIFI_MAX_BACKOFF_MS = 5 * 60 * 1000
     
     # BLE settings
     BLE_NAME_PREFIX = "ESP32_Device"
@@ -21,10 +55,15 @@ class Config:
     BLE_DEVICE_ID_UUID = "00002A1C-0000-1000-8000-00805F9B34FB"
     PROVISIONING_BUTTON_CONFIRMATION_DURATION_MS = 10000
 
-    # Device ID settings
+    # Persistent state
+    KV_STORE_FILE = "state.kv"
+    KV_STORE_COMPACT_BYTES = 4096
+    TIMER_CACHE_FLUSH_IDLE_MS = 5000
+    # Derive the device ID from machine.unique_id() instead of generating and saving a random one
+    DEVICE_ID_FROM_UNIQUE_ID = True
+    # Legacy JSON files, migrated into the KV store on first boot
+    WIFI_CREDENTIALS_FILE = "wifi_credentials.json"
     DEVICE_ID_FILE = "dev_id.json"
-
-    # API settings
     TIMER_JSON_FILE = "timer.json"
     
     # Pin configurations
@@ -43,14 +82,31 @@ class Config:
     SOFT_RESET_DURATION_MS = 3000
     BUTTON_TAP_DURATION_MS = 1000
 
+    # Event bus settings
+    EVENT_QUEUE_SIZE = 16
+    EVENT_BUS_PROFILING = False
+
     # SoftAP settings
     SOFTAP_IP = "192.168.4.1"
     SOFTAP_SUBNET = "255.255.255.0"
+    SOFTAP_MAX_CLIENTS = 8  # Connections served at once, more are closed straight away
+    SOFTAP_CLIENT_TIMEOUT_SEC = 5  # For a client to send its request and read the page
+    SOFTAP_REQUEST_BUFFER_BYTES = 1024  # Per client; holds the body and the header line being parsed
+    SOFTAP_SEND_CHUNK_BYTES = 1460  # One TCP segment at the usual MTU
+    SOFTAP_DNS_BUFFER_BYTES = 512  # The classic DNS over UDP limit
+    SOFTAP_DNS_BURST = 16  # Queries answered per wakeup before the web server gets a turn
+    SOFTAP_DNS_TTL_SEC = 60
+    SOFTAP_SCAN_TTL_MS = 30000  # How long a scan for the network picker is trusted
+    SOFTAP_SCAN_MAX_NETWORKS = 20
     
     # Provisioning mode selection
     PROVISIONING_MODE_BLE = "ble"
     PROVISIONING_MODE_SOFTAP = "softap"
     DEFAULT_PROVISIONING_MODE = PROVISIONING_MODE_SOFTAP
 
-    # Add new setting for offline presses file
-    OFFLINE_PRESSES_FILE = "offline_presses.json"
+    # Offline press journal
+    OFFLINE_PRESSES_FILE = "offline_presses.bin"
+    LEGACY_OFFLINE_PRESSES_FILE = "offline_presses.json"
+    PRESS_SYNC_CHUNK_RECORDS = 64
+    PRESS_SYNC_MIN_BACKOFF_SEC = 60  # After the server turns a batch down with a 4xx
+    PRESS_SYNC_MAX_BACKOFF_SEC = 6 * 60 * 60
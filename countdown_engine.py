@@ -0,0 +1,196 @@
+"""
+Keeps the days/hours/minutes/seconds of the countdown up to date without re-parsing or re-dividing every tick.
+
+The timer's ISO end time is parsed into an epoch once, when the timer data changes. After that the
+engine anchors the remaining seconds to ticks_ms and steps the fields by one second per tick (borrowing
+or carrying like an odometer). Steady-state ticks only update small ints on a preallocated record,
+so they allocate nothing.
+
+Example usage:
+
+    engine = CountdownEngine()
+    engine.set_end_time("2024-11-17T10:33:20Z")
+    if engine.update():
+        record = engine.record
+        if record.changed & TimeRecord.CHANGED_MINUTES:
+            ...
+"""
+import utime
+from config import Config
+from ticker import rtc_second_edge
+
+class TimeRecord:
+    """The countdown as it should be displayed. A single instance is reused for every tick."""
+    __slots__ = ('days', 'hours', 'minutes', 'seconds', 'type', 'changed')
+
+    # Bits set in `changed`. They accumulate until the consumer clears them, so a coalesced
+    # (skipped) TIME_CHANGED never loses a change.
+    CHANGED_SECONDS = 1
+    CHANGED_MINUTES = 2
+    CHANGED_HOURS = 4
+    CHANGED_DAYS = 8
+    CHANGED_TYPE = 16
+    CHANGED_ALL = 31
+
+    UNTIL = "until"
+    SINCE = "since"
+
+    def __init__(self):
+        self.days = 0
+        self.hours = 0
+        self.minutes = 0
+        self.seconds = 0
+        self.type = TimeRecord.UNTIL
+        self.changed = 0
+
+def parse_iso8601(value):
+    """
+    Parse an ISO 8601 timestamp such as '2024-11-17T10:33:20Z', '2024-11-17T10:33:20.123Z'
+    or '2024-11-17T11:33:20+01:00' (or +0100, +01) into seconds since the epoch
+    (UTC, the same clock as utime.time()).
+    """
+    timestamp = utime.mktime((
+        int(value[0:4]),
+        int(value[5:7]),
+        int(value[8:10]),
+        int(value[11:13]),
+        int(value[14:16]),
+        int(value[17:19]),
+        0, 0
+    ))
+
+    # Skip fractional seconds
+    index = 19
+    if index < len(value) and value[index] == '.':
+        index += 1
+        while index < len(value) and value[index].isdigit():
+            index += 1
+
+    zone = value[index:]
+    if zone and zone[0] in '+-':
+        # ±hh, ±hhmm or ±hh:mm
+        offset = int(zone[1:3]) * 3600
+        if len(zone) > 3:
+            offset += int(zone[-2:]) * 60
+        timestamp += -offset if zone[0] == '+' else offset
+    return timestamp
+
+def format_iso8601(timestamp):
+    """Format seconds since the epoch as an ISO 8601 UTC timestamp such as '2024-11-17T10:33:20Z'"""
+    t = utime.gmtime(timestamp)
+    return "%04d-%02d-%02dT%02d:%02d:%02dZ" % (t[0], t[1], t[2], t[3], t[4], t[5])
+
+class CountdownEngine:
+    def __init__(self):
+        self.record = TimeRecord()
+        self.end_time = None
+        self.end_time_str = None
+        self.remaining = 0
+        self._anchor_ticks = 0
+        self._anchor_remaining = 0
+
+    def set_end_time(self, end_time_str):
+        """Parse a new end time. Does nothing if it hasn't changed since the last call."""
+        if end_time_str == self.end_time_str:
+            return
+        self.end_time_str = end_time_str
+        self.end_time = parse_iso8601(end_time_str) if end_time_str else None
+        if self.end_time is not None:
+            self.sync()
+
+    def has_end_time(self):
+        return self.end_time is not None
+
+    def sync(self):
+        """Re-anchor to the RTC, e.g. after NTP has adjusted it, and recompute every field"""
+        if self.end_time is None:
+            return
+        # Anchor on the RTC second edge so the fields flip in step with the aligned Ticker
+        now, self._anchor_ticks = rtc_second_edge()
+        self._anchor_remaining = self.end_time - now
+        self.remaining = self._anchor_remaining
+        self._recompute()
+
+    def update(self):
+        """
+        Advance the record to the current time. Returns True if any field changed.
+        Normally this is a single one-second step; larger jumps (stalls) fall back to a full recompute.
+        """
+        if self.end_time is None:
+            return False
+        elapsed_ms = utime.ticks_diff(utime.ticks_ms(), self._anchor_ticks)
+        if elapsed_ms >= Config.COUNTDOWN_RESYNC_INTERVAL_MS:
+            # ticks_ms wraps, so re-anchor well before ticks_diff stops being valid
+            self.sync()
+            return True
+        remaining = self._anchor_remaining - elapsed_ms // 1000
+        steps = self.remaining - remaining
+        if steps == 0:
+            return False
+        self.remaining = remaining
+        if steps == 1:
+            self._step()
+        else:
+            self._recompute()
+        return True
+
+    def _recompute(self):
+        record = self.record
+        remaining = self.remaining
+        record.type = TimeRecord.UNTIL if remaining > 0 else TimeRecord.SINCE
+        remaining = abs(remaining)
+        record.days = remaining // 86400
+        record.hours = (remaining % 86400) // 3600
+        record.minutes = (remaining % 3600) // 60
+        record.seconds = remaining % 60
+        record.changed |= TimeRecord.CHANGED_ALL
+
+    def _step(self):
+        """Move the record on by one second: down while counting until the end time, up once past it"""
+        record = self.record
+        if self.remaining > 0:
+            self._decrement(record)
+        elif self.remaining == 0:
+            self._decrement(record)
+            record.type = TimeRecord.SINCE
+            record.changed |= TimeRecord.CHANGED_TYPE
+        else:
+            self._increment(record)
+
+    def _decrement(self, record):
+        record.changed |= TimeRecord.CHANGED_SECONDS
+        if record.seconds > 0:
+            record.seconds -= 1
+            return
+        record.seconds = 59
+        record.changed |= TimeRecord.CHANGED_MINUTES
+        if record.minutes > 0:
+            record.minutes -= 1
+            return
+        record.minutes = 59
+        record.changed |= TimeRecord.CHANGED_HOURS
+        if record.hours > 0:
+            record.hours -= 1
+            return
+        record.hours = 23
+        record.days -= 1
+        record.changed |= TimeRecord.CHANGED_DAYS
+
+    def _increment(self, record):
+        record.changed |= TimeRecord.CHANGED_SECONDS
+        if record.seconds < 59:
+            record.seconds += 1
+            return
+        record.seconds = 0
+        record.changed |= TimeRecord.CHANGED_MINUTES
+        if record.minutes < 59:
+            record.minutes += 1
+            return
+        record.minutes = 0
+        record.changed |= TimeRecord.CHANGED_HOURS
+        if record.hours < 23:
+            record.hours += 1
+            return
+        record.hours = 0
+        record.days += 1
+        record.changed |= TimeRecord.CHANGED_DAYS
@@ -1,117 +1,273 @@
-import time
+import uasyncio as asyncio
+import sys
+import utime
 from config import Config
 from api import API
+from network_worker import network_worker
 from event_bus import event_bus, Events
-import utime
-import sys
+from countdown_engine import CountdownEngine, parse_iso8601, format_iso8601
+from ticker import Ticker
+from action_cable import TimerChannel
 from timer_display import TimerDisplay
+from timer_cache import timer_cache
+from time_sync import time_sync
+from boot_timeline import boot_timeline
 
 class CountdownTimer:
     def __init__(self, device_id):
         self.device_id = device_id
         self.api = API()
         self.display = TimerDisplay()
-        self.abort = False
-        self.last_fetched_timer_data_from_api = 0  
+        self.abort_flag = asyncio.ThreadSafeFlag()
+        self.press_flag = asyncio.ThreadSafeFlag()
+        self.poll_now_flag = asyncio.ThreadSafeFlag()
+        self.timer_channel = None
+        self.engine = CountdownEngine()
+        self.ticker = Ticker(1000)
+        self._rtc_sets_seen = time_sync.rtc_sets
+        # Taps that have restarted the countdown locally but not yet reached the server
+        self.unsynced_presses = 0
+        self.last_press_latency_ms = None
+        self.max_press_latency_ms = 0
         self.timer_data = self.api.get_cached_timer()
-        self._fetch_timer_settings()
+        self._load_end_time()
+        # The cached countdown is only meaningful once the RTC has been set (after power loss it hasn't)
+        self.clock_valid = time_sync.rtc_is_set()
+        self.first_frame_shown = False
+        boot_timeline.mark("cached timer loaded")
         self._subscribe()
 
     def _subscribe(self):
-        event_bus.subscribe(Events.TIME_CHANGED, self._update_display)
-        event_bus.subscribe(Events.WIFI_RESET, self._abort_timer)
-        event_bus.subscribe(Events.BUTTON_TAPPED, self._restart_timer)
+        self.subscriptions = (
+            event_bus.subscribe(Events.TIME_CHANGED, self._update_display),
+            event_bus.subscribe(Events.WIFI_RESET, self._abort_timer),
+            event_bus.subscribe(Events.BUTTON_TAPPED, self._restart_timer),
+            event_bus.subscribe(Events.WIFI_CONNECTED, self._on_wifi_connected),
+        )
 
     def _unsubscribe(self):
-        event_bus.unsubscribe(Events.TIME_CHANGED, self._update_display)
-        event_bus.unsubscribe(Events.WIFI_RESET, self._abort_timer)
-        event_bus.unsubscribe(Events.BUTTON_TAPPED, self._restart_timer)
+        for handle in self.subscriptions:
+            event_bus.unsubscribe(handle)
 
     @staticmethod
     def clear_data():
         """Clear the timer data from the API - used during a factory reset"""
         API.clear_cache()
 
-    def start(self):
-        """Start the countdown timer"""
+    async def run(self):
+        """
+        Run the countdown timer until it is aborted.
+
+        Ticking, API polling and button press syncing run as separate tasks so that slow
+        network calls never hold up the once-per-second tick. Timer updates are pushed over the
+        ActionCable channel; the API is only polled while that channel is down.
+        """
         print("[Timer] Starting")
-        
+        self._show_first_frame()
+        tasks = [
+            asyncio.create_task(self._tick_loop()),
+            asyncio.create_task(self._poll_api_loop()),
+            asyncio.create_task(self._press_sync_loop()),
+        ]
+        if self.timer_data and "short_code" in self.timer_data:
+            self.timer_channel = TimerChannel(
+                Config.WEBSOCKET_URI,
+                self.timer_data["short_code"],
+                self.device_id,
+                self._on_timer_pushed,
+                self.poll_now_flag.set
+            )
+            tasks.append(asyncio.create_task(self.timer_channel.run()))
+        await self.abort_flag.wait()
+        for task in tasks:
+            task.cancel()
+        timer_cache.flush()
+        self._unsubscribe()
+        print("[Timer] Aborted")
+
+    async def _tick_loop(self):
         while True:
-            current_time = utime.time()
+            await self.ticker.wait()
+            self._tick()
+            if self.ticker.tick_count % Config.TICKER_STATS_INTERVAL_TICKS == 0:
+                self.ticker.print_stats()
+                timer_cache.print_stats()
 
-            if self.abort:
-                print("[Timer] Aborted")
-                self._unsubscribe()
-                break
-            
-            if "end_time" not in self.timer_data:
-                # The timer data has never been successfully loaded from the API,
-                # not even once. Try again every minute.
-                self._fetch_timer_settings()
-                time.sleep(60) 
-                continue
-            
-            # Check if it's time to update settings
-            if current_time - self.last_fetched_timer_data_from_api >= Config.FETCH_TIMER_DATA_FROM_API_INTERVAL:
+    async def _poll_api_loop(self):
+        """
+        Refresh the timer settings from the API every FETCH_TIMER_DATA_FROM_API_INTERVAL seconds while the
+        ActionCable channel is down, and once each time it (re)connects to pick up anything missed.
+        """
+        fetch_now = False
+        while True:
+            if fetch_now or not (self.timer_channel and self.timer_channel.connected):
                 print("[Timer] Fetching timer data from API")
-                self._fetch_timer_settings()
-                self.last_fetched_timer_data_from_api = current_time
-            
-            self._tick()
+                try:
+                    await self._fetch_timer_settings()
+                    await self._release_http_connection()
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    # e.g. a malformed end time; keep polling, the next response may be fine
+                    print(f"[Timer] Error polling the API: {e}")
+                    sys.print_exception(e)
+            try:
+                await asyncio.wait_for(self.poll_now_flag.wait(), Config.FETCH_TIMER_DATA_FROM_API_INTERVAL)
+                fetch_now = True
+            except asyncio.TimeoutError:
+                fetch_now = False
+
+    async def _release_http_connection(self):
+        """
+        Close the kept-alive API connection while updates are pushed over the channel, since polling has
+        stopped and it would only hold a second TLS session's worth of heap. The next request reopens it.
+        Closed on the network worker, which is the only thread that uses the socket.
+        """
+        if self.timer_channel and self.timer_channel.connected and self.api.http.sock is not None:
+            await network_worker.call(self.api.http.close)
+
+    def _on_wifi_connected(self):
+        """Refresh as soon as WiFi comes up, rather than waiting for the next poll"""
+        self.poll_now_flag.set()
+
+    def _on_timer_pushed(self, timer_data):
+        """Apply a timer pushed over the ActionCable channel straight away"""
+        if self.unsynced_presses:
+            # Sent before the server saw our press; the press sync fetches the reconciled timer
+            print("[Timer] Ignoring pushed timer until the button press is synced")
+            return
+        self.api.save_timer_data(timer_data, preserve_token=True)
+        self.timer_data = timer_data
+        self._load_end_time()
+
+    async def _press_sync_loop(self):
+        """
+        Reconcile button presses with the server: save the locally restarted timer, send the press,
+        then fetch the timer and let the server's version replace ours.
+        """
+        while True:
+            await self.press_flag.wait()
+            presses = self.unsynced_presses
+            try:
+                if self.timer_data and "short_code" in self.timer_data:
+                    self.api.save_timer_data(self.timer_data, preserve_token=True)
+                    try:
+                        await network_worker.call(self.api.timer_pressed, self.timer_data["short_code"])
+                    except Exception as e:
+                        print(f"[Timer] Error syncing button press: {e}")
+                    self.unsynced_presses -= presses
+                    presses = 0
+                    await self._fetch_timer_settings()
+                    await self._release_http_connection()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"[Timer] Error reconciling button press: {e}")
+                sys.print_exception(e)
+            # Counted off even if syncing failed, or every later fetch would keep the local restart
+            self.unsynced_presses -= presses
+
+    def _show_first_frame(self):
+        """Render the cached countdown straight away, without waiting for WiFi or the first tick"""
+        if self.clock_valid and self.engine.has_end_time():
+            self.engine.sync()
+            event_bus.publish(Events.TIME_CHANGED, self.engine.record)
+        elif self.engine.has_end_time():
+            print("[Timer] Clock not set yet, the countdown is shown once the time is synced")
 
     def _tick(self):
-        """Tick the timer"""
-        end_time = self._get_end_time()
-        current_time = utime.localtime()
-        current_timestamp = utime.mktime(current_time)
-
-        elapsed_seconds = end_time - current_timestamp
-        time_type = "until" if elapsed_seconds > 0 else "since"
-        
-        # Take absolute value if elapsed_seconds is negative
-        elapsed_seconds = abs(elapsed_seconds)
-
-        days = elapsed_seconds // 86400
-        hours = (elapsed_seconds % 86400) // 3600
-        minutes = (elapsed_seconds % 3600) // 60
-        seconds = elapsed_seconds % 60
-
-        event_bus.publish(Events.TIME_CHANGED, {
-            "days": days,
-            "hours": hours,
-            "minutes": minutes,
-            "seconds": seconds,
-            "type": time_type
-        })
-        time.sleep(1)
-
-    def _update_display(self, time_data):
-        self.display.update_time(time_data)
-
-    def _restart_timer(self):
-        """Restart the timer"""
-        if self.timer_data and "short_code" in self.timer_data:
-            self.api.timer_pressed(self.timer_data["short_code"])
-            self._fetch_timer_settings()
+        """Tick the timer. Allocates nothing unless the end time has changed."""
+        if self.clock_valid and self.engine.update():
+            # Deferred so a display that falls behind only ever renders the latest time
+            event_bus.publish_deferred(Events.TIME_CHANGED, self.engine.record)
+
+    def _update_display(self, time_record):
+        self.display.update_time(time_record)
+        time_record.changed = 0
+        if not self.first_frame_shown:
+            self.first_frame_shown = True
+            boot_timeline.mark("first frame")
 
-    def _fetch_timer_settings(self):
+    def _restart_timer(self, pressed_ticks=None):
+        """
+        Restart the countdown locally as soon as the tap is recognised and redraw it straight away.
+        The API call is made by the press sync task, never from the caller's context.
+        """
+        if self._restart_locally():
+            event_bus.publish(Events.TIME_CHANGED, self.engine.record)
+            if pressed_ticks is not None:
+                self._record_press_latency(utime.ticks_diff(utime.ticks_ms(), pressed_ticks))
+        self.unsynced_presses += 1
+        self.press_flag.set()
+
+    def _restart_locally(self):
+        """Move the cached timer to start now, keeping its duration. Returns False if the duration isn't known."""
+        timer_data = self.timer_data
+        if not timer_data or "start_time" not in timer_data or "end_time" not in timer_data:
+            return False
+        try:
+            duration = parse_iso8601(timer_data["end_time"]) - parse_iso8601(timer_data["start_time"])
+        except (ValueError, IndexError) as e:
+            print(f"[Timer] Cannot restart locally, bad timer times: {e}")
+            return False
+
+        now = utime.time()
+        timer_data = dict(timer_data)
+        timer_data["start_time"] = format_iso8601(now)
+        timer_data["end_time"] = format_iso8601(now + duration)
+        # The validators describe the server's copy, which this no longer matches
+        timer_data.pop("etag", None)
+        timer_data.pop("last_modified", None)
+        self.timer_data = timer_data
+        self._load_end_time()
+        return True
+
+    def _record_press_latency(self, latency_ms):
+        self.last_press_latency_ms = latency_ms
+        if latency_ms > self.max_press_latency_ms:
+            self.max_press_latency_ms = latency_ms
+        print(f"[Timer] Tap to display {latency_ms}ms (max {self.max_press_latency_ms}ms)")
+
+    async def _fetch_timer_settings(self):
         """
         Fetch timer settings from the online API or local cache.
         Returns True if timer settings were successfully loaded from either source.
         """
 
         # Get short code if it exists in timer data
-        if 'short_code' in self.timer_data:
+        timer_data = None
+        if self.timer_data and 'short_code' in self.timer_data:
             short_code = self.timer_data["short_code"]
-            self.timer_data = self.api.get_timer_for_device(self.device_id, short_code)
-        else:
-            self.timer_data = None
-        
+            try:
+                timer_data = await network_worker.call(self.api.get_timer_for_device, self.device_id, short_code)
+            except Exception as e:
+                print(f"[Timer] Error fetching timer settings: {e}")
+
+        if self.unsynced_presses:
+            # A tap restarted the countdown while this was in flight, so the response is already stale
+            print("[Timer] Button press not synced yet, keeping the local restart")
+            return True
+
+        if timer_data is not None:
+            boot_timeline.mark("first api refresh")
+
         # If API call failed, try to get from cache
+        self.timer_data = timer_data
         if self.timer_data is None:
             print("[Timer] No timer data found, trying cache")
             self.timer_data = self.api.get_cached_timer()
             
+        self._load_end_time()
+        # The API call may have re-synced the RTC, so re-anchor the countdown
+        self.clock_valid = time_sync.rtc_is_set()
+        self.engine.sync()
+        if time_sync.rtc_sets != self._rtc_sets_seen:
+            # The RTC's second edge has moved, and the ticker's deadlines are lined up with it
+            self._rtc_sets_seen = time_sync.rtc_sets
+            self.ticker.align()
+        if timer_data is not None:
+            boot_timeline.print_breakdown()
+
         if self.timer_data:
             print(f"[Timer] Timer loaded for device {self.device_id}: {self.timer_data}")
             return True
@@ -119,25 +275,10 @@ class CountdownTimer:
             print(f"[Timer] No timer found for device {self.device_id}")
             return False
             
+    def _load_end_time(self):
+        """Parse the end time into the countdown engine. Only re-parses when it has changed."""
+        self.engine.set_end_time(self.timer_data.get("end_time") if self.timer_data else None)
+
     def _abort_timer(self):
         """Abort the timer"""
-        self.abort = True
-
-    def _get_end_time(self):
-        """Return the start time of the timer. Parsed from the timer data."""
-        if self.timer_data and "end_time" in self.timer_data:
-            end_time_str = self.timer_data["end_time"]
-            year = int(end_time_str[0:4])
-            month = int(end_time_str[5:7])
-            day = int(end_time_str[8:10])
-            hour = int(end_time_str[11:13])
-            minute = int(end_time_str[14:16])
-            second = int(end_time_str[17:19])
-
-            timestamp = utime.mktime((year, month, day, hour, minute, second, 0, 0))
-
-            return timestamp
-        else:
-            return None
-
-        
+        self.abort_flag.set()
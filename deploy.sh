@@ -2,6 +2,9 @@
 # This script is used to deploy the code to the ESP32.
 # It will copy the code to the device and reset it.
 
+# Render and compress the captive portal pages into portal_pages.py
+python3 build_portal.py || exit 1
+
 # Copy all the python files to the device
 for file in *.py; do
     echo "Copying $file to device..."
@@ -1,25 +1,37 @@
-import json
 import machine
 import time
 import random
 from config import Config
+from kv_store import kv_store
 
 class DeviceID:
+    # Held in RAM once known, so only the first call per boot looks anywhere else
+    _device_id = None
+
     @staticmethod
     def get_id():
-        """Get the device ID, generating and saving a new one if it doesn't exist"""
-        try:
-            with open(Config.DEVICE_ID_FILE, 'r') as f:
-                data = json.load(f)
-                return data['device_id']
-        except:
-            # Generate new UUID if file doesn't exist or is invalid
-            device_id = str(machine.unique_id().hex() + str(time.time() + random.randint(0, 10000000)))
-            DeviceID.save_id(device_id)
-            return device_id
+        """
+        Get the device ID, computing it once per boot.
+
+        An ID persisted by an earlier firmware is always honoured. Otherwise, with
+        DEVICE_ID_FROM_UNIQUE_ID the ID is derived from the chip's unique ID and never needs saving;
+        without it a random ID is generated and saved.
+        """
+        if DeviceID._device_id is not None:
+            return DeviceID._device_id
+        device_id = kv_store.get("device_id")
+        if device_id is None:
+            if Config.DEVICE_ID_FROM_UNIQUE_ID:
+                device_id = machine.unique_id().hex()
+            else:
+                # Generate new UUID if it has never been stored
+                device_id = str(machine.unique_id().hex() + str(time.time() + random.randint(0, 10000000)))
+                DeviceID.save_id(device_id)
+        DeviceID._device_id = device_id
+        return device_id
     
     @staticmethod
     def save_id(device_id):
         """Save the device ID to persistent storage"""
-        with open(Config.DEVICE_ID_FILE, 'w') as f:
-            json.dump({'device_id': device_id}, f) 
+        kv_store.set("device_id", device_id)
+        DeviceID._device_id = device_id
@@ -11,60 +11,270 @@ Example usage:
     def on_pairing_mode():
         print("Device entered pairing mode")
     
-    event_bus.subscribe(Events.ENTERING_PAIRING_MODE, on_pairing_mode)
+    handle = event_bus.subscribe(Events.ENTERING_PAIRING_MODE, on_pairing_mode)
 
     # Publish an event
     event_bus.publish(Events.ENTERING_PAIRING_MODE)
 
-    # Unsubscribe when done
-    event_bus.unsubscribe(Events.ENTERING_PAIRING_MODE, on_pairing_mode)
+    # Unsubscribe when done, using the handle returned by subscribe
+    event_bus.unsubscribe(handle)
 
     # Subscribe with parameters
     def on_wifi_status(connected, ip_address):
         print(f"WiFi connected: {connected}, IP: {ip_address}")
     
-    event_bus.subscribe('WIFI_STATUS', on_wifi_status)
-    event_bus.publish('WIFI_STATUS', True, '192.168.1.100')
+    event_bus.subscribe(Events.WIFI_CONNECTED, on_wifi_status)
+    event_bus.publish(Events.WIFI_CONNECTED, True, '192.168.1.100')
+
+Events are small integers that index a fixed-size dispatch table of callback tuples.
+The tuples are only rebuilt when subscriptions change, so publish() is an index and a loop.
+
+Publishing from an interrupt handler or machine.Timer callback:
+
+    # Callbacks must not run (or allocate) inside the IRQ, so the event is queued instead
+    event_bus.publish_deferred(Events.BUTTON_TAPPED)
+
+    # ...and delivered later by the main loop
+    event_bus.dispatch_pending()
+
+    # or by a uasyncio task that drains the queue as soon as something is queued
+    asyncio.create_task(event_bus.run_dispatcher())
+
+    # Events in COALESCED_EVENTS (e.g. TIME_CHANGED) keep only their latest queued value,
+    # so a consumer that falls behind is handed the newest time rather than a backlog
+
+Profiling subscribers (set Config.EVENT_BUS_PROFILING = True, then from the REPL):
+
+    event_bus.print_profile()      # table over serial
+    event_bus.profile_json()       # the same numbers as a JSON string
+    event_bus.reset_profile()
 """
+import gc
+import json
+import machine
+import sys
+import time
+import uasyncio as asyncio
+from config import Config
+from micropython import const
 
 class Events:
-    """Constants for all application events"""
-    ENTERING_PAIRING_MODE = 'ENTERING_PAIRING_MODE'
-    EXITING_PAIRING_MODE = 'EXITING_PAIRING_MODE'
-    WIFI_RESET = 'WIFI_RESET'
-    TIME_CHANGED = 'TIME_CHANGED'
-    BUTTON_TAPPED = 'BUTTON_TAPPED'
-    FACTORY_RESET_BUTTON_PRESSED = 'FACTORY_RESET_BUTTON_PRESSED'
-    SOFT_RESET_BUTTON_PRESSED = 'SOFT_RESET_BUTTON_PRESSED'
-    WIFI_CONNECTED = 'WIFI_CONNECTED'
-    WIFI_CREDENTIALS_RECEIVED = 'WIFI_CREDENTIALS_RECEIVED'
-    # Add future events here:
-    # TIMER_STARTED = 'TIMER_STARTED'
-    # TIMER_EXPIRED = 'TIMER_EXPIRED'
-    # etc.
+    """Constants for all application events. Each event is an index into the dispatch table."""
+    ENTERING_PAIRING_MODE = const(0)
+    EXITING_PAIRING_MODE = const(1)
+    WIFI_RESET = const(2)
+    TIME_CHANGED = const(3)
+    BUTTON_TAPPED = const(4)
+    FACTORY_RESET_BUTTON_PRESSED = const(5)
+    SOFT_RESET_BUTTON_PRESSED = const(6)
+    WIFI_CONNECTED = const(7)
+    WIFI_CREDENTIALS_RECEIVED = const(8)
+    WIFI_DISCONNECTED = const(9)
+    # Add future events here, then bump COUNT and add the name to NAMES
+    COUNT = const(10)
+
+    NAMES = (
+        'ENTERING_PAIRING_MODE',
+        'EXITING_PAIRING_MODE',
+        'WIFI_RESET',
+        'TIME_CHANGED',
+        'BUTTON_TAPPED',
+        'FACTORY_RESET_BUTTON_PRESSED',
+        'SOFT_RESET_BUTTON_PRESSED',
+        'WIFI_CONNECTED',
+        'WIFI_CREDENTIALS_RECEIVED',
+        'WIFI_DISCONNECTED',
+    )
+
+    # Only the latest queued value of these events is delivered
+    COALESCED_EVENTS = (TIME_CHANGED,)
 
 class EventBus:
-    def __init__(self):
-        self._subscribers = {}
+    def __init__(self, queue_size=Config.EVENT_QUEUE_SIZE):
+        # event -> tuple of callbacks, rebuilt only when subscriptions change
+        self._dispatch = [()] * Events.COUNT
+        # event -> {handle: callback}, the source the dispatch tuples are built from
+        self._subscribers = [None] * Events.COUNT
+        # handle -> event
+        self._handles = {}
+        self._next_handle = 1
+
+        # Preallocated ring buffer for events published from IRQ/timer context
+        self._queue_events = [None] * queue_size
+        self._queue_args = [None] * queue_size
+        self._queue_size = queue_size
+        self._queue_head = 0
+        self._queue_count = 0
+        self._queue_flag = asyncio.ThreadSafeFlag()
+        # event -> queue slot holding its pending value, for coalesced events (-1 when none)
+        self._pending_slot = [-1] * Events.COUNT
+        self._coalesced = [False] * Events.COUNT
+        for event in Events.COALESCED_EVENTS:
+            self._coalesced[event] = True
+        self.overflow_count = 0
+        self.max_queue_depth = 0
+
+        # Per-event and per-callback stats: key -> [calls, total_us, max_us, allocated_bytes]
+        self._profile = {}
+        if Config.EVENT_BUS_PROFILING:
+            # Swap in the instrumented publish so the normal path has no profiling checks at all
+            self.publish = self._publish_profiled
         
     def subscribe(self, event, callback):
-        """Subscribe to an event"""
-        if event not in self._subscribers:
-            self._subscribers[event] = []
-        self._subscribers[event].append(callback)
+        """Subscribe to an event. Returns a handle to pass to unsubscribe()."""
+        handle = self._next_handle
+        self._next_handle += 1
+        if self._subscribers[event] is None:
+            self._subscribers[event] = {}
+        self._subscribers[event][handle] = callback
+        self._handles[handle] = event
+        self._rebuild_dispatch(event)
+        return handle
         
     def publish(self, event, *args, **kwargs):
         """Publish an event to all subscribers"""
-        if event in self._subscribers:
-            for callback in self._subscribers[event]:
-                callback(*args, **kwargs)
+        for callback in self._dispatch[event]:
+            callback(*args, **kwargs)
                 
-    def unsubscribe(self, event, callback):
-        """Unsubscribe from an event"""
-        if event in self._subscribers:
-            self._subscribers[event].remove(callback)
-            if not self._subscribers[event]:
-                del self._subscribers[event]
+    def unsubscribe(self, handle):
+        """Unsubscribe using the handle returned by subscribe()"""
+        event = self._handles.pop(handle, None)
+        if event is None:
+            return
+        del self._subscribers[event][handle]
+        self._rebuild_dispatch(event)
+
+    def _rebuild_dispatch(self, event):
+        """Rebuild the callback tuple for an event, in subscription order"""
+        subscribers = self._subscribers[event]
+        self._dispatch[event] = tuple(subscribers[handle] for handle in sorted(subscribers))
+
+    def _publish_profiled(self, event, *args, **kwargs):
+        """publish() that also records call counts, ticks_us durations and gc.mem_alloc deltas"""
+        if not self._dispatch[event]:
+            return
+        event_alloc_before = gc.mem_alloc()
+        event_start = time.ticks_us()
+        for callback in self._dispatch[event]:
+            alloc_before = gc.mem_alloc()
+            start = time.ticks_us()
+            callback(*args, **kwargs)
+            elapsed_us = time.ticks_diff(time.ticks_us(), start)
+            self._record((event, callback), elapsed_us, gc.mem_alloc() - alloc_before)
+        elapsed_us = time.ticks_diff(time.ticks_us(), event_start)
+        self._record(event, elapsed_us, gc.mem_alloc() - event_alloc_before)
+
+    def _record(self, key, elapsed_us, allocated):
+        stats = self._profile.get(key)
+        if stats is None:
+            stats = self._profile[key] = [0, 0, 0, 0]
+        stats[0] += 1
+        stats[1] += elapsed_us
+        if elapsed_us > stats[2]:
+            stats[2] = elapsed_us
+        # A garbage collection during the callback makes the delta negative
+        if allocated > 0:
+            stats[3] += allocated
+
+    def reset_profile(self):
+        self._profile = {}
+
+    def profile_stats(self):
+        """Return the profiling stats as a dict of events, each with its per-callback breakdown"""
+        events = {}
+        for key, (calls, total_us, max_us, allocated) in self._profile.items():
+            stats = {
+                "calls": calls,
+                "total_us": total_us,
+                "max_us": max_us,
+                "avg_us": total_us // calls,
+                "alloc_bytes": allocated,
+            }
+            if isinstance(key, tuple):
+                event, callback = key
+                events.setdefault(Events.NAMES[event], {"callbacks": {}})["callbacks"][_callback_name(callback)] = stats
+            else:
+                events.setdefault(Events.NAMES[key], {"callbacks": {}}).update(stats)
+        return events
+
+    def profile_json(self):
+        return json.dumps(self.profile_stats())
+
+    def print_profile(self):
+        if not Config.EVENT_BUS_PROFILING:
+            print("[EVENTS] Profiling is disabled (Config.EVENT_BUS_PROFILING)")
+            return
+        for event, stats in self.profile_stats().items():
+            print(f"[EVENTS] {event}: calls={stats.get('calls', 0)} total={stats.get('total_us', 0)}us max={stats.get('max_us', 0)}us alloc={stats.get('alloc_bytes', 0)}B")
+            for name, cb_stats in stats["callbacks"].items():
+                print(f"[EVENTS]   {name}: calls={cb_stats['calls']} avg={cb_stats['avg_us']}us max={cb_stats['max_us']}us alloc={cb_stats['alloc_bytes']}B")
+
+    def publish_deferred(self, event, arg=None):
+        """
+        Queue an event to be published later by dispatch_pending().
+        Safe to call from IRQ and timer callbacks: it never allocates and never runs subscribers.
+        At most one argument is carried; if the queue is full the event is dropped and counted.
+        A coalesced event that is already queued has its argument replaced instead.
+        """
+        slot = self._pending_slot[event]
+        if slot >= 0:
+            self._queue_args[slot] = arg
+            return True
+        if self._queue_count >= self._queue_size:
+            self.overflow_count += 1
+            return False
+        index = (self._queue_head + self._queue_count) % self._queue_size
+        self._queue_events[index] = event
+        self._queue_args[index] = arg
+        if self._coalesced[event]:
+            self._pending_slot[event] = index
+        self._queue_count += 1
+        if self._queue_count > self.max_queue_depth:
+            self.max_queue_depth = self._queue_count
+        self._queue_flag.set()
+        return True
+
+    def dispatch_pending(self):
+        """Publish every queued event, in order. Call from the main loop, never from an IRQ."""
+        while self._queue_count:
+            irq_state = machine.disable_irq()
+            event = self._queue_events[self._queue_head]
+            arg = self._queue_args[self._queue_head]
+            self._queue_events[self._queue_head] = None
+            self._queue_args[self._queue_head] = None
+            self._pending_slot[event] = -1
+            self._queue_head = (self._queue_head + 1) % self._queue_size
+            self._queue_count -= 1
+            machine.enable_irq(irq_state)
+
+            if arg is None:
+                self.publish(event)
+            else:
+                self.publish(event, arg)
+
+    async def run_dispatcher(self):
+        """uasyncio task that delivers queued events as soon as they are published"""
+        while True:
+            await self._queue_flag.wait()
+            try:
+                self.dispatch_pending()
+            except Exception as e:
+                print(f"[EVENTS] Error dispatching queued event: {e}")
+                sys.print_exception(e)
+
+    def print_queue_stats(self):
+        print(f"[EVENTS] Queue depth: {self._queue_count}/{self._queue_size}, max depth: {self.max_queue_depth}, overflows: {self.overflow_count}")
+
+def _callback_name(callback):
+    """Readable name for a subscriber, e.g. 'CountdownTimer._update_display'"""
+    try:
+        return f"{callback.__self__.__class__.__name__}.{callback.__name__}"
+    except AttributeError:
+        pass
+    try:
+        return callback.__name__
+    except AttributeError:
+        return repr(callback)
 
 # Global event bus instance
 event_bus = EventBus() 
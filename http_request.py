@@ -0,0 +1,234 @@
+"""
+Incremental HTTP/1.1 request parser over a fixed bytearray, for the captive portal web server.
+
+The request is read straight into the parser's buffer and parsed as it arrives, however the client's
+TCP segments split it. Header names are matched case-insensitively and in place; only the method and
+path are copied out. Header lines are dropped from the buffer once they have been parsed, so long
+headers (User-Agent, Accept-Language...) never count against the body. The body is read up to
+Content-Length and can then be decoded as form fields, percent-decoding them in place.
+
+Anything malformed or too big raises HttpError with the status code to reply with.
+
+Example usage:
+
+    request = HttpRequest(1024)
+    while not request.feed(await reader.readinto(request.space())):
+        pass
+    request.method, request.path    # b"POST", b"/configure"
+    request.form()                  # {"ssid": "My WiFi", ...}
+"""
+
+# Status codes HttpError can carry, with their reason phrases
+STATUS_REASONS = {
+    400: b"Bad Request",
+    404: b"Not Found",
+    413: b"Payload Too Large",
+    431: b"Request Header Fields Too Large",
+    501: b"Not Implemented",
+}
+
+_CR = 13
+_LF = 10
+_SPACE = 32
+_TAB = 9
+_COLON = 58
+_QUESTION = 63
+_AMPERSAND = 38
+_EQUALS = 61
+_PLUS = 43
+_PERCENT = 37
+
+class HttpError(ValueError):
+    """A request that can't be served. status is the HTTP status code to reply with."""
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+def _index(buf, byte, start, end):
+    """Position of byte in buf[start:end], or end if it isn't there"""
+    while start < end and buf[start] != byte:
+        start += 1
+    return start
+
+def _hex_value(byte):
+    if 48 <= byte <= 57:
+        return byte - 48
+    byte |= 0x20
+    if 97 <= byte <= 102:
+        return byte - 87
+    raise HttpError(400, "bad percent-encoding")
+
+class HttpRequest:
+    def __init__(self, size):
+        self.buf = bytearray(size)
+        self.view = memoryview(self.buf)
+        self.reset()
+
+    def reset(self):
+        """Get ready for the next request, reusing the buffer"""
+        self.length = 0
+        self.method = None
+        self.path = None
+        self.content_length = 0
+        # -1 until the blank line that ends the headers has been parsed
+        self.body_start = -1
+        self._line_start = 0
+        self._scanned = 0
+
+    def is_empty(self):
+        return self.length == 0
+
+    def space(self):
+        """The free part of the buffer, for the next read to go into"""
+        return self.view[self.length:]
+
+    def feed(self, count):
+        """
+        Account for count more bytes read into space(). Returns True once the whole request, body
+        included, is in the buffer. A count of 0 (the client closed the connection) raises HttpError.
+        """
+        if not count:
+            raise HttpError(400, "connection closed mid-request")
+        self.length += count
+        if self.body_start < 0:
+            self._parse_head()
+            if self.body_start < 0:
+                if self.length == len(self.buf):
+                    self._drop_parsed_lines()
+                return False
+            if self.body_start + self.content_length > len(self.buf):
+                # Make room for the body where the request line and headers were
+                self._drop_parsed_lines()
+                self.body_start = 0
+        return self.length >= self.body_start + self.content_length
+
+    def body(self):
+        return self.view[self.body_start:self.body_start + self.content_length]
+
+    def form(self):
+        """
+        The body as application/x-www-form-urlencoded fields: {name: value}. Fields are percent-decoded
+        in place, so this can only be called once per request.
+        """
+        fields = {}
+        buf = self.buf
+        start = self.body_start
+        end = start + self.content_length
+        while start < end:
+            field_end = _index(buf, _AMPERSAND, start, end)
+            equals = _index(buf, _EQUALS, start, field_end)
+            name = self._decode(start, equals)
+            fields[name] = self._decode(equals + 1, field_end) if equals < field_end else ""
+            start = field_end + 1
+        return fields
+
+    def _decode(self, start, end):
+        """Percent-decode buf[start:end] in place (it can only get shorter) and return it as a str"""
+        buf = self.buf
+        first = start
+        out = start
+        while start < end:
+            byte = buf[start]
+            if byte == _PLUS:
+                byte = _SPACE
+            elif byte == _PERCENT:
+                if start + 2 >= end:
+                    raise HttpError(400, "truncated percent-encoding")
+                byte = _hex_value(buf[start + 1]) << 4 | _hex_value(buf[start + 2])
+                start += 2
+            buf[out] = byte
+            out += 1
+            start += 1
+        try:
+            return str(self.view[first:out], "utf-8")
+        except UnicodeError:
+            raise HttpError(400, "form field is not UTF-8")
+
+    def _parse_head(self):
+        """Parse every complete line of the request line and headers that hasn't been parsed yet"""
+        buf = self.buf
+        scan = self._scanned
+        while scan < self.length:
+            if buf[scan] == _LF:
+                start = self._line_start
+                end = scan
+                if end > start and buf[end - 1] == _CR:
+                    end -= 1
+                self._line_start = scan + 1
+                if self.method is None:
+                    self._parse_request_line(start, end)
+                elif start == end:
+                    self._end_of_head(scan + 1)
+                    scan += 1
+                    break
+                else:
+                    self._parse_header(start, end)
+            scan += 1
+        self._scanned = scan
+
+    def _parse_request_line(self, start, end):
+        buf = self.buf
+        if start == end:
+            # Tolerated before the request line (RFC 9112 section 2.2)
+            return
+        method_end = _index(buf, _SPACE, start, end)
+        target_end = _index(buf, _SPACE, method_end + 1, end)
+        if method_end == end or target_end == end or method_end == start:
+            raise HttpError(400, "bad request line")
+        path_end = _index(buf, _QUESTION, method_end + 1, target_end)
+        self.method = bytes(self.view[start:method_end])
+        self.path = bytes(self.view[method_end + 1:path_end])
+
+    def _parse_header(self, start, end):
+        buf = self.buf
+        colon = _index(buf, _COLON, start, end)
+        if colon == end:
+            raise HttpError(400, "bad header line")
+        if self._name_is(start, colon, b"content-length"):
+            value = self._skip_whitespace(colon + 1, end)
+            if value == end:
+                raise HttpError(400, "empty Content-Length")
+            length = 0
+            while value < end and 48 <= buf[value] <= 57:
+                length = length * 10 + buf[value] - 48
+                value += 1
+            if self._skip_whitespace(value, end) != end:
+                raise HttpError(400, "bad Content-Length")
+            self.content_length = length
+        elif self._name_is(start, colon, b"transfer-encoding"):
+            raise HttpError(501, "chunked requests are not supported")
+
+    def _name_is(self, start, end, lowercase_name):
+        """Case-insensitive header name match, without copying the name out of the buffer"""
+        if end - start != len(lowercase_name):
+            return False
+        buf = self.buf
+        for offset in range(len(lowercase_name)):
+            # Setting bit 5 lowercases a letter and leaves '-' unchanged
+            if buf[start + offset] | 0x20 != lowercase_name[offset]:
+                return False
+        return True
+
+    def _skip_whitespace(self, start, end):
+        buf = self.buf
+        while start < end and (buf[start] == _SPACE or buf[start] == _TAB):
+            start += 1
+        return start
+
+    def _end_of_head(self, body_start):
+        if self.content_length > len(self.buf):
+            raise HttpError(413, "request body too large")
+        self.body_start = body_start
+
+    def _drop_parsed_lines(self):
+        """Move the unparsed rest of the buffer to the front, over the lines that have been parsed"""
+        start = self._line_start
+        if start == 0:
+            raise HttpError(431, "request line or header too long")
+        buf = self.buf
+        count = self.length - start
+        for offset in range(count):
+            buf[offset] = buf[start + offset]
+        self.length = count
+        self._scanned -= start
+        self._line_start = 0
@@ -0,0 +1,188 @@
+"""
+Small crash-safe key-value store for the device's persistent state (WiFi credentials, device ID, timer).
+
+All the state lives in one log-structured file. Every set or delete appends a record:
+
+    op (uint8) | key length (uint8) | value length (uint16) | CRC32 (uint32) | key | value
+
+The CRC covers the first four header bytes, the key and the value. Values are stored as JSON. On load
+the log is replayed into an in-RAM index, so lookups never touch the filesystem. A power cut can at worst
+leave a torn last record, which fails its CRC, so the previous value of that key is kept.
+
+Setting a key to the value it already has writes nothing. Once the log is mostly superseded records it
+is compacted: the live records are written to a temporary file, which is then renamed over the log.
+
+The old per-module JSON files are imported once, the first time the store is loaded.
+
+Example usage:
+
+    kv_store.set("device_id", "abc123")
+    kv_store.get("device_id")           # "abc123", from RAM
+    kv_store.delete("device_id")
+"""
+import binascii
+import json
+import os
+import struct
+from config import Config
+
+_MAGIC = b"KV01"
+_HEADER_FORMAT = "<BBHI"
+_HEADER_SIZE = 8
+_OP_SET = 1
+_OP_DELETE = 2
+
+# (key, legacy JSON file) pairs imported on first load
+_LEGACY_FILES = (
+    ("wifi", Config.WIFI_CREDENTIALS_FILE),
+    ("device_id", Config.DEVICE_ID_FILE),
+    ("timer", Config.TIMER_JSON_FILE),
+)
+
+class KVStore:
+    def __init__(self, path):
+        self.path = path
+        # key -> JSON encoded value
+        self.index = {}
+        self.size = 0
+        self.writes = 0
+        self.writes_avoided = 0
+        self.compactions = 0
+        self._loaded = False
+
+    def _load(self):
+        if self._loaded:
+            return
+        self._loaded = True
+        self._read_log()
+        self._migrate_json_files()
+
+    def _read_log(self):
+        """Replay the log into the index, dropping a torn or corrupt tail if there is one"""
+        try:
+            with open(self.path, "rb") as f:
+                data = f.read()
+        except OSError:
+            # No store yet, it is created on the first write
+            return
+
+        if data[:4] != _MAGIC:
+            print("[KV] Store unreadable (bad header), starting a new one")
+            self._compact()
+            return
+
+        offset = 4
+        while offset + _HEADER_SIZE <= len(data):
+            op, key_length, value_length, crc = struct.unpack_from(_HEADER_FORMAT, data, offset)
+            end = offset + _HEADER_SIZE + key_length + value_length
+            if end > len(data):
+                break
+            body = memoryview(data)[offset + _HEADER_SIZE:end]
+            if crc != binascii.crc32(body, binascii.crc32(memoryview(data)[offset:offset + 4])) & 0xFFFFFFFF:
+                break
+            key = str(bytes(body[:key_length]), "utf-8")
+            if op == _OP_SET:
+                self.index[key] = bytes(body[key_length:])
+            else:
+                self.index.pop(key, None)
+            offset = end
+
+        self.size = offset
+        if offset != len(data):
+            print(f"[KV] Dropping corrupt tail at byte {offset}")
+            self._compact()
+
+    def get(self, key, default=None):
+        """Return a fresh copy of the value stored under key, or default"""
+        self._load()
+        value = self.index.get(key)
+        return default if value is None else json.loads(value)
+
+    def __contains__(self, key):
+        self._load()
+        return key in self.index
+
+    def set(self, key, value):
+        """Store value under key. Returns True if anything was written, False if it was unchanged."""
+        self._load()
+        encoded = json.dumps(value).encode()
+        if self.index.get(key) == encoded:
+            self.writes_avoided += 1
+            return False
+        self._append(_OP_SET, key, encoded)
+        self.index[key] = encoded
+        return True
+
+    def delete(self, key):
+        self._load()
+        if key not in self.index:
+            return
+        self._append(_OP_DELETE, key, b"")
+        del self.index[key]
+
+    def _append(self, op, key, value):
+        if self.size == 0:
+            # Start the log with a compaction, which writes the header
+            self._compact()
+        record = self._record(op, key.encode(), value)
+        with open(self.path, "ab") as f:
+            f.write(record)
+        self.size += len(record)
+        self.writes += 1
+        if self.size > Config.KV_STORE_COMPACT_BYTES and self.size > 2 * self._live_size():
+            self._compact()
+
+    @staticmethod
+    def _record(op, key, value):
+        header = struct.pack("<BBH", op, len(key), len(value))
+        crc = binascii.crc32(value, binascii.crc32(key, binascii.crc32(header))) & 0xFFFFFFFF
+        return header + struct.pack("<I", crc) + key + value
+
+    def _live_size(self):
+        size = 4
+        for key, value in self.index.items():
+            size += _HEADER_SIZE + len(key) + len(value)
+        return size
+
+    def _compact(self):
+        """Write just the live records to a temporary file, then rename it over the log"""
+        tmp_path = self.path + ".tmp"
+        size = 4
+        with open(tmp_path, "wb") as f:
+            f.write(_MAGIC)
+            for key, value in self.index.items():
+                record = self._record(_OP_SET, key.encode(), value)
+                f.write(record)
+                size += len(record)
+        os.rename(tmp_path, self.path)
+        self.size = size
+        self.compactions += 1
+
+    def _migrate_json_files(self):
+        """One-time import of the JSON files each module used to keep its state in"""
+        if "_migrated" in self.index:
+            # Done on an earlier boot, don't probe for the old files again
+            return
+        for key, path in _LEGACY_FILES:
+            try:
+                with open(path, "r") as f:
+                    value = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if key == "device_id":
+                try:
+                    value = value["device_id"]
+                except (KeyError, TypeError):
+                    print(f"[KV] {path} has no device ID, not migrating it")
+                    continue
+            print(f"[KV] Migrating {path} into the store")
+            if key not in self.index:
+                self.set(key, value)
+            os.remove(path)
+        self.set("_migrated", 1)
+
+    def print_stats(self):
+        print(f"[KV] keys={len(self.index)} size={self.size}B live={self._live_size()}B writes={self.writes} writes avoided={self.writes_avoided} compactions={self.compactions}")
+
+# Global key-value store instance
+kv_store = KVStore(Config.KV_STORE_FILE)
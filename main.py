@@ -1,4 +1,11 @@
+import micropython
+from boot_timeline import boot_timeline
 from application import Application
+boot_timeline.mark("imports")
+
+# Lets exceptions raised inside IRQ handlers be reported
+micropython.alloc_emergency_exception_buf(100)
 
 app = Application()
+boot_timeline.mark("application init")
 app.start()
@@ -0,0 +1,77 @@
+"""
+Runs blocking network calls (HTTP requests, DNS lookups, ntptime, WLAN.connect) on a background thread.
+
+MicroPython's urequests and ntptime block the caller for the whole round trip, which would
+freeze every uasyncio task, including the 1 Hz countdown tick. Coroutines hand the blocking call
+to the worker thread instead and await the result, so the event loop keeps running.
+
+Jobs are processed one at a time, in the order they were queued.
+
+Example usage:
+
+    timer_data = await network_worker.call(api.get_timer_for_device, device_id, short_code)
+"""
+import _thread
+import uasyncio as asyncio
+import sys
+from config import Config
+
+class _Job:
+    def __init__(self, func, args):
+        self.func = func
+        self.args = args
+        self.result = None
+        self.error = None
+        self.done = asyncio.ThreadSafeFlag()
+
+class NetworkWorker:
+    def __init__(self):
+        self._jobs = []
+        self._lock = _thread.allocate_lock()
+        self._wake = _thread.allocate_lock()
+        self._wake.acquire()
+        self._started = False
+
+    async def call(self, func, *args):
+        """Run func(*args) on the worker thread and return its result (or raise its exception)"""
+        self._start()
+        job = _Job(func, args)
+        with self._lock:
+            self._jobs.append(job)
+        if self._wake.locked():
+            self._wake.release()
+        await job.done.wait()
+        if job.error is not None:
+            raise job.error
+        return job.result
+
+    def _start(self):
+        if self._started:
+            return
+        self._started = True
+        _thread.stack_size(Config.NETWORK_WORKER_STACK_SIZE)
+        _thread.start_new_thread(self._run, ())
+        print("[WORKER] Network worker thread started")
+
+    def _next_job(self):
+        with self._lock:
+            if self._jobs:
+                return self._jobs.pop(0)
+        return None
+
+    def _run(self):
+        while True:
+            job = self._next_job()
+            if job is None:
+                self._wake.acquire()
+                continue
+            try:
+                job.result = job.func(*job.args)
+            except Exception as e:
+                print(f"[WORKER] Error running {job.func}: {e}")
+                sys.print_exception(e)
+                job.error = e
+            job.done.set()
+
+# Global network worker instance
+network_worker = NetworkWorker()
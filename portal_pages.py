@@ -0,0 +1,132 @@
+"""
+Captive portal pages, gzip-compressed. Generated by build_portal.py from portal/, do not edit.
+
+Each page is (response head, deflate segments, uncompressed static size, CRC32 of the first
+segment, CRC folds for the segments after each slot). See SoftAPProvisioning._send_page.
+"""
+
+STYLE_PATH = b'/portal.css?v=92599359'
+
+# Slots: none
+STYLE = (
+    b'HTTP/1.1 200 OK\r\nContent-Type: text/css\r\nContent-Encoding: gzip\r\nVary: Accept-Encoding\r\nCache-Control: public, max-age=31536000, immutable\r\nConnection: close\r\n',
+    (
+        (
+            b'\x1f\x8b\x08\x00\x00\x00\x00\x00\x02\xff\x9dT\xcbn\xdb0\x10\xbc\xfb+\x88\x04\x05Z\xc04$\xc7\x8e\r\xf9V'
+            b'\xb4\x05z\xe8\xa5A?\x80"W\x12a\x8a$H*vR\xf4\xdf\xbb\xa2%Y\xb2\x1d\x04-\xa4\x0b\x1f;'
+            b';3\xbb\xcb\xdc\x88\x17\xf2{V\x18\x1dh\xc1j\xa9^2B\x99\xb5\n\xa8\x7f\xf1\x01\xea9\xf9\xac\xa4\xde'
+            b"\xff`\xfc)\xae\xbf\xe1\xcd9\xb9{\x82\xd2\x00\xf9\xf5\xfdnN~\x9a\xdc\x043'\x9eiO=8Y\xec"
+            b'f5s\xa5\xd4\x19Iv3\xcb\x84\x90\xba\xcc\xc82\xb1\xc7\xdd,g|_:\xd3h\x91\x91\xfbb\x8d\xdf'
+            b'f7\xe3F\x19\x87\xebT\xe0\x87\xe1\x7ff\x0b\x8ey\x98\xd4\xe0\x90]\xcd\x8e\xf4 E\xa82\xb2J"\xca'
+            b'\x80OX\x13\xcc\x14\xf5P\xc9\x00\xe3\xbc\xeb\x98\xd78\x01\x8e:&d\xe33\x92v\x9bG\xea+&\xcc\xa1'
+            b'\x85Z\xda#I\x11\x9e\xb82g\x1f\x939\xe9\xfeE\xfa\xa9\xa5T\xa5H%\xc01P\xa6d\x89\xc99\xe8'
+            b"\x00\xae'C\xd1\x85`\xea>_t\xd4\xcbW\xc0\x8d\xd5\xb0q\x00YV!#\x8fI\xd2BJm\x9b\x80"
+            b'\xa8\x9d\xb84I>\x8c\x88\xa7\xcb\xb1\xd4\xc8,\xe9\x85\xe0\x1a\x97\xde()\xc8\xbdX\xe2\xb7\xb9\xd2\xb8\x1d$'
+            b"\xca\xd7\x08\xd8\x9d\xe3\xd6\x84_\xfa\xd8^\x0c\x0e\xeb'\x834z\xb8\x18\xcb\x82\xfa\x97~ \x9b\x15\x867\x1e"
+            b')\x9b&`_`\xb46\x1a\x86\xd4}!\x93d\x93\xc2C\x1b\x957\xe8\x8a~G\xe3\xa4)\xfa\xd8\x0e\xab'
+            b'+g/{\x92n\xa2\xf4J\xd1\xc4\xf1u\xeb8o\x9co1\xad\x91\xa7\xd2MD\x0f$.\x84\x9f$d'
+            b'\x95y\x8e\xddxIv\xf3\xf5K\xecX\xdfp\x0e\xbe\xf5\xa6wa\xb9e\x9b\xd5:\x1e\x82s\xc6\x8d\x8e\x04'
+            b'\x7fXwG]\x1c\x95<\xfa4\x92\xb1\xda\x9e\x1b\xe0\xdc^q\x000\xae\xc6 V\xc2\x1bM\xd9\x16\x87V'
+            b'\x9d\xf8t1b\xf1o\x89na\xffG\xf2\xb7D\x14\xc6\xd5\xb4u\xd3\xc69\x9f\\:\xcd\xe8\xf4\x92b9'
+            b'(\xbc*\xa4\xb7\x8a\xe1c\x95+\xc3\xf7W\xf8\xeb\xdb\xf5G,\x01\xcf\x92\x03\xd5\xac\x86Q9\xfa\x9e\xbb5'
+            b'\xa4\x0b\x0f\xa1\xb1\xd8\x13\x02\xa6\xae\x9d\xe6ZA@\xcd\xd4[\xc6O\xcf\xcd\xe0Zl\xae\x96{F\x1ak\xc1'
+            b'q\xe6\xe1MC\xcfI\xb2\x0c\x19\xe4{\x19h\x9c8\x8a:9TF\x89\xd8}W]~\x99_cB\xa6'
+            b'.}[\xf0\n\xf8\x1e\'\x7f\xec]\xa1\x00\x01"\x17\x8aCV\xfb3\xa3\x89\x11#\xc8\x01\xe6\xe2\xe9:='
+            b'\xc3\xe7gy\xdb>V$\xfa\xf7\x17Y\x93Y\x92c\x06\x00\x00'
+        ),
+    ),
+    1635,
+    0,
+    (),
+)
+
+# Slots: ssid
+CONFIG_PAGE = (
+    b'HTTP/1.1 200 OK\r\nContent-Type: text/html; charset=utf-8\r\nContent-Encoding: gzip\r\nVary: Accept-Encoding\r\nCache-Control: no-store\r\nConnection: close\r\n',
+    (
+        (
+            b'\x1f\x8b\x08\x00\x00\x00\x00\x00\x02\xff4\x8eMo\xc20\x0c\x86\xef\xfc\n/\xe7\xb1\n\x10\x87JI9\xf0q'
+            b'\x1d\x12\x93\xd0\x8eYb\x14\x0b\xd7\xad\x1a\xaf\x88\x7f\xbff\xc0\xe9\x91\xad\xd7\x8f_\xfb\xb6\xfb\xdc~}\x1f\xf7'
+            b"\x90\xb4\xe5ff_@\x1f'()c\xb3?\x1dWK8\xd3\x81\xe0\x84\xfa\xdb\xdb\xea\xb1\x9f\xd9\x16\xd5\x83"
+            b'\xf8\x16\x9d\x19\to}7\xa8\x81\xd0\x89\xa2\xa837\x8a\x9a\\\xc4\x91\x02\xce\xff\x87w !%\xcf\xf3\x1c'
+            b'<\xa3[\x98I\xc2$W\x18\x90\x9d\xc9zg\xcc\tq\xb2\xa4\x01/\xceTE\xe9\xf9#\xe4\xbc\x19]\xbd'
+            b'\\\xd7\xf5j]\x97\xab\xeaY\xf1\xa7\x8b\xf7\t\x91F\x08\xecsv\xa6\xfc\xf7$8\x94XZ4\xdbN\x04'
+            b'\x83\x82\xcd\xbd\x97W\xe8\xd9\xaat7\xcd\x1f\x00\x00\x00\xff\xff'
+        ),
+        (
+            b'\x95T\xdfo\xd30\x10~\xcf_q\xf8a\xca\xc4\xda\xb4lO\xb4)\xd2\xc6\x10H0&\xad\x12\x0f\xd3\x84'
+            b'\\\xe7\xd2\x98%v\xb0\x9d\xb2\n\xed\x7f\xe7\xec\xfc\xea\xb4I\xc0S|?\xbe\xbb\xef;_\xbcLl\xcd\xd5'
+            b'\n\x9c\x86o\xf2\x83\\&\xc5|\x15-sm*\xa8\xd0\x15:K\xd9\xf5\xd7\x9b5\x03.\x9c\xd4*e\x89'
+            b'\xd0*\x97\xdb\xc6 \xa3\xc4L\xee@\x94\xdc\xda\x94y\xccdktS\xfb@\xc97X\x02\xf9Rf\xd15'
+            b"\xf5D\xe8\x8c\x10\xefq'\x05\xc2\x8dw\xc1\x05\xb9\x96I\xc8$\x84Tu\xe3\xc0\xedkL\x99\xc3\x07\xc7@"
+            b'fO\xc0\xa0x\x85\x9d\xe7{\xf0D]\xeb\xc3\xa4\x8a?\x94\xa8\xb6\xaeH\xd9\x19\x8b\xea\x92\x0b,t\x99!'
+            b'\x11\xb9T\x0e\r\x9cMD\xc1\r\xc9\xa1s\x0b1\xf8\xb3\x91\x063"\x91\x90\xa0\x7f\x95ee\xc6V~h'
+            b'p\x85\xee\x976\xf7pE\x04\xff*\xc8\xc3z)\xe1\\J\xebR\xa6\xda\x1a\x96\xc1\x13\xce\xd7R\xdc\x836'
+            b'\x80\x81{\xe8\xe6\xb1#i\xe0\x8d\xd3BWu\x89\x8eJ\xea<\x0f\xf7\xc2\x1d\xf7uC\xcb\xa1\xf4\x8a\xf4u'
+            b"\x81AK'S\x14(\xee7\xfa\x81r\x0ey\x0f\xee\x8eq!\xb3\x0c\x15\x83\x1d/\x1b2\xe7l\xf51x"
+            b'\xa0\xeb1\xaa\xff\x8fI\xd6\x14&p?\xcd\xeb\xce|y\x92Cr\x906Z-\xbf\xd1~\xe1\xe6C\xf5\xb1'
+            b'\xd9\xc0q\xd38\xa7UW\xdf6\x9bJ:\xb6\xba\xd0J\xa1p\xcb\xa4\x8d\xfal/`DYadMs'
+            b'\xcc\x1b\x15~\r(5\xcf\xbaM\xb0\xb1Ag$\xdac\xf8\x1d\xe5\xe8D\x11\xb3\xa4\xbf\x86\xe9\x0f\xab\x15;'
+            b'\x9e\xba\x02U<\xa0\tak\xad,z\x08\xa1\x1b\xa3\xa0w\x05D|\xbc\x88\x1e\x9f\xa1\xfa\xa2\x1e\xb5\xe3&'
+            b',\x13\xa4\x90i\xd1T\xb43\xd3-\xba\xcb\x12\xfd\xf1|\xff)\x8b\xc7]\xa0j>w*I\xa6\xf9\xb8\xfe'
+            b'\xf2\x99P\x8c-\xa2\x81%\xa9\xbd\xe4D\xfcY\xaf\xbe\x95\xae\x83\xfb\xa0\x990\xc8\x1dv\xfdb\xd6&\xf8N'
+            b'\xedi\x1a\xb6\x86\x00]\xa1\xdb\xd9\xdd\x10j\xd7a\x0c\xcd\xef\xe050\xc8\xce+F\x87\xbe\xf5\xed\x9b;x'
+            b'\x07\xec\x04,\nz\x81\xe8\x9a\xdfzK\xd7\xa8\x06A\xbc&+\xbb(d\x99\xc5m\xf10\xb8E$s\x88'
+            b'_\r\xf2\xdaG\x02\x8e\x8e\xe0\xe0\xaa\x92\x04\xd6\x05B.\rM\xd1\n\xae\xe89\xd9\x83u\xb2,a\x83`'
+            b'\x1a\xa5\xa4\xdaF\xf4\xde\xace\x85\xbaq\x07\xd3!\xfc\x8b+\x00\x13\x98\x1f/\xe0\xf1\x04Ng\xb3\x99\xe7\x12'
+            b'\xd8<FO\x92O\xc9\xb5L\xfa\x9d\xa2\xad\xd3\xd9\xde\x7f\x0bW\xd1\x1f\xf0\x07'
+        ),
+    ),
+    1708,
+    2244684410,
+    (
+        (166139508, (1424558700, 2849117400, 2295672817, 3403372963, 1321710855, 2643421710, 3765424733, 464429819, 928859638, 1857719276, 3715438552, 1637558769, 3275117538, 1562222981, 3124445962, 2936504405, 2239629035, 3515681687, 2020282735, 4040565470, 987579389, 1975158778, 3950317556, 228268457, 456536914, 913073828, 1826147656, 3652295312, 1746023265, 3492046530, 2067385285, 4134770570)),
+    ),
+)
+
+# Slots: none
+SUCCESS_PAGE = (
+    b'HTTP/1.1 200 OK\r\nContent-Type: text/html; charset=utf-8\r\nContent-Encoding: gzip\r\nVary: Accept-Encoding\r\nCache-Control: no-store\r\nConnection: close\r\n',
+    (
+        (
+            b'\x1f\x8b\x08\x00\x00\x00\x00\x00\x02\xffE\x91\xc1n\xc3 \x10D\xef\xf9\x8a\r\xe7&VZ\xe5`\xc9\xa4\x87\xb4'
+            b'\xbd\xb6R+U9\x12\xd8\xc4\xabb\xb0\xd8\xb5#\xff}!N\x94\xd3\xc0j\xe6\xc1@\xb3|\xfb\xdc\xff\x1c'
+            b'\xbe\xde\xa1\x95\xce\xef\x16\xcd]\xd0\xb8,B\xe2q\xf7K\x1f\x04\xfb\x18\x02ZA\xd7T\xf3t\xd1t(\x06'
+            b'\x82\xe9P\xab\x91\xf0\xd2\xc7$\nl\x0c\x82A\xb4\xba\x90\x93V;\x1c\xc9\xe2\xea\xbay\x02\n$d\xfc\x8a'
+            b'\xad\xf1\xa87*C<\x85?H\xe8\xb5b\x99<r\x8b\x98)m\xc2\x93VUA\x1a\xbf\xb6\xcc\xaf\xa3\xae'
+            b'\x9f\xb7u\xfd\xb2\xadK\xaa\xba]\xf0\x18\xdd\x94\xc5\xd1\x08\xd6\x1bf\xad\xca\xf9\x86\x02\xa6bk7\xf71\x0f'
+            b'\xd6"\xb3\xda}\xcf\x8b\xd3\xe0\xfd\xf4(\xb5\xcc\xc4M\x0e\xf4w\x7f\x97=\xe6\x8c\x19r\x88C\x82\xb9\x06\x10'
+            b'C\x88\x97\xd2q\x8e\x81D(\xaf\xb3n\x8e\xe9\xea\x04kBFDF\x906\xbb\xfb\xcc\x00\x13\x1c\xb0\x98$'
+            b'00\x853L\x0f\xe2:W\xe9K\x9f\xdc\xa0\xc8\xadO5\x7f\xc3?\xc1*A\xc6\x9e\x01\x00\x00'
+        ),
+    ),
+    414,
+    0,
+    (),
+)
+
+# Slots: message
+ERROR_PAGE = (
+    b'HTTP/1.1 200 OK\r\nContent-Type: text/html; charset=utf-8\r\nContent-Encoding: gzip\r\nVary: Accept-Encoding\r\nCache-Control: no-store\r\nConnection: close\r\n',
+    (
+        (
+            b'\x1f\x8b\x08\x00\x00\x00\x00\x00\x02\xffl\x8f1O\xc40\x0c\x85\xf7\xfb\x15!3GU\xd0\r\x95\x9a2\x1c\xb0'
+            b'\xc2\xc0\xc2h\x92\x07\xb1p\x93Sb\xf5t\xff\x9e\x14\xe8\xc6\xf4\xc9\xcf\xcf\xcf\xf6x\xf5\xf0||}{y'
+            b'4Qg\x99v\xe3\x06PhPV\xc1t\xcc)\xc1+\xe7d\x9e\x88\x05a\xec~\x1b\xbbq\x86\x92I4'
+            b"\xc3\xd9\x85q>\xe5\xa2\xd6\xf8\x9c\x14I\x9d=s\xd0\xe8\x02\x16\xf6\xd8\xff\x14\xd7\x86\x13+\x93\xec\xab'\x81"
+            b'\xebm\x0b\x11N_\xa6@\x9c\xadz\x11\xd4\x08\xb4\x94X\xf0\xe1l\xb7F\x92\xdc\xf8Z\xef\x177\xdc\x1e\x86'
+            b'\xe1\xee0\xacS\xdd\xdf\x8d\xef9\\\x1a\x02/\xc6\x0b\xd5\xea\xec\xba\x9f8\xa1\xac\xb6\xd8o2J\xc9M\xfa'
+            b'\xe7\x9b\xd87\xe3i\xf3\xcd\xa8\x95>a\xa7o\x00\x00\x00\xff\xff'
+        ),
+        (
+            b'\xb3\xd1/\xb0\xe3\xb2I*-)\xc9\xcfS\xc8\xcfK\xce\xc9L\xce\xb6U*\xcf\xccK\xc9/\xd7\xcb\xc8,'
+            b'.\xc9/\xaa\xd4KJL\xce\xd6\xd0T\xb2\x0b)\xaaTpLO\xcc\xcc\xb3\xd1\x87\xe8\x00j\xd5O\xc9,'
+            b'\x03QI\xf9)\x95 :\xa3$7\xc7\x8e\x0b\x00'
+        ),
+    ),
+    372,
+    3849008024,
+    (
+        (3404092746, (2919054452, 2156625577, 3664247571, 1874784359, 3749568718, 1703593949, 3407187898, 1297750325, 2595500650, 3994641045, 121881451, 243762902, 487525804, 975051608, 1950103216, 3900206432, 193059969, 386119938, 772239876, 1544479752, 3088959504, 2873792097, 2380540547, 3233370951, 1510187215, 3020374430, 3011478909, 3180203195, 2691505975, 2611689519, 3962009119, 54520447)),
+    ),
+)
@@ -0,0 +1,161 @@
+"""
+Append-only journal of button presses made while offline.
+
+The file is an 8 byte header (magic + first sequence number) followed by fixed 12 byte records:
+
+    sequence number (uint32) | timestamp (uint32, seconds) | CRC32 of the first 8 bytes (uint32)
+
+Appending a press writes one record to the end of the file, so it costs the same however many presses
+are queued. A power cut can at worst leave a partial or corrupt last record; on load the journal keeps
+every record up to the first bad one and drops the rest.
+
+Sequence numbers keep counting across syncs, so the server can ignore a batch it has already seen.
+
+Example usage:
+
+    press_journal.append(utime.time())
+    for seq, timestamp in press_journal.records():
+        ...
+    press_journal.acknowledge(last_seq)   # after the server has stored everything up to last_seq
+"""
+import binascii
+import os
+import struct
+import json
+from config import Config
+
+_MAGIC = b"PJ01"
+_HEADER_FORMAT = "<4sI"
+_HEADER_SIZE = 8
+_RECORD_FORMAT = "<III"
+_RECORD_SIZE = 12
+
+class PressJournal:
+    def __init__(self, path):
+        self.path = path
+        self.base_seq = 0
+        self.count = 0
+        self.exists = False
+        self._loaded = False
+
+    def _load(self):
+        if self._loaded:
+            return
+        self._loaded = True
+        self._read_journal()
+        if not self.exists:
+            # Presses from the old JSON file are imported into a new journal, so only look for it then
+            self._migrate_json_presses()
+            if not self.exists:
+                # An empty journal saves probing for the old file on every boot
+                self._rewrite(self.base_seq, ())
+
+    def _read_journal(self):
+        """Read the header and validate the records, dropping a corrupt tail if there is one"""
+        try:
+            with open(self.path, "rb") as f:
+                header = f.read(_HEADER_SIZE)
+                if len(header) != _HEADER_SIZE or header[:4] != _MAGIC:
+                    raise ValueError("bad journal header")
+                self.base_seq = struct.unpack(_HEADER_FORMAT, header)[1]
+                valid = 0
+                record = bytearray(_RECORD_SIZE)
+                while f.readinto(record) == _RECORD_SIZE and self._valid(record, self.base_seq + valid):
+                    valid += 1
+                size = f.seek(0, 2)
+        except OSError:
+            # No journal yet, it is created on the first append
+            return
+        except ValueError as e:
+            print(f"[JOURNAL] Journal unreadable ({e}), starting a new one")
+            self._rewrite(self.base_seq, ())
+            return
+
+        self.exists = True
+        self.count = valid
+        if size != _HEADER_SIZE + valid * _RECORD_SIZE:
+            print(f"[JOURNAL] Dropping corrupt tail after {valid} records")
+            self._rewrite(self.base_seq, list(self.records()))
+
+    @staticmethod
+    def _valid(record, expected_seq):
+        seq, timestamp, crc = struct.unpack(_RECORD_FORMAT, record)
+        return seq == expected_seq and crc == binascii.crc32(memoryview(record)[:8]) & 0xFFFFFFFF
+
+    def append(self, timestamp):
+        """Append one press. Returns its sequence number."""
+        self._load()
+        if not self.exists:
+            self._rewrite(self.base_seq, ())
+        seq = self.base_seq + self.count
+        body = struct.pack("<II", seq, int(timestamp))
+        with open(self.path, "ab") as f:
+            f.write(body)
+            f.write(struct.pack("<I", binascii.crc32(body) & 0xFFFFFFFF))
+        self.count += 1
+        return seq
+
+    def __len__(self):
+        self._load()
+        return self.count
+
+    def records(self):
+        """Yield (seq, timestamp) for every valid record, reading the file one record at a time"""
+        self._load()
+        if not self.count:
+            return
+        record = bytearray(_RECORD_SIZE)
+        with open(self.path, "rb") as f:
+            f.seek(_HEADER_SIZE)
+            for _ in range(self.count):
+                f.readinto(record)
+                seq, timestamp, _ = struct.unpack(_RECORD_FORMAT, record)
+                yield seq, timestamp
+
+    def last_seq(self):
+        self._load()
+        return self.base_seq + self.count - 1 if self.count else None
+
+    def acknowledge(self, last_seq):
+        """
+        Drop every record up to and including last_seq, once the server has confirmed it has them.
+        An ack for records that were already dropped (last_seq below base_seq) changes nothing.
+        """
+        self._load()
+        if not self.count or last_seq < self.base_seq:
+            return
+        last_seq = min(last_seq, self.last_seq())
+        remaining = []
+        if last_seq < self.last_seq():
+            # Presses queued while the upload was in flight
+            remaining = [(seq, timestamp) for seq, timestamp in self.records() if seq > last_seq]
+        self._rewrite(last_seq + 1, remaining)
+
+    def _rewrite(self, base_seq, records):
+        """Write a new journal to a temporary file, then rename it over the old one"""
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(struct.pack(_HEADER_FORMAT, _MAGIC, base_seq))
+            for seq, timestamp in records:
+                body = struct.pack("<II", seq, timestamp)
+                f.write(body)
+                f.write(struct.pack("<I", binascii.crc32(body) & 0xFFFFFFFF))
+        os.rename(tmp_path, self.path)
+        self.exists = True
+        self.base_seq = base_seq
+        self.count = len(records)
+
+    def _migrate_json_presses(self):
+        """One-time import of presses queued in the old offline_presses.json format"""
+        try:
+            with open(Config.LEGACY_OFFLINE_PRESSES_FILE, "r") as f:
+                presses = json.load(f)
+        except (OSError, ValueError):
+            return
+        print(f"[JOURNAL] Migrating {len(presses)} presses from {Config.LEGACY_OFFLINE_PRESSES_FILE}")
+        for press_time in presses:
+            self.append(press_time)
+        os.remove(Config.LEGACY_OFFLINE_PRESSES_FILE)
+
+# Global press journal instance
+press_journal = PressJournal(Config.OFFLINE_PRESSES_FILE)
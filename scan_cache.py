@@ -0,0 +1,60 @@
+"""
+Cache of the WiFi networks in range, for the provisioning page's network picker.
+
+WLAN.scan() blocks for a couple of seconds, so it never runs on a request: refresh() is called from a
+background task (through the network worker) and requests only ever read the cache. The networks are
+deduplicated by SSID (keeping the strongest access point), hidden networks are left out, and the rest
+are sorted strongest first. The JSON the page fetches is encoded once per scan.
+
+Example usage:
+
+    scan_cache = ScanCache()
+    await network_worker.call(scan_cache.refresh)
+    scan_cache.json             # b'[["Home WiFi",-48,3],["Cafe",-71,0]]' (ssid, rssi, authmode)
+    scan_cache.in_range("Cafe") # True, False, or None if there is no scan to go by
+"""
+import json
+import network
+import utime
+from config import Config
+
+class ScanCache:
+    def __init__(self):
+        self.json = b"[]"
+        self._ssids = ()
+        self._scan_ticks = None
+        self.scans = 0
+
+    def is_stale(self):
+        return self._scan_ticks is None or utime.ticks_diff(utime.ticks_ms(), self._scan_ticks) >= Config.SOFTAP_SCAN_TTL_MS
+
+    def in_range(self, ssid):
+        """
+        Whether the last scan saw ssid, or None if there hasn't been a scan that found anything (so it
+        can't be ruled out). A stale scan still counts: networks rarely come into range while the page
+        is open, and the page asks for a new scan whenever it loads.
+        """
+        if not self._ssids:
+            return None
+        return ssid in self._ssids
+
+    def refresh(self):
+        """Scan for networks. Blocks for the length of the scan, so call it through the network worker."""
+        start = utime.ticks_ms()
+        wlan = network.WLAN(network.STA_IF)
+        wlan.active(True)
+        strongest = {}
+        for ssid, _, _, rssi, authmode, _ in wlan.scan():
+            try:
+                ssid = ssid.decode()
+            except UnicodeError:
+                continue
+            if ssid and (ssid not in strongest or rssi > strongest[ssid][0]):
+                strongest[ssid] = (rssi, authmode)
+        networks = sorted(strongest.items(), key=lambda item: item[1][0], reverse=True)
+        del networks[Config.SOFTAP_SCAN_MAX_NETWORKS:]
+        self.json = json.dumps([[ssid, rssi, authmode] for ssid, (rssi, authmode) in networks], separators=(",", ":")).encode()
+        self._ssids = set(strongest)
+        self._scan_ticks = utime.ticks_ms()
+        self.scans += 1
+        print(f"[SCAN] {len(strongest)} networks in range, scanned in {utime.ticks_diff(self._scan_ticks, start)}ms")
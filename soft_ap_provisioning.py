@@ -1,14 +1,82 @@
 import network
-import socket
+import struct
 import sys
-import json
-import select
 import time
+import binascii
+import uasyncio as asyncio
+import portal_pages
+from http_request import HttpRequest, HttpError, STATUS_REASONS
+from captive_dns import CaptiveDns
+from scan_cache import ScanCache
 from config import Config
 from device_id import DeviceID
 from event_bus import event_bus, Events
+from network_worker import network_worker
+
+# Shown on the error page for the last status handle_wifi_credentials reported
+_FAILURE_MESSAGES = {
+    b"FAILED": b"Unable to connect to the WiFi network.<br>Please check your credentials.",
+    b"FAILED - INVALID SHORT CODE": b"Connected to WiFi, but the setup code was not accepted.<br>Please check the code.",
+    b"FAILED - NETWORK NOT FOUND": b"That WiFi network is not in range.<br>Pick one from the list, or tick Hidden network.",
+}
+
+_JSON_HEAD = b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\nCache-Control: no-store\r\nConnection: close\r\nContent-Length: %d\r\n\r\n"
+
+# Sends the OS that probed for a captive portal straight to ours, so it pops up the portal at once
+_REDIRECT = b"HTTP/1.1 302 Found\r\nLocation: http://%s/\r\nContent-Length: 0\r\nCache-Control: no-store\r\nConnection: close\r\n\r\n" % Config.SOFTAP_IP.encode()
+_NOT_FOUND = b"HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\nConnection: close\r\n\r\n"
+
+# Paths answered without serving a page: connectivity probes get the redirect, icons a 404
+_ROUTES = {
+    b"/generate_204": _REDIRECT,            # Android, ChromeOS
+    b"/gen_204": _REDIRECT,                 # Android, Chrome
+    b"/hotspot-detect.html": _REDIRECT,     # iOS, macOS
+    b"/library/test/success.html": _REDIRECT,  # older iOS
+    b"/connecttest.txt": _REDIRECT,         # Windows 10 and later
+    b"/ncsi.txt": _REDIRECT,                # older Windows
+    b"/redirect": _REDIRECT,                # Windows, after the probe
+    b"/canonical.html": _REDIRECT,          # Firefox
+    b"/success.txt": _REDIRECT,             # Firefox
+    b"/favicon.ico": _NOT_FOUND,
+    b"/apple-touch-icon.png": _NOT_FOUND,
+    b"/apple-touch-icon-precomposed.png": _NOT_FOUND,
+    b"/robots.txt": _NOT_FOUND,
+}
+
+def _crc32_fold(crc, fold):
+    """binascii.crc32(segment, crc) for a segment, from its fold (see build_portal.crc_fold)"""
+    result, columns = fold
+    bit = 0
+    while crc:
+        if crc & 1:
+            result ^= columns[bit]
+        crc >>= 1
+        bit += 1
+    return result
+
+async def _readable(sock):
+    """Wait until a non-blocking socket has data, without blocking the scheduler (streams only cover TCP)"""
+    yield asyncio.core._io_queue.queue_read(sock)
 
 class SoftAPProvisioning:
+    """
+    Captive portal for entering the WiFi credentials and setup code.
+
+    The web server and the DNS responder run as uasyncio tasks, so the parallel connections a phone
+    opens (captive-portal probes, favicon, the page itself) are served side by side and a slow client
+    never holds up DNS. At most Config.SOFTAP_MAX_CLIENTS connections are served at once, each of which
+    has Config.SOFTAP_CLIENT_TIMEOUT_SEC to send its request. The connection attempt itself runs on the
+    network worker thread, so the portal keeps answering while it is in progress.
+
+    The connectivity probes of Android, iOS/macOS, Windows and Firefox get a precomputed redirect to the
+    portal rather than the page, so the OS pops the portal up straight away.
+
+    The page offers the networks in range from a scan made in the background (see ScanCache), and a
+    network that the scan didn't see is turned down at once rather than after a full connect attempt.
+
+    The pages are pre-rendered and gzip-compressed by build_portal.py (see portal_pages.py) and streamed
+    in SOFTAP_SEND_CHUNK_BYTES slices straight from those byte strings.
+    """
     def __init__(self, handle_wifi_credentials):
         self.handle_wifi_credentials = handle_wifi_credentials
         # First deactivate any existing WiFi interfaces
@@ -20,60 +88,84 @@ class SoftAPProvisioning:
         time.sleep(1)  # Give it a moment to clean up
         
         self.web_server = None
-        self.dns_server = None
+        self.dns = CaptiveDns(Config.SOFTAP_IP)
+        self.scan_cache = ScanCache()
+        self.scan_wanted = None
         self.ssid = f"ESP32_Setup_{DeviceID.get_id()[:6]}"
+        self._ssid_bytes = self.ssid.encode()
         self.connected = False
+        self.done = None
+        # One request buffer per client that can be served at once, allocated up front
+        self._free_requests = [HttpRequest(Config.SOFTAP_REQUEST_BUFFER_BYTES) for _ in range(Config.SOFTAP_MAX_CLIENTS)]
+        self.rejected_clients = 0
         event_bus.publish(Events.ENTERING_PAIRING_MODE)
         
         # Now configure and activate AP
         self.ap.active(True)
         self.ap.config(essid=self.ssid, authmode=network.AUTH_OPEN)
-        self.ap.ifconfig(('192.168.4.1', '255.255.255.0', '192.168.4.1', '192.168.4.1'))
+        self.ap.ifconfig((Config.SOFTAP_IP, Config.SOFTAP_SUBNET, Config.SOFTAP_IP, Config.SOFTAP_IP))
 
     def start(self):
-        """Start the SoftAP and web server"""
+        """Start the SoftAP and serve the portal until credentials that work have been submitted"""
         self._setup_ap()
-        self._start_web_server()
-        self.await_credentials_then_disconnect()
+        asyncio.run(self._serve())
+        asyncio.new_event_loop()
+        self.disconnect()
 
     def _setup_ap(self):
         """Configure and start the access point"""
         self.ap.active(True)
         self.ap.config(essid=self.ssid)
         print(f"[SoftAP] Access Point started. SSID: {self.ssid}")
-        print(f"[SoftAP] Connect to {self.ssid} and visit http://192.168.4.1")
+        print(f"[SoftAP] Connect to {self.ssid} and visit http://{Config.SOFTAP_IP}")
 
-    def _start_web_server(self):
-        """Start the web server and DNS server for the captive portal"""
-        self.web_server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.web_server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        self.web_server.bind(('0.0.0.0', 80))
-        self.web_server.listen(1)
-        
-        self.dns_server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        self.dns_server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        self.dns_server.bind(('0.0.0.0', 53))
+    async def _serve(self):
+        """Run the web server, DNS responder and event dispatcher until a connection attempt succeeds"""
+        self.done = asyncio.Event()
+        self.scan_wanted = asyncio.Event()
+        self.web_server = await asyncio.start_server(
+            self._handle_web_client, "0.0.0.0", 80, backlog=Config.SOFTAP_MAX_CLIENTS
+        )
+        self.dns.open()
         print("[SoftAP] Web and DNS servers started")
+        tasks = (
+            asyncio.create_task(self._run_dns_server()),
+            asyncio.create_task(self._run_scanner()),
+            asyncio.create_task(event_bus.run_dispatcher()),
+        )
+        try:
+            await self.done.wait()
+        finally:
+            for task in tasks:
+                task.cancel()
+            self.web_server.close()
+            await self.web_server.wait_closed()
+            self.web_server = None
 
-    def await_credentials_then_disconnect(self):
-        """Wait for WiFi credentials to be submitted, then shut down AP mode"""
-        while not self.connected:
-            r, w, err = select.select([self.web_server, self.dns_server], [], [], 1)
-            
-            for sock in r:
-                if sock is self.web_server:
-                    self._handle_web_client()
-                elif sock is self.dns_server:
-                    self._handle_dns_request()
+    async def _run_dns_server(self):
+        while True:
+            await _readable(self.dns.sock)
+            if self.dns.handle_pending() == Config.SOFTAP_DNS_BURST:
+                # Still more waiting; let the web clients have a turn first
+                await asyncio.sleep_ms(0)
 
-        self.disconnect()
+    async def _run_scanner(self):
+        """Scan straight away, then again whenever the page asks for networks and the scan is stale"""
+        while True:
+            try:
+                await network_worker.call(self.scan_cache.refresh)
+            except Exception as e:
+                print(f"[SoftAP] Error scanning for networks: {e}")
+            self.scan_wanted.clear()
+            await self.scan_wanted.wait()
 
     def disconnect(self):
         """Clean up and shut down AP mode"""
         if self.web_server:
             self.web_server.close()
-        if self.dns_server:
-            self.dns_server.close()
+            self.web_server = None
+        self.dns.close()
+        self.dns.print_stats()
         
         # Make sure to deactivate AP
         self.ap.active(False)
@@ -82,282 +174,164 @@ class SoftAPProvisioning:
         event_bus.publish(Events.EXITING_PAIRING_MODE)
         print("[SoftAP] SoftAP provisioning completed and shut down")
 
-    def _handle_web_client(self):
-        """Handle incoming web requests"""
+    async def _handle_web_client(self, reader, writer):
+        """Serve one connection, turning it away straight away if too many are already being served"""
+        if not self._free_requests:
+            self.rejected_clients += 1
+            print(f"[SoftAP] Too many clients, dropped a connection ({self.rejected_clients} so far)")
+            await self._close(writer)
+            return
+
+        request = self._free_requests.pop()
         try:
-            client, addr = self.web_server.accept()
-            request = client.recv(1024).decode()
-            
-            if "POST /configure" in request:
-                # Extract credentials from POST data
-                content_length = int(request.split("Content-Length: ")[1].split("\r\n")[0])
-                post_data = request.split("\r\n\r\n")[1][:content_length]
-                credentials = self._parse_credentials(post_data)
-                
-                if credentials:
-                    success = self._try_connection(credentials, client)
-                    if success:
-                        self.connected = True
+            if not await asyncio.wait_for(self._read_request(reader, request), Config.SOFTAP_CLIENT_TIMEOUT_SEC):
+                return
+            if request.method == b"POST" and request.path == b"/configure":
+                credentials = self._parse_credentials(request)
+                if credentials and not credentials["hidden"] and self.scan_cache.in_range(credentials["ssid"]) is False:
+                    print(f"[SoftAP] {credentials['ssid']} is not in range, not trying it")
+                    await self._send_page(writer, portal_pages.ERROR_PAGE, _FAILURE_MESSAGES[b"FAILED - NETWORK NOT FOUND"])
+                elif credentials:
+                    await self._try_connection(credentials, writer)
+                else:
+                    await self._send_page(writer, portal_pages.ERROR_PAGE, _FAILURE_MESSAGES[b"FAILED"])
+            elif request.path == b"/networks.json":
+                await self._send_networks(writer)
+            elif request.path in _ROUTES:
+                await self._send_response(writer, _ROUTES[request.path])
+            elif request.path.startswith(b"/portal.css"):
+                await self._send_page(writer, portal_pages.STYLE)
             else:
                 # Serve the configuration page
-                self._serve_config_page(client)
-            
-            client.close()
-            
+                await self._send_page(writer, portal_pages.CONFIG_PAGE, self._ssid_bytes)
+        except HttpError as e:
+            print(f"[SoftAP] Bad request: {e}")
+            await self._send_status(writer, e.status)
+        except asyncio.TimeoutError:
+            print("[SoftAP] Client timed out")
         except Exception as e:
             print(f"[SoftAP] Error handling web client: {e}")
             sys.print_exception(e)
+        finally:
+            self._free_requests.append(request)
+            await self._close(writer)
 
-    def _handle_dns_request(self):
-        """Handle DNS queries with a redirect to our IP"""
-        try:
-            data, addr = self.dns_server.recvfrom(1024)
-            # Simple DNS response pointing all requests to 192.168.4.1
-            response = (
-                data[:2]  # Transaction ID
-                + b'\x81\x80'  # Flags (Standard response)
-                + data[4:6]  # Questions
-                + data[4:6]  # Answer RRs
-                + b'\x00\x00'  # Authority RRs
-                + b'\x00\x00'  # Additional RRs
-                + data[12:]    # Original query
-                + b'\xc0\x0c'  # Pointer to domain name
-                + b'\x00\x01'  # Type A
-                + b'\x00\x01'  # Class IN
-                + b'\x00\x00\x00\x3c'  # TTL (60 seconds)
-                + b'\x00\x04'  # Data length
-                + bytes(map(int, '192.168.4.1'.split('.')))  # IP address
-            )
-            self.dns_server.sendto(response, addr)
-        except Exception as e:
-            print(f"[SoftAP] Error handling DNS request: {e}")
+    async def _read_request(self, reader, request):
+        """Read a request into request. False if the client closed the connection without sending one."""
+        request.reset()
+        while True:
+            count = await reader.readinto(request.space())
+            if not count and request.is_empty():
+                return False
+            if request.feed(count):
+                return True
+
+    async def _send_networks(self, writer):
+        """The networks from the last scan, as JSON. Never scans; asks the scanner for a new scan if it's stale."""
+        if self.scan_cache.is_stale():
+            self.scan_wanted.set()
+        body = self.scan_cache.json
+        await self._send_response(writer, _JSON_HEAD % len(body))
+        await self._send_response(writer, body)
 
-    def _parse_credentials(self, post_data):
-        """Parse the POST data to extract WiFi credentials"""
+    async def _send_status(self, writer, status):
+        """A bodyless response, for requests that can't be served"""
+        await self._send_response(writer, b"HTTP/1.1 %d %s\r\nContent-Length: 0\r\nConnection: close\r\n\r\n" % (status, STATUS_REASONS[status]))
+
+    @staticmethod
+    async def _close(writer):
         try:
-            params = {}
-            for param in post_data.split("&"):
-                key, value = param.split("=")
-                params[key] = value.replace("+", " ")
-            return {
-                "ssid": params.get("ssid", ""),
-                "password": params.get("password", ""),
-                "setup_code": params.get("setup_code", "")
-            }
-        except:
-            return None
+            writer.close()
+            await writer.wait_closed()
+        except OSError:
+            pass
 
-    def _try_connection(self, credentials, client):
-        """Attempt to connect to WiFi with provided credentials"""
-        # Close the servers temporarily before making the API call
-        self.web_server.close()
-        self.dns_server.close()
-        time.sleep(1)  # Give time for sockets to close properly
-        
-        # Pass an empty callback since we'll show the result page instead
-        success = self.handle_wifi_credentials(
-            credentials["ssid"],
-            credentials["password"],
-            credentials["setup_code"],
-            lambda status: None  # Empty callback
-        )
-        
-        # Reopen the servers if connection failed
-        if not success:
-            self._start_web_server()
-            self._serve_error_page(client)
-        else:
-            self._serve_success_page(client)
-        
-        time.sleep(2)
-        return success
+    @staticmethod
+    async def _send_response(writer, response):
+        try:
+            writer.write(response)
+            await asyncio.wait_for(writer.drain(), Config.SOFTAP_CLIENT_TIMEOUT_SEC)
+        except (OSError, asyncio.TimeoutError):
+            pass
 
+    async def _send_page(self, writer, page, *values):
+        """Send a page from portal_pages, filling its slots with values (bytes, inserted as they are)"""
+        await asyncio.wait_for(self._stream_page(writer, page, values), Config.SOFTAP_CLIENT_TIMEOUT_SEC)
 
-    def _serve_success_page(self, client):
-        """Serve a success page when WiFi connection is established"""
-        html = f"""
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <title>WiFi Connected</title>
-            <meta name="viewport" content="width=device-width, initial-scale=1">
-            <style>
-                {self._get_common_styles()}
-            </style>
-        </head>
-        <body>
-            <div class="container">
-                <h1 class="success">Successfully Connected!</h1>
-                <p class="message">
-                    Your device is now connected to WiFi.<br>
-                    You can close this page and start using your device.
-                </p>
-            </div>
-        </body>
-        </html>
+    @staticmethod
+    async def _stream_page(writer, page, values):
         """
-        response = f"HTTP/1.1 200 OK\r\nContent-Type: text/html\r\n\r\n{html}"
-        client.send(response.encode())
-
-    def _serve_error_page(self, client):
-        """Serve an error page when WiFi connection fails"""
-        html = f"""
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <title>Connection Failed</title>
-            <meta name="viewport" content="width=device-width, initial-scale=1">
-            <style>
-                {self._get_common_styles()}
-            </style>
-        </head>
-        <body>
-            <div class="container">
-                <h1 class="error">Connection Failed</h1>
-                <p class="message">Unable to connect to the WiFi network.<br>Please check your credentials.</p>
-                <button onclick="window.history.back()">Try Again</button>
-            </div>
-        </body>
-        </html>
+        Each value goes into the gzip stream as a stored deflate block between the pre-compressed
+        segments, and the CRC32 is carried across the segments with their folds. The segments are
+        written one MTU-sized memoryview slice at a time, so no copy of them is ever made.
         """
-        response = f"HTTP/1.1 200 OK\r\nContent-Type: text/html\r\n\r\n{html}"
-        client.send(response.encode())
+        head, segments, size, crc, folds = page
+        length = 0
+        for segment in segments:
+            length += len(segment)
+        for value in values:
+            length += 5 + len(value)
+        if values:
+            # The gzip trailer, which is already part of the segment when there are no slots
+            length += 8
+        writer.write(head)
+        writer.write(b"Content-Length: %d\r\n\r\n" % length)
+
+        chunk = Config.SOFTAP_SEND_CHUNK_BYTES
+        for index, segment in enumerate(segments):
+            if index:
+                value = values[index - 1]
+                writer.write(struct.pack("<BHH", 0, len(value), len(value) ^ 0xFFFF))
+                writer.write(value)
+                crc = _crc32_fold(binascii.crc32(value, crc), folds[index - 1])
+                size += len(value)
+            view = memoryview(segment)
+            for offset in range(0, len(segment), chunk):
+                writer.write(view[offset:offset + chunk])
+                await writer.drain()
+        if values:
+            writer.write(struct.pack("<II", crc, size))
+            await writer.drain()
 
-    def _serve_config_page(self, client):
-        """Serve the WiFi configuration page"""
-        html = f"""
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <title>ESP32 WiFi Setup</title>
-            <meta name="viewport" content="width=device-width, initial-scale=1">
-            <style>
-                {self._get_common_styles()}
-            </style>
-        </head>
-        <body>
-            <div class="container">
-                <h1>Connect <span class="device-name">{self.ssid}</span> to WiFi</h1>
-                <form method="POST" action="/configure">
-                    <div class="form-group">
-                        <label for="setup-code">Device Setup Code</label>
-                        <input type="text" id="setup-code" name="setup_code" 
-                               class="setup-code" maxlength="4" 
-                               placeholder="Enter 4-character code" required>
-                    </div>
-                    <div class="form-group">
-                        <label for="ssid">WiFi Network Name</label>
-                        <input type="text" id="ssid" name="ssid" placeholder="Enter WiFi name" required value="Nest Router">
-                    </div>
-                    <div class="form-group">
-                        <label for="password">WiFi Password</label>
-                        <input type="password" id="password" name="password" placeholder="Enter WiFi password" required value="ACRES-let-nea">
-                    </div>
-                    <button type="submit">Connect</button>
-                </form>
-            </div>
-        </body>
-        </html>
+    def _parse_credentials(self, request):
+        """The WiFi credentials and setup code from the submitted form, or None if it isn't one"""
+        try:
+            params = request.form()
+        except HttpError as e:
+            print(f"[SoftAP] Bad form data: {e}")
+            return None
+        if "ssid" not in params:
+            return None
+        return {
+            "ssid": params["ssid"],
+            "password": params.get("password", ""),
+            "setup_code": params.get("setup_code", ""),
+            "hidden": params.get("hidden") == "1"
+        }
+
+    async def _try_connection(self, credentials, writer):
         """
-        response = f"HTTP/1.1 200 OK\r\nContent-Type: text/html\r\n\r\n{html}"
-        client.send(response.encode())
-    def _get_common_styles(self):
-        """Return common CSS styles used across all pages"""
-        return """
-            body {
-                font-family: -apple-system, BlinkMacSystemFont, "Segoe UI", Roboto, sans-serif;
-                margin: 0;
-                padding: 20px;
-                background: #f5f5f7;
-                color: #1d1d1f;
-            }
-            .container {
-                max-width: 400px;
-                margin: 0 auto;
-                background: white;
-                padding: 25px;
-                border-radius: 15px;
-                box-shadow: 0 2px 10px rgba(0, 0, 0, 0.1);
-            }
-            h1 {
-                text-align: center;
-                margin-bottom: 25px;
-                font-size: 24px;
-                font-weight: 600;
-            }
-            input {
-                width: 100%;
-                padding: 12px;
-                margin: 10px 0;
-                border: 1px solid #d2d2d7;
-                border-radius: 8px;
-                box-sizing: border-box;
-                font-size: 16px;
-                transition: border-color 0.2s;
-            }
-            input:focus {
-                outline: none;
-                border-color: #0071e3;
-            }
-            button {
-                width: 100%;
-                padding: 12px;
-                background: #0071e3;
-                color: white;
-                border: none;
-                border-radius: 8px;
-                font-size: 16px;
-                font-weight: 500;
-                cursor: pointer;
-                transition: background-color 0.2s;
-            }
-            button:hover {
-                background: #0077ED;
-            }
-            .success {
-                color: #28a745;
-            }
-            .error {
-                color: #dc3545;
-            }
-            .success-icon {
-                font-size: 48px;
-                margin-bottom: 20px;
-            }
-            .message {
-                text-align: center;
-                line-height: 1.5;
-            }
-            .error-icon {
-                font-size: 48px;
-                margin-bottom: 20px;
-                text-align: center;
-            }
-            .message {
-                text-align: center;
-                line-height: 1.5;
-                margin-bottom: 20px;
-            }
-            .form-group {
-                margin-bottom: 15px;
-            }
-            .form-group label {
-                display: block;
-                margin-bottom: 5px;
-                font-weight: 500;
-            }
-            .device-name {
-                color: #0071e3;
-                font-weight: 600;
-            }
-            .setup-code {
-                font-size: 24px;
-                letter-spacing: 2px;
-                text-transform: uppercase;
-                text-align: center;
-            }
-            .setup-code::-webkit-input-placeholder {
-                font-size: 16px;
-                letter-spacing: normal;
-            }
+        Attempt to connect to WiFi with the provided credentials. The attempt runs on the network worker
+        thread, so the portal and DNS keep being served meanwhile.
         """
+        statuses = []
+        try:
+            success = await network_worker.call(
+                self.handle_wifi_credentials,
+                credentials["ssid"],
+                credentials["password"],
+                credentials["setup_code"],
+                statuses.append
+            )
+        except Exception as e:
+            print(f"[SoftAP] Error trying the WiFi credentials: {e}")
+            success = False
+
+        if success:
+            await self._send_page(writer, portal_pages.SUCCESS_PAGE)
+            self.connected = True
+            self.done.set()
+        else:
+            message = _FAILURE_MESSAGES.get(statuses[-1] if statuses else None, _FAILURE_MESSAGES[b"FAILED"])
+            await self._send_page(writer, portal_pages.ERROR_PAGE, message)
+        return success
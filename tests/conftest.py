@@ -0,0 +1,263 @@
+import _thread
+import asyncio
+import calendar
+import gc
+import os
+import pytest
+import struct
+import sys
+import time
+import traceback
+import types
+
+# The modules live at the top level of the repo, as they do on the device's filesystem
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Stand-ins for the MicroPython modules and builtins the firmware imports, so the modules that don't
+# touch hardware can be run under CPython. Only what the firmware actually uses is provided.
+
+def _module(name, **attributes):
+    module = types.ModuleType(name)
+    module.__dict__.update(attributes)
+    sys.modules[name] = module
+    return module
+
+def _ticks_ms():
+    return int(time.monotonic() * 1000)
+
+def _ticks_us():
+    return int(time.monotonic() * 1000000)
+
+def _ticks_add(ticks, delta):
+    return ticks + delta
+
+def _ticks_diff(end, start):
+    return end - start
+
+def _sleep_ms(ms):
+    time.sleep(ms / 1000)
+
+# MicroPython's time module has the ticks functions too
+for _name, _function in (("ticks_ms", _ticks_ms), ("ticks_us", _ticks_us), ("ticks_add", _ticks_add),
+                         ("ticks_diff", _ticks_diff), ("sleep_ms", _sleep_ms)):
+    if not hasattr(time, _name):
+        setattr(time, _name, _function)
+
+_module(
+    "utime",
+    ticks_ms=_ticks_ms,
+    ticks_us=_ticks_us,
+    ticks_add=_ticks_add,
+    ticks_diff=_ticks_diff,
+    sleep_ms=_sleep_ms,
+    sleep=time.sleep,
+    time=lambda: int(time.time()),
+    time_ns=time.time_ns,
+    gmtime=lambda seconds=None: time.gmtime(seconds),
+    localtime=lambda seconds=None: time.gmtime(seconds),
+    mktime=lambda t: calendar.timegm(tuple(t[:6]) + (0, 0, 0)),
+)
+
+_module("micropython", const=lambda value: value, alloc_emergency_exception_buf=lambda size: None)
+
+class _RTC:
+    def datetime(self, value=None):
+        return time.gmtime()
+
+class _Pin:
+    IN = OUT = PULL_UP = PULL_DOWN = IRQ_FALLING = IRQ_RISING = 0
+
+    def __init__(self, *args, **kwargs):
+        self._value = 0
+
+    def irq(self, *args, **kwargs):
+        pass
+
+    def value(self, value=None):
+        if value is None:
+            return self._value
+        self._value = value
+
+class _Timer:
+    ONE_SHOT = PERIODIC = 0
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def init(self, *args, **kwargs):
+        pass
+
+    def deinit(self):
+        pass
+
+_module(
+    "machine",
+    RTC=_RTC,
+    Pin=_Pin,
+    PWM=_Pin,
+    Timer=_Timer,
+    unique_id=lambda: b"\x24\x6f\x28\xaa\xbb\xcc",
+    disable_irq=lambda: 0,
+    enable_irq=lambda state: None,
+)
+
+class _WLAN:
+    """A station that is connected unless a test says otherwise (network.WLAN.connected = False)"""
+    connected = True
+
+    def __init__(self, interface=0):
+        self.interface = interface
+
+    def active(self, *args):
+        return True
+
+    def isconnected(self):
+        return _WLAN.connected
+
+    def config(self, *args, **kwargs):
+        return None
+
+    def ifconfig(self, *args):
+        return ("192.168.1.50", "255.255.255.0", "192.168.1.1", "192.168.1.1")
+
+_module("network", STA_IF=0, AP_IF=1, AUTH_OPEN=0, WLAN=_WLAN)
+
+def _ntp_unreachable():
+    raise OSError("NTP is not reachable from the tests")
+
+_module("ntptime", time=_ntp_unreachable)
+
+class ThreadSafeFlag:
+    """uasyncio.ThreadSafeFlag: set() may be called from any thread, wait() clears it"""
+    def __init__(self):
+        self._loop = None
+        self._event = None
+        self._pending = False
+
+    def set(self):
+        if self._loop is None:
+            self._pending = True
+            return
+        try:
+            self._loop.call_soon_threadsafe(self._event.set)
+        except RuntimeError:
+            # The test that was waiting has finished and closed its loop
+            pass
+
+    async def wait(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._event = asyncio.Event()
+            if self._pending:
+                self._pending = False
+                self._event.set()
+        await self._event.wait()
+        self._event.clear()
+
+_uasyncio = _module("uasyncio", ThreadSafeFlag=ThreadSafeFlag, sleep_ms=lambda ms: asyncio.sleep(ms / 1000))
+for _name in ("CancelledError", "Event", "TimeoutError", "create_task", "gather", "new_event_loop",
+              "open_connection", "run", "sleep", "start_server", "wait_for"):
+    setattr(_uasyncio, _name, getattr(asyncio, _name))
+
+# CPython's threads need far bigger stacks than the ESP32's, so the size the firmware asks for is ignored
+_thread.stack_size = lambda size=0: 0
+
+if not hasattr(sys, "print_exception"):
+    sys.print_exception = lambda exception, file=None: traceback.print_exception(exception, file=file)
+if not hasattr(gc, "mem_alloc"):
+    gc.mem_alloc = lambda: 0
+    gc.mem_free = lambda: 0
+
+
+@pytest.fixture
+def fresh_boot(tmp_path, monkeypatch):
+    """An empty filesystem as the working directory, and the modules' singletons as they are at boot"""
+    monkeypatch.chdir(tmp_path)
+    from config import Config
+    from device_id import DeviceID
+    from kv_store import kv_store
+    from press_journal import press_journal
+    from timer_cache import timer_cache
+    kv_store.__init__(Config.KV_STORE_FILE)
+    press_journal.__init__(Config.OFFLINE_PRESSES_FILE)
+    timer_cache.__init__()
+    DeviceID._device_id = None
+    return tmp_path
+
+
+def dns_query(name, qtype=1, query_id=0x1234, edns=False):
+    """A standard recursive query for name, with an EDNS OPT record advertising 1232 bytes if edns"""
+    packet = struct.pack(">HHHHHH", query_id, 0x0100, 1, 0, 0, 1 if edns else 0)
+    for label in name.split("."):
+        packet += bytes((len(label),)) + label.encode()
+    packet += struct.pack(">BHH", 0, qtype, 1)
+    if edns:
+        packet += struct.pack(">BHHIH", 0, 41, 1232, 0, 0)
+    return packet
+
+async def http_get(port, path, host="192.168.4.1"):
+    """GET path from the portal as a browser would. Returns the status line, the headers and the body."""
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(b"GET %s HTTP/1.1\r\nHost: %s\r\nAccept-Encoding: gzip\r\nConnection: close\r\n\r\n"
+                 % (path.encode(), host.encode()))
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    head, _, body = response.partition(b"\r\n\r\n")
+    status, *lines = head.split(b"\r\n")
+    headers = {}
+    for line in lines:
+        name, _, value = line.partition(b":")
+        headers[name.strip().lower()] = value.strip()
+    return status, headers, body
+
+class _StreamReader:
+    """MicroPython's Stream.readinto(), over a CPython StreamReader"""
+    def __init__(self, reader):
+        self.reader = reader
+
+    async def readinto(self, buf):
+        data = await self.reader.read(len(buf))
+        buf[:len(data)] = data
+        return len(data)
+
+class Portal:
+    """A SoftAPProvisioning serving over loopback: its web server on web_port and its DNS on dns_port"""
+    def __init__(self, provisioning):
+        self.provisioning = provisioning
+        self.web_server = None
+        self.web_port = None
+        self.dns_port = None
+
+    async def start(self):
+        import socket
+        provisioning = self.provisioning
+        provisioning.done = asyncio.Event()
+        provisioning.scan_wanted = asyncio.Event()
+        self.web_server = await asyncio.start_server(
+            lambda reader, writer: provisioning._handle_web_client(_StreamReader(reader), writer), "127.0.0.1", 0
+        )
+        self.web_port = self.web_server.sockets[0].getsockname()[1]
+        # CaptiveDns.open() binds port 53 on every interface; the tests use a loopback port instead
+        dns = provisioning.dns
+        dns.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        dns.sock.bind(("127.0.0.1", 0))
+        dns.sock.setblocking(False)
+        self.dns_port = dns.sock.getsockname()[1]
+        # _run_dns_server waits on uasyncio's I/O queue; CPython's loop calls back when the socket is readable
+        asyncio.get_running_loop().add_reader(dns.sock, dns.handle_pending)
+
+    async def stop(self):
+        asyncio.get_running_loop().remove_reader(self.provisioning.dns.sock)
+        self.provisioning.dns.close()
+        self.web_server.close()
+        await self.web_server.wait_closed()
+
+@pytest.fixture
+def portal(fresh_boot, monkeypatch):
+    """A captive portal whose connection attempts fail, ready to start() inside a test's event loop"""
+    import soft_ap_provisioning
+    # Skip the second-long pauses that give the real radio time to settle
+    monkeypatch.setattr(soft_ap_provisioning, "time", types.SimpleNamespace(sleep=lambda seconds: None))
+    return Portal(soft_ap_provisioning.SoftAPProvisioning(lambda ssid, password, code, notify: False))
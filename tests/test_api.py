@@ -0,0 +1,138 @@
+import json
+import pytest
+import api as api_module
+from api import API, HttpResponse
+from press_journal import PressJournal
+
+START = 1731750000
+
+class FakeHttp:
+    """Answers every request with the next of the given (status, body) responses"""
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.requests = []
+
+    def request(self, method, path, headers=None, body=None):
+        if callable(body):
+            body = b"".join(body())
+        self.requests.append((method, path, body))
+        status, content = self.responses.pop(0)
+        return HttpResponse(status, {}, memoryview(content))
+
+    def get(self, path, headers=None):
+        return self.request("GET", path, headers)
+
+    def post(self, path, body, headers=None):
+        return self.request("POST", path, headers, body)
+
+    def print_metrics(self):
+        pass
+
+@pytest.fixture
+def journal(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    journal = PressJournal(str(tmp_path / "presses.bin"))
+    monkeypatch.setattr(api_module, "press_journal", journal)
+    return journal
+
+def make_api(*responses):
+    api = API()
+    api.http = FakeHttp(*responses)
+    return api
+
+def test_acknowledged_batch_is_dropped(journal):
+    for i in range(3):
+        journal.append(START + i)
+    api = make_api((200, b'{"last_seq": 1}'))
+
+    assert api._sync_offline_presses("abc")
+    assert list(journal.records()) == [(2, START + 2)]
+    method, path, body = api.http.requests[0]
+    assert (method, path) == ("POST", "/api/device/ABC/presses")
+    assert [press["seq"] for press in json.loads(body)["presses"]] == [0, 1, 2]
+
+def test_missing_endpoint_keeps_the_journal(journal):
+    for i in range(3):
+        journal.append(START + i)
+    api = make_api((404, b"Not Found"))
+
+    # Polling carries on with the server's timer...
+    assert api._sync_offline_presses("abc")
+    # ...but the presses are kept for when the server can take them
+    assert len(PressJournal(journal.path)) == 3
+
+def test_rejected_batch_is_not_resent_until_the_backoff_is_over(journal, monkeypatch):
+    journal.append(START)
+    api = make_api((404, b""), (404, b""), (204, b""))
+    now = [0]
+    monkeypatch.setattr(api_module.utime, "ticks_ms", lambda: now[0])
+
+    assert api._sync_offline_presses("abc")
+    assert api._sync_offline_presses("abc")
+    assert len(api.http.requests) == 1
+
+    now[0] += 60 * 1000
+    assert api._sync_offline_presses("abc")
+    assert len(api.http.requests) == 2
+    assert api.press_sync_backoff_sec == 240
+
+    now[0] += 120 * 1000
+    assert api._sync_offline_presses("abc")
+    assert len(api.http.requests) == 3
+    assert len(journal) == 0
+
+@pytest.mark.parametrize("status", [500, 503, 408, 429])
+def test_transient_failure_keeps_the_journal_and_the_local_timer(journal, status):
+    journal.append(START)
+    api = make_api((status, b""))
+
+    assert not api._sync_offline_presses("abc")
+    assert len(journal) == 1
+
+class FakeSocket:
+    """A kept-alive connection that has sent the given bytes and has nothing more to read"""
+    def __init__(self, data):
+        self.data = data
+        self.sent = b""
+
+    def write(self, data):
+        self.sent += bytes(data)
+
+    def readline(self):
+        end = self.data.find(b"\n") + 1 or len(self.data)
+        line, self.data = self.data[:end], self.data[end:]
+        return line
+
+    def readinto(self, view):
+        count = min(len(view), len(self.data))
+        view[:count] = self.data[:count]
+        self.data = self.data[count:]
+        return count
+
+    def close(self):
+        pass
+
+def client_with(data):
+    client = api_module.HttpClient("https://timer.example.com")
+    client.sock = FakeSocket(data)
+    return client
+
+def test_not_modified_with_content_length_has_no_body():
+    client = client_with(
+        b"HTTP/1.1 304 Not Modified\r\nETag: \"v2\"\r\nContent-Length: 213\r\n\r\n"
+        b"HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\n{}"
+    )
+    response = client.get("/api/device/ABC", {"If-None-Match": '"v2"'})
+    assert response.status_code == 304
+    assert len(response.content) == 0
+    assert response.header("etag") == '"v2"'
+
+    # The connection is still in step for the next response
+    response = client.get("/api/device/ABC")
+    assert (response.status_code, response.json()) == (200, {})
+
+@pytest.mark.parametrize("status", [204, 304])
+def test_bodyless_statuses_leave_the_socket_open(status):
+    client = client_with(b"HTTP/1.1 %d X\r\nContent-Length: 10\r\n\r\n" % status)
+    client.get("/")
+    assert client.sock is not None
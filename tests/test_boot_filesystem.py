@@ -0,0 +1,100 @@
+import builtins
+import os
+import pytest
+from api import API
+from config import Config
+from device_id import DeviceID
+from kv_store import kv_store
+from press_journal import press_journal
+from timer_cache import timer_cache
+from wifi_connection import WifiConnection
+
+class FilesystemLog:
+    """Every open() made while active: (path, mode, found)"""
+    def __init__(self, monkeypatch):
+        self.opens = []
+        real_open = builtins.open
+
+        def logged_open(path, mode="r", *args, **kwargs):
+            try:
+                f = real_open(path, mode, *args, **kwargs)
+            except OSError:
+                self.opens.append((str(path), mode, False))
+                raise
+            self.opens.append((str(path), mode, True))
+            return f
+
+        monkeypatch.setattr(builtins, "open", logged_open)
+
+    def probes(self):
+        """Opens of files that weren't there"""
+        return [path for path, mode, found in self.opens if not found]
+
+    def writes(self):
+        return [path for path, mode, found in self.opens if "r" not in mode]
+
+def reboot():
+    """Forget everything held in RAM, as a reset does; the files stay"""
+    kv_store.__init__(Config.KV_STORE_FILE)
+    press_journal.__init__(Config.OFFLINE_PRESSES_FILE)
+    timer_cache.__init__()
+    DeviceID._device_id = None
+
+def boot():
+    """Everything a boot reads before the countdown is running"""
+    wifi = WifiConnection()
+    if wifi.has_saved_credentials():
+        wifi.load_credentials()
+    DeviceID.get_id()
+    timer_cache.get()
+    press_journal.last_seq()
+    return wifi
+
+def provision(wifi):
+    """What a successful provisioning saves"""
+    wifi.wifi_ssid = "Home"
+    wifi.wifi_pass = "secret"
+    API().register_device(DeviceID.get_id(), "ABC123")
+    wifi.save_credentials()
+
+@pytest.fixture
+def filesystem(fresh_boot, monkeypatch):
+    return FilesystemLog(monkeypatch)
+
+def test_first_boot_probes_once_then_provisions(filesystem):
+    wifi = boot()
+    assert not wifi.has_saved_credentials()
+    # The legacy JSON files are looked for once, and the empty journal is created
+    assert set(filesystem.probes()) >= {Config.WIFI_CREDENTIALS_FILE, Config.DEVICE_ID_FILE, Config.TIMER_JSON_FILE}
+
+    provision(wifi)
+    assert kv_store.get("wifi")["networks"][0]["ssid"] == "Home"
+    assert timer_cache.get()["short_code"] == "ABC123"
+
+def test_steady_state_boot_makes_no_probes(filesystem):
+    provision(boot())
+    reboot()
+    filesystem.opens.clear()
+
+    wifi = boot()
+    assert wifi.wifi_ssid == "Home"
+    assert filesystem.probes() == []
+    assert filesystem.writes() == []
+    assert sorted(path for path, _, _ in filesystem.opens) == sorted([Config.KV_STORE_FILE, Config.OFFLINE_PRESSES_FILE])
+
+    # ...and every later one the same
+    reboot()
+    filesystem.opens.clear()
+    boot()
+    assert filesystem.probes() == []
+    assert len(filesystem.opens) == 2
+
+def test_device_id_is_looked_up_once_per_boot(filesystem):
+    provision(boot())
+    reboot()
+    filesystem.opens.clear()
+
+    for _ in range(10):
+        DeviceID.get_id()
+    assert len(filesystem.opens) == 1
+    assert DeviceID.get_id() == bytes.hex(b"\x24\x6f\x28\xaa\xbb\xcc")
@@ -0,0 +1,152 @@
+import socket
+import struct
+import time
+import tracemalloc
+import pytest
+from captive_dns import CaptiveDns
+from config import Config
+from conftest import dns_query
+
+TYPE_A = 1
+TYPE_AAAA = 28
+TYPE_HTTPS = 65
+TYPE_ANY = 255
+
+# What a phone looks up as it joins the access point
+HOSTNAMES = (
+    "connectivitycheck.gstatic.com", "clients3.google.com", "www.google.com", "captive.apple.com",
+    "www.apple.com", "gateway.icloud.com", "www.msftconnecttest.com", "dns.msftncsi.com",
+    "detectportal.firefox.com", "mtalk.google.com", "play.googleapis.com", "graph.facebook.com",
+    "api.whatsapp.net", "time.android.com",
+)
+
+@pytest.fixture
+def dns():
+    return CaptiveDns(Config.SOFTAP_IP)
+
+def respond(dns, query):
+    length = dns._build_response(query)
+    return bytes(dns._buf[:length])
+
+def header(response):
+    """(id, flags, question, answer, authority and additional counts)"""
+    return struct.unpack(">HHHHHH", response[:12])
+
+@pytest.mark.parametrize("qtype", [TYPE_A, TYPE_ANY])
+def test_address_queries_get_the_portal(dns, qtype):
+    query = dns_query("captive.apple.com", qtype)
+    response = respond(dns, query)
+    assert header(response) == (0x1234, 0x8580, 1, 1, 0, 0)
+    # The question is echoed, then an A record that points back at its name
+    assert response[12:len(query)] == query[12:]
+    assert response[len(query):len(query) + 2] == b"\xc0\x0c"
+    assert response[-4:] == socket.inet_aton(Config.SOFTAP_IP)
+    assert struct.unpack(">I", response[-10:-6])[0] == Config.SOFTAP_DNS_TTL_SEC
+
+@pytest.mark.parametrize("qtype", [TYPE_AAAA, TYPE_HTTPS])
+def test_other_types_get_an_empty_answer(dns, qtype):
+    response = respond(dns, dns_query("captive.apple.com", qtype))
+    # NOERROR rather than NXDOMAIN, with only the SOA that lets the client cache the empty answer
+    assert header(response) == (0x1234, 0x8580, 1, 0, 1, 0)
+    assert struct.unpack(">H", response[-32:-30])[0] == 6
+    assert dns.empty == 1 and dns.answered == 0
+
+def test_edns_record_is_replaced_by_the_answer(dns):
+    plain = respond(dns, dns_query("www.google.com"))
+    assert respond(dns, dns_query("www.google.com", edns=True)) == plain
+
+def test_recursion_desired_is_echoed(dns):
+    query = bytearray(dns_query("www.google.com"))
+    query[2] = 0
+    assert header(respond(dns, bytes(query)))[1] == 0x8480
+
+def test_other_opcodes_are_not_implemented(dns):
+    query = bytearray(dns_query("www.google.com"))
+    query[2] |= 2 << 3  # STATUS
+    _, flags, *counts = header(respond(dns, bytes(query)))
+    assert flags & 0x800F == 0x8004
+    assert counts == [0, 0, 0, 0]
+    assert dns.rejected == 1
+
+@pytest.mark.parametrize("query", [
+    dns_query("www.google.com")[:-2],                                       # question cut short
+    dns_query("www.google.com")[:5] + b"\x02" + dns_query("www.google.com")[6:],  # two questions
+    dns_query("www.google.com")[:12] + b"\xc0\x0c" + struct.pack(">HH", 1, 1),    # compressed name
+])
+def test_malformed_questions_are_format_errors(dns, query):
+    assert header(respond(dns, query))[1] & 0x000F == 1
+    assert dns.rejected == 1
+
+@pytest.mark.parametrize("query", [
+    b"\x12\x34\x01\x00\x00",                                  # runt
+    b"\x12\x34\x81\x80" + dns_query("www.google.com")[4:],  # a response
+])
+def test_runts_and_responses_are_dropped(dns, query):
+    assert dns._build_response(query) == 0
+    assert dns.queries == 0
+
+@pytest.fixture
+def served(dns):
+    """The responder on a loopback socket, and a client socket aimed at it"""
+    dns.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    dns.sock.bind(("127.0.0.1", 0))
+    dns.sock.setblocking(False)
+    client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    client.connect(dns.sock.getsockname())
+    client.settimeout(1)
+    yield dns, client
+    client.close()
+    dns.close()
+
+def replay_join_burst(dns, client, round_number):
+    """Fire the lookups of a phone joining the access point back to back, then answer them"""
+    sent = {}
+    for index, name in enumerate(HOSTNAMES):
+        for offset, qtype in enumerate((TYPE_A, TYPE_AAAA, TYPE_HTTPS)):
+            query_id = (round_number * 64 + index * 3 + offset) & 0xFFFF
+            client.send(dns_query(name, qtype, query_id, edns=True))
+            sent[query_id] = qtype
+    # Give loopback a moment to queue every datagram, as the radio would before the next wakeup
+    time.sleep(0.001)
+    wakeups = []
+    while True:
+        count = dns.handle_pending()
+        if not count:
+            break
+        wakeups.append(count)
+    answers = {}
+    for _ in sent:
+        response = client.recv(512)
+        query_id, flags, _, answer_count, authority_count, _ = header(response)
+        answers[query_id] = (flags & 0x000F, answer_count, authority_count)
+    return sent, answers, wakeups
+
+def test_join_burst_is_answered_in_full(served):
+    dns, client = served
+    rounds = 50
+    for round_number in range(rounds):
+        sent, answers, wakeups = replay_join_burst(dns, client, round_number)
+        assert answers.keys() == sent.keys()
+        for query_id, qtype in sent.items():
+            assert answers[query_id] == ((0, 1, 0) if qtype == TYPE_A else (0, 0, 1))
+        # Every wakeup but the last answers a full burst
+        assert sum(wakeups) == len(sent)
+        assert all(count == Config.SOFTAP_DNS_BURST for count in wakeups[:-1])
+    burst = len(HOSTNAMES) * 3
+    assert (dns.queries, dns.answered, dns.empty, dns.rejected) == (
+        rounds * burst, rounds * len(HOSTNAMES), rounds * len(HOSTNAMES) * 2, 0
+    )
+
+def test_building_responses_does_not_allocate(dns):
+    queries = [dns_query(name, qtype, edns=True) for name in HOSTNAMES for qtype in (TYPE_A, TYPE_AAAA)]
+    for query in queries:
+        dns._build_response(query)
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        for index in range(1000):
+            dns._build_response(queries[index % len(queries)])
+        growth = tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+    assert growth < 512
@@ -0,0 +1,101 @@
+"""
+Each OS's captive-portal check, played against the portal over loopback: resolve the probe host through
+the portal's DNS, fetch the probe, decide from the response whether the network is captive (as the OS
+does), then follow the redirect and load the page and its stylesheet.
+"""
+import asyncio
+import gzip
+import re
+import socket
+import pytest
+from config import Config
+from conftest import dns_query, http_get
+
+# Host, path, and what the OS expects to get back when it is online
+PROBES = {
+    "android": ("connectivitycheck.gstatic.com", "/generate_204", (b"204", b"")),
+    "chrome": ("clients3.google.com", "/gen_204", (b"204", b"")),
+    "ios": ("captive.apple.com", "/hotspot-detect.html", (b"200", b"<HTML><HEAD><TITLE>Success</TITLE>")),
+    "old ios": ("captive.apple.com", "/library/test/success.html", (b"200", b"<HTML><HEAD><TITLE>Success</TITLE>")),
+    "windows": ("www.msftconnecttest.com", "/connecttest.txt", (b"200", b"Microsoft Connect Test")),
+    "old windows": ("www.msftncsi.com", "/ncsi.txt", (b"200", b"Microsoft NCSI")),
+    "firefox": ("detectportal.firefox.com", "/canonical.html", (b"200", b"<meta http-equiv=\"refresh\"")),
+    "firefox success": ("detectportal.firefox.com", "/success.txt", (b"200", b"success")),
+}
+
+# A probe answer is just the redirect's headers
+MAX_PROBE_BYTES = 160
+# The probe and the page, which is all the popup needs before it can show the portal
+MAX_POPUP_BYTES = 1300
+
+async def resolve(port, name):
+    loop = asyncio.get_running_loop()
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setblocking(False)
+    sock.connect(("127.0.0.1", port))
+    try:
+        await loop.sock_sendall(sock, dns_query(name))
+        response = await asyncio.wait_for(loop.sock_recv(sock, 512), 1)
+    finally:
+        sock.close()
+    return socket.inet_ntoa(response[-4:])
+
+def size(status, headers, body):
+    return len(status) + 2 + sum(len(name) + len(value) + 4 for name, value in headers.items()) + 2 + len(body)
+
+@pytest.mark.parametrize("os_name", PROBES)
+def test_probe_pops_up_the_portal(portal, os_name):
+    host, path, online = PROBES[os_name]
+
+    async def scenario():
+        await portal.start()
+        try:
+            address = await resolve(portal.dns_port, host)
+            probe = await http_get(portal.web_port, path, host)
+            location = probe[1].get(b"location", b"").decode()
+            assert location.startswith("http://")
+            page_host, _, page_path = location[len("http://"):].partition("/")
+            page = await http_get(portal.web_port, "/" + page_path, page_host)
+            html = gzip.decompress(page[2])
+            stylesheet = re.search(rb'href="(/portal\.css[^"]*)"', html).group(1).decode()
+            style = await http_get(portal.web_port, stylesheet, page_host)
+        finally:
+            await portal.stop()
+        return address, probe, location, page, html, style
+
+    address, probe, location, page, html, style = asyncio.run(scenario())
+    assert address == Config.SOFTAP_IP
+
+    status, headers, body = probe
+    # Anything but the expected answer means captive; a redirect also tells the OS where the portal is
+    assert (status.split()[1], body[:len(online[1])]) != online
+    assert status == b"HTTP/1.1 302 Found"
+    assert location == f"http://{Config.SOFTAP_IP}/"
+    assert headers[b"content-length"] == b"0" and body == b""
+    assert size(*probe) <= MAX_PROBE_BYTES
+
+    assert page[0] == b"HTTP/1.1 200 OK"
+    assert page[1][b"content-encoding"] == b"gzip"
+    assert int(page[1][b"content-length"]) == len(page[2])
+    assert portal.provisioning.ssid.encode() in html
+    assert style[0] == b"HTTP/1.1 200 OK"
+    assert int(style[1][b"content-length"]) == len(style[2])
+    gzip.decompress(style[2])
+
+    total = size(*probe) + size(*page)
+    print(f"\n{os_name}: probe {size(*probe)} bytes, {total} bytes until the portal is shown, "
+          f"{size(*style)} more for the stylesheet")
+    assert total <= MAX_POPUP_BYTES
+
+@pytest.mark.parametrize("path", ["/favicon.ico", "/apple-touch-icon.png", "/robots.txt"])
+def test_icons_are_not_found(portal, path):
+    async def scenario():
+        await portal.start()
+        try:
+            return await http_get(portal.web_port, path)
+        finally:
+            await portal.stop()
+
+    status, headers, body = asyncio.run(scenario())
+    assert status == b"HTTP/1.1 404 Not Found"
+    assert body == b""
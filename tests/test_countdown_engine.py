@@ -0,0 +1,32 @@
+import pytest
+from countdown_engine import parse_iso8601, format_iso8601
+
+UTC = 1731839600  # 2024-11-17T10:33:20Z
+
+@pytest.mark.parametrize("value", [
+    "2024-11-17T10:33:20Z",
+    "2024-11-17T10:33:20.123Z",
+    "2024-11-17T10:33:20.123456Z",
+    "2024-11-17T10:33:20",
+    "2024-11-17T11:33:20+01",
+    "2024-11-17T11:33:20+0100",
+    "2024-11-17T11:33:20+01:00",
+    "2024-11-17T11:33:20.5+01:00",
+    "2024-11-17T09:33:20-01",
+    "2024-11-17T09:33:20-0100",
+    "2024-11-17T09:33:20-01:00",
+    "2024-11-17T16:03:20+05:30",
+    "2024-11-17T16:03:20+0530",
+    "2024-11-17T10:33:20+00:00",
+])
+def test_parse_iso8601(value):
+    assert parse_iso8601(value) == UTC
+
+def test_format_round_trips():
+    assert format_iso8601(UTC) == "2024-11-17T10:33:20Z"
+    assert parse_iso8601(format_iso8601(UTC)) == UTC
+
+@pytest.mark.parametrize("value", ["", "garbage", "2024-11-17"])
+def test_malformed_times_raise(value):
+    with pytest.raises((ValueError, IndexError)):
+        parse_iso8601(value)
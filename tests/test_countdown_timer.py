@@ -0,0 +1,121 @@
+import asyncio
+import time
+import pytest
+import countdown_timer as countdown_timer_module
+from api import API
+from countdown_timer import CountdownTimer
+from timer_cache import timer_cache
+
+TIMER = {
+    "timer_id": 1,
+    "short_code": "ABC123",
+    "start_time": "2024-11-16T09:44:50Z",
+    "end_time": "2099-11-17T05:44:50Z",
+}
+
+class OfflineChannel:
+    """A TimerChannel that never connects, so the countdown keeps polling"""
+    connected = False
+
+    def __init__(self, *args):
+        pass
+
+    async def run(self):
+        await asyncio.sleep(3600)
+
+@pytest.fixture
+def countdown(fresh_boot, monkeypatch):
+    monkeypatch.setattr(countdown_timer_module, "TimerChannel", OfflineChannel)
+    timer_cache.update(dict(TIMER))
+    return CountdownTimer("device")
+
+def run_for(timer, seconds, during=None):
+    async def scenario():
+        task = asyncio.create_task(timer.run())
+        await asyncio.sleep(seconds)
+        if during:
+            await during()
+        timer._abort_timer()
+        await task
+    asyncio.run(scenario())
+
+def test_tick_keeps_running_while_a_fetch_is_slow(countdown, monkeypatch):
+    fetches = []
+
+    def slow_fetch(self, device_id, short_code):
+        fetches.append(time.monotonic())
+        time.sleep(2.5)
+        return dict(TIMER)
+
+    monkeypatch.setattr(API, "get_timer_for_device", slow_fetch)
+    run_for(countdown, 2.2)
+
+    assert len(fetches) == 1
+    # The fetch was in flight the whole time, yet every second was ticked on time
+    assert countdown.ticker.tick_count >= 2
+    stats = countdown.ticker.stats()
+    assert stats["skipped"] == 0
+    assert stats["max_ms"] < 100
+
+def test_polling_survives_a_malformed_end_time(countdown, monkeypatch):
+    responses = [dict(TIMER, end_time="not a time"), dict(TIMER)]
+    fetched = []
+
+    def fetch(self, device_id, short_code):
+        fetched.append(short_code)
+        return responses.pop(0) if responses else dict(TIMER)
+
+    monkeypatch.setattr(API, "get_timer_for_device", fetch)
+
+    async def poll_again():
+        countdown.poll_now_flag.set()
+        await asyncio.sleep(0.2)
+
+    run_for(countdown, 0.2, poll_again)
+    assert len(fetched) == 2
+    assert countdown.engine.end_time_str == TIMER["end_time"]
+
+def test_press_sync_survives_a_malformed_end_time(countdown, monkeypatch):
+    bad_times = iter(f"bad {i}" for i in range(100))
+    # A different one each time, since an end time that hasn't changed isn't parsed again
+    monkeypatch.setattr(API, "get_timer_for_device", lambda self, device_id, short_code: dict(TIMER, end_time=next(bad_times)))
+    presses = []
+    monkeypatch.setattr(API, "timer_pressed", lambda self, short_code: presses.append(short_code))
+
+    async def tap_twice():
+        for _ in range(2):
+            countdown._restart_timer()
+            await asyncio.sleep(0.2)
+
+    run_for(countdown, 0.2, tap_twice)
+    assert presses == ["ABC123", "ABC123"]
+    assert countdown.unsynced_presses == 0
+
+class SubscribedChannel(OfflineChannel):
+    """A TimerChannel that subscribes straight away"""
+    def __init__(self, uri, short_code, device_id, on_timer_update, on_connected):
+        self.on_connected = on_connected
+
+    async def run(self):
+        self.connected = True
+        self.on_connected()
+        await asyncio.sleep(3600)
+
+def test_api_connection_is_closed_while_the_channel_is_subscribed(countdown, monkeypatch):
+    monkeypatch.setattr(countdown_timer_module, "TimerChannel", SubscribedChannel)
+    http = countdown.api.http
+    fetched = []
+
+    def fetch(self, device_id, short_code):
+        # As a real request would leave it: connected and kept alive
+        http.sock = object()
+        fetched.append(short_code)
+        return dict(TIMER)
+
+    monkeypatch.setattr(API, "get_timer_for_device", fetch)
+    monkeypatch.setattr(http, "close", lambda: setattr(http, "sock", None))
+    run_for(countdown, 0.3)
+
+    # The boot poll and the catch-up fetch on subscribing, then nothing is left open
+    assert len(fetched) == 2
+    assert http.sock is None
@@ -0,0 +1,190 @@
+import random
+import time
+from urllib.parse import quote_plus, parse_qsl
+import pytest
+from http_request import HttpRequest, HttpError
+
+BUFFER_SIZE = 1024
+
+FORM = b"ssid=Caf%C3%A9+WiFi&password=p%26ss%3Dw0rd&setup_code=AB"
+POST = (
+    b"POST /configure HTTP/1.1\r\n"
+    b"Host: 192.168.4.1\r\n"
+    b"User-Agent: Mozilla/5.0 (iPhone; CPU iPhone OS 17_5 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.5 Mobile/15E148 Safari/604.1\r\n"
+    b"Content-Type: application/x-www-form-urlencoded\r\n"
+    b"Accept-Language: en-GB,en;q=0.9\r\n"
+    b"Content-Length: %d\r\n"
+    b"\r\n" % len(FORM)
+) + FORM
+
+def parse(raw, sizes=None, request=None):
+    """
+    Feed raw to a parser the way the portal does, each read filling at most the free space.
+    sizes are the TCP segment sizes (the rest of raw arrives in one final segment).
+    Returns the request once it is complete, or None if raw ran out first.
+    """
+    request = request or HttpRequest(BUFFER_SIZE)
+    segments = []
+    offset = 0
+    for size in sizes or ():
+        segments.append(raw[offset:offset + size])
+        offset += size
+    segments.append(raw[offset:])
+    for segment in segments:
+        while segment:
+            space = request.space()
+            count = min(len(space), len(segment))
+            space[:count] = segment[:count]
+            segment = segment[count:]
+            if request.feed(count):
+                return request
+    return None
+
+def test_post_in_one_segment():
+    request = parse(POST)
+    assert request.method == b"POST"
+    assert request.path == b"/configure"
+    assert request.form() == {"ssid": "Café WiFi", "password": "p&ss=w0rd", "setup_code": "AB"}
+
+def test_post_split_at_every_byte():
+    for split in range(1, len(POST)):
+        request = parse(POST, [split])
+        assert request.form()["ssid"] == "Café WiFi", split
+
+def test_post_sent_a_few_bytes_at_a_time():
+    for size in (1, 2, 7, 13):
+        request = parse(POST, [size] * (len(POST) // size))
+        assert request.form()["password"] == "p&ss=w0rd"
+
+def test_incomplete_body_is_not_done():
+    assert parse(POST[:-1]) is None
+
+def test_closed_connection_mid_request():
+    request = HttpRequest(BUFFER_SIZE)
+    request.space()[:10] = POST[:10]
+    request.feed(10)
+    with pytest.raises(HttpError) as error:
+        request.feed(0)
+    assert error.value.status == 400
+
+@pytest.mark.parametrize("name", [b"Content-Length", b"content-length", b"CONTENT-LENGTH", b"cOnTeNt-LeNgTh"])
+def test_header_names_match_in_any_case(name):
+    raw = b"POST /configure HTTP/1.1\r\n" + name + b":  3 \r\n\r\na=b"
+    assert parse(raw).form() == {"a": "b"}
+
+def test_bare_lf_line_endings():
+    raw = b"POST /configure HTTP/1.1\nHost: x\nContent-Length: 3\n\na=b"
+    assert parse(raw).form() == {"a": "b"}
+
+def test_blank_lines_before_the_request_line():
+    request = parse(b"\r\n\r\nGET / HTTP/1.1\r\n\r\n")
+    assert request.method == b"GET"
+
+def test_query_string_is_not_part_of_the_path():
+    request = parse(b"GET /portal.css?v=3 HTTP/1.1\r\nHost: x\r\n\r\n")
+    assert request.path == b"/portal.css"
+
+def test_headers_longer_than_the_buffer_are_dropped_as_they_are_parsed():
+    headers = b"".join(b"X-Padding-%d: %s\r\n" % (i, b"x" * 200) for i in range(14))
+    raw = b"POST /configure HTTP/1.1\r\n" + headers + b"Content-Length: 9\r\n\r\nssid=Home"
+    assert len(raw) > 2 * BUFFER_SIZE
+    assert parse(raw).form() == {"ssid": "Home"}
+
+def test_body_that_needs_the_room_taken_by_the_headers():
+    body = b"ssid=" + b"a" * 900
+    raw = b"POST /configure HTTP/1.1\r\nUser-Agent: " + b"u" * 100 + b"\r\nContent-Length: %d\r\n\r\n" % len(body) + body
+    assert parse(raw).form() == {"ssid": "a" * 900}
+
+@pytest.mark.parametrize("raw, status", [
+    (b"GARBAGE\r\n\r\n", 400),
+    (b" / HTTP/1.1\r\n\r\n", 400),
+    (b"GET / HTTP/1.1\r\nNoColon\r\n\r\n", 400),
+    (b"POST / HTTP/1.1\r\nContent-Length:\r\n\r\n", 400),
+    (b"POST / HTTP/1.1\r\nContent-Length: 1x\r\n\r\n", 400),
+    (b"POST / HTTP/1.1\r\nContent-Length: 5000\r\n\r\n", 413),
+    (b"GET /" + b"a" * BUFFER_SIZE + b" HTTP/1.1\r\n\r\n", 431),
+    (b"POST / HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\n", 501),
+])
+def test_bad_requests(raw, status):
+    with pytest.raises(HttpError) as error:
+        parse(raw)
+    assert error.value.status == status
+
+@pytest.mark.parametrize("body, fields", [
+    (b"a=1&b=2", {"a": "1", "b": "2"}),
+    (b"a=&b", {"a": "", "b": ""}),
+    (b"a=x+y%20z", {"a": "x y z"}),
+    (b"a=%e2%82%AC", {"a": "€"}),
+    (b"a=100%25", {"a": "100%"}),
+    (b"%61=b", {"a": "b"}),
+])
+def test_percent_decoding(body, fields):
+    raw = b"POST / HTTP/1.1\r\nContent-Length: %d\r\n\r\n" % len(body) + body
+    assert parse(raw).form() == fields
+
+@pytest.mark.parametrize("body", [b"a=%zz", b"a=%4", b"a=%", b"a=%ff%fe"])
+def test_bad_percent_encoding(body):
+    raw = b"POST / HTTP/1.1\r\nContent-Length: %d\r\n\r\n" % len(body) + body
+    with pytest.raises(HttpError) as error:
+        parse(raw).form()
+    assert error.value.status == 400
+
+def _random_text(rng):
+    alphabet = "abcXYZ019 &=%+?#/éü€😀"
+    return "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 20)))
+
+def _random_name(rng):
+    return "".join(rng.choice("-abcdefghijklmnopqrstuvwxyz") for _ in range(rng.randint(1, 20)))
+
+def test_random_posts_parse_like_urllib():
+    rng = random.Random(1)
+    request = HttpRequest(BUFFER_SIZE)
+    for _ in range(2000):
+        fields = {name: _random_text(rng) for name in ("ssid", "password", "setup_code")}
+        body = "&".join(f"{quote_plus(name)}={quote_plus(value)}" for name, value in fields.items()).encode()
+        newline = rng.choice((b"\r\n", b"\n"))
+        lines = [b"POST /configure HTTP/1.1"]
+        for _ in range(rng.randint(0, 12)):
+            lines.append(b"X-%s: %s" % (_random_name(rng).encode(), b"v" * rng.randint(0, 300)))
+        content_length = bytes(c & ~0x20 if c != 45 and rng.random() < 0.5 else c for c in b"content-length")
+        lines.insert(rng.randint(1, len(lines)), content_length + b": %d" % len(body))
+        raw = newline.join(lines) + newline + newline + body
+        sizes = [rng.randint(1, 200) for _ in range(rng.randint(0, 6))]
+
+        request.reset()
+        parsed = parse(raw, sizes, request)
+        assert parsed is not None
+        assert parsed.form() == dict(parse_qsl(body.decode(), keep_blank_values=True))
+
+def test_mutated_requests_only_raise_http_error():
+    rng = random.Random(2)
+    request = HttpRequest(BUFFER_SIZE)
+    for _ in range(20000):
+        raw = bytearray(POST)
+        for _ in range(rng.randint(1, 8)):
+            position = rng.randrange(len(raw))
+            action = rng.randrange(3)
+            if action == 0:
+                raw[position] = rng.randrange(256)
+            elif action == 1:
+                del raw[position]
+            else:
+                raw.insert(position, rng.choice(b"\r\n :%&=+\x00\xff"))
+        request.reset()
+        try:
+            parsed = parse(bytes(raw), [rng.randint(1, 100)], request)
+            if parsed is not None:
+                parsed.form()
+        except HttpError:
+            pass
+
+def test_parse_benchmark():
+    request = HttpRequest(BUFFER_SIZE)
+    rounds = 2000
+    for sizes in (None, [150, 200]):
+        start = time.perf_counter()
+        for _ in range(rounds):
+            request.reset()
+            parse(POST, sizes, request).form()
+        per_request_us = (time.perf_counter() - start) * 1000000 / rounds
+        print(f"{len(POST)} byte POST in {1 if sizes is None else len(sizes) + 1} segment(s): {per_request_us:.0f}us")
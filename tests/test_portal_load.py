@@ -0,0 +1,129 @@
+"""
+Load test for the captive portal: bursts of clients, some of them idling before they send their request,
+while a phone keeps resolving names. Run with PORTAL_LOAD_TEST=1 (and -s to see the figures).
+"""
+import asyncio
+import os
+import socket
+import time
+import pytest
+from conftest import dns_query, http_get
+
+pytestmark = pytest.mark.skipif(not os.environ.get("PORTAL_LOAD_TEST"), reason="set PORTAL_LOAD_TEST=1 to run")
+
+BURST = 6
+IDLE_SEC = 0.5
+DNS_INTERVAL_SEC = 0.02
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+async def client(port, idle):
+    """One page load, idling before sending the request if idle. Returns the status and how long it took."""
+    start = time.perf_counter()
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    if idle:
+        await asyncio.sleep(IDLE_SEC)
+    try:
+        writer.write(b"GET / HTTP/1.1\r\nHost: 192.168.4.1\r\nAccept-Encoding: gzip\r\n\r\n")
+        await writer.drain()
+        response = await reader.read()
+    except ConnectionResetError:
+        # Turned away: the portal closed the connection without reading the request
+        response = b""
+    writer.close()
+    return response.split(b"\r\n", 1)[0], time.perf_counter() - start
+
+async def resolve_until(port, stop):
+    """Resolve a name every DNS_INTERVAL_SEC until stop is set. Returns the round trip of each lookup."""
+    loop = asyncio.get_running_loop()
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setblocking(False)
+    sock.connect(("127.0.0.1", port))
+    latencies = []
+    query_id = 0
+    try:
+        while not stop.is_set():
+            query_id += 1
+            start = time.perf_counter()
+            await loop.sock_sendall(sock, dns_query("connectivitycheck.gstatic.com", query_id=query_id))
+            response = await asyncio.wait_for(loop.sock_recv(sock, 512), 2)
+            latencies.append(time.perf_counter() - start)
+            assert response[:2] == query_id.to_bytes(2, "big")
+            await asyncio.sleep(DNS_INTERVAL_SEC)
+    finally:
+        sock.close()
+    return latencies
+
+@pytest.mark.parametrize("clients, idle", [(24, 4), (60, 6)])
+def test_bursts_of_clients(portal, clients, idle):
+    async def scenario():
+        await portal.start()
+        stop = asyncio.Event()
+        dns = asyncio.create_task(resolve_until(portal.dns_port, stop))
+        tasks = []
+        for index in range(clients):
+            # Spread the idle clients across the bursts
+            tasks.append(asyncio.create_task(client(portal.web_port, index % (clients // idle) == 0)))
+            if index % BURST == BURST - 1:
+                await asyncio.sleep(0.05)
+        results = await asyncio.gather(*tasks)
+        stop.set()
+        latencies = await dns
+        await portal.stop()
+        return results, latencies
+
+    results, dns_latencies = asyncio.run(scenario())
+    statuses = [status for status, _ in results]
+    served_in = [(seconds, index % (clients // idle) == 0) for index, (status, seconds) in enumerate(results) if status]
+    fast = [seconds for seconds, was_idle in served_in if not was_idle]
+    slow = [seconds for seconds, was_idle in served_in if was_idle]
+    print(f"\n{clients} clients, {idle} idle: fast p95 {percentile(fast, 0.95) * 1000:.0f}ms, "
+          f"idle max {max(slow) * 1000:.0f}ms, DNS max {max(dns_latencies) * 1000:.0f}ms "
+          f"over {len(dns_latencies)} lookups, {portal.provisioning.rejected_clients} turned away")
+
+    # Only connections beyond SOFTAP_MAX_CLIENTS may be turned away, and those get no response at all
+    served = statuses.count(b"HTTP/1.1 200 OK")
+    assert served + statuses.count(b"") == clients
+    assert clients - served == portal.provisioning.rejected_clients
+    # An idle client only holds up itself, and neither holds up DNS
+    assert percentile(fast, 0.95) < 0.2
+    assert max(slow) < IDLE_SEC + 0.2
+    assert max(dns_latencies) < 0.1
+
+def test_page_is_served_during_a_connection_attempt(portal):
+    attempts = []
+
+    def slow_attempt(ssid, password, code, notify):
+        attempts.append(ssid)
+        time.sleep(1)
+        notify(b"FAILED")
+        return False
+
+    portal.provisioning.handle_wifi_credentials = slow_attempt
+    portal.provisioning.scan_cache.in_range = lambda ssid: None
+
+    async def scenario():
+        await portal.start()
+        reader, writer = await asyncio.open_connection("127.0.0.1", portal.web_port)
+        form = b"ssid=Home&password=secret&setup_code=ABC123"
+        writer.write(b"POST /configure HTTP/1.1\r\nHost: 192.168.4.1\r\n"
+                     b"Content-Type: application/x-www-form-urlencoded\r\nContent-Length: %d\r\n\r\n%s"
+                     % (len(form), form))
+        await writer.drain()
+        while not attempts:
+            await asyncio.sleep(0.01)
+        start = time.perf_counter()
+        status, _, _ = await http_get(portal.web_port, "/")
+        page_seconds = time.perf_counter() - start
+        error_page = await reader.read()
+        writer.close()
+        await portal.stop()
+        return status, page_seconds, error_page
+
+    status, page_seconds, error_page = asyncio.run(scenario())
+    print(f"\npage served in {page_seconds * 1000:.0f}ms during a 1s connection attempt")
+    assert status == b"HTTP/1.1 200 OK"
+    assert page_seconds < 0.2
+    assert error_page.startswith(b"HTTP/1.1 200 OK")
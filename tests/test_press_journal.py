@@ -0,0 +1,109 @@
+import json
+import os
+import pytest
+from config import Config
+from press_journal import PressJournal, _HEADER_SIZE, _RECORD_SIZE
+
+START = 1731750000
+
+@pytest.fixture(autouse=True)
+def in_tmp_path(tmp_path, monkeypatch):
+    # The legacy JSON file is looked up relative to the working directory
+    monkeypatch.chdir(tmp_path)
+
+def reload(journal):
+    return PressJournal(journal.path)
+
+def test_thousands_of_presses_survive_a_reload(tmp_path):
+    journal = PressJournal(str(tmp_path / "presses.bin"))
+    for i in range(5000):
+        assert journal.append(START + i) == i
+
+    reloaded = reload(journal)
+    assert len(reloaded) == 5000
+    assert reloaded.last_seq() == 4999
+    assert list(reloaded.records()) == [(i, START + i) for i in range(5000)]
+    assert os.path.getsize(journal.path) == _HEADER_SIZE + 5000 * _RECORD_SIZE
+
+def test_torn_last_record_is_dropped(tmp_path):
+    journal = PressJournal(str(tmp_path / "presses.bin"))
+    for i in range(3):
+        journal.append(START + i)
+    with open(journal.path, "r+b") as f:
+        f.truncate(_HEADER_SIZE + 2 * _RECORD_SIZE + 5)
+
+    reloaded = reload(journal)
+    assert list(reloaded.records()) == [(0, START), (1, START + 1)]
+    assert os.path.getsize(journal.path) == _HEADER_SIZE + 2 * _RECORD_SIZE
+    assert reloaded.append(START + 2) == 2
+
+def test_records_after_a_corrupt_one_are_dropped(tmp_path):
+    journal = PressJournal(str(tmp_path / "presses.bin"))
+    for i in range(10):
+        journal.append(START + i)
+    with open(journal.path, "r+b") as f:
+        f.seek(_HEADER_SIZE + 4 * _RECORD_SIZE + 4)
+        f.write(b"\xff")
+
+    assert list(reload(journal).records()) == [(i, START + i) for i in range(4)]
+
+def test_bad_header_starts_a_new_journal(tmp_path):
+    path = tmp_path / "presses.bin"
+    path.write_bytes(b"garbage")
+
+    journal = PressJournal(str(path))
+    assert len(journal) == 0
+    assert journal.append(START) == 0
+    assert list(reload(journal).records()) == [(0, START)]
+
+def test_acknowledge_keeps_presses_queued_during_the_upload(tmp_path):
+    journal = PressJournal(str(tmp_path / "presses.bin"))
+    for i in range(3000):
+        journal.append(START + i)
+    journal.acknowledge(2499)
+
+    reloaded = reload(journal)
+    assert list(reloaded.records()) == [(i, START + i) for i in range(2500, 3000)]
+
+def test_sequence_numbers_keep_counting_after_an_ack(tmp_path):
+    journal = PressJournal(str(tmp_path / "presses.bin"))
+    for i in range(3):
+        journal.append(START + i)
+    journal.acknowledge(2)
+
+    reloaded = reload(journal)
+    assert len(reloaded) == 0
+    assert reloaded.last_seq() is None
+    assert reloaded.append(START + 3) == 3
+
+def test_stale_ack_keeps_every_record(tmp_path):
+    journal = PressJournal(str(tmp_path / "presses.bin"))
+    for i in range(3):
+        journal.append(START + i)
+    journal.acknowledge(1)
+    journal.acknowledge(0)
+
+    assert list(reload(journal).records()) == [(2, START + 2)]
+
+def test_ack_beyond_the_last_record_stops_at_it(tmp_path):
+    journal = PressJournal(str(tmp_path / "presses.bin"))
+    for i in range(3):
+        journal.append(START + i)
+    journal.acknowledge(10)
+
+    assert reload(journal).append(START + 3) == 3
+
+def test_ack_of_an_empty_journal_does_nothing(tmp_path):
+    journal = PressJournal(str(tmp_path / "presses.bin"))
+    journal.acknowledge(0)
+
+    assert len(reload(journal)) == 0
+
+def test_presses_are_migrated_from_the_json_file(tmp_path):
+    with open(Config.LEGACY_OFFLINE_PRESSES_FILE, "w") as f:
+        json.dump([START, START + 60], f)
+
+    journal = PressJournal(str(tmp_path / "presses.bin"))
+    assert list(journal.records()) == [(0, START), (1, START + 60)]
+    assert not os.path.exists(Config.LEGACY_OFFLINE_PRESSES_FILE)
+    assert list(reload(journal).records()) == [(0, START), (1, START + 60)]
@@ -0,0 +1,103 @@
+import calendar
+import time
+import types
+import pytest
+import time_sync as time_sync_module
+from config import Config
+from time_sync import TimeSync
+
+class Clock:
+    """Real time, and an RTC that runs slow by ppm and can be set the way machine.RTC does"""
+    def __init__(self, ppm=80):
+        self.true = 1730000000.0
+        self.rtc = 0.0
+        self.ppm = ppm
+        self.ntp_reachable = True
+        self.ntp_attempts = 0
+
+    def advance(self, seconds):
+        self.true += seconds
+        self.rtc += seconds * (1 - self.ppm / 1000000)
+
+    def date_header(self):
+        return time.strftime("%a, %d %b %Y %H:%M:%S GMT", time.gmtime(int(self.true)))
+
+    def ntp_time(self):
+        self.ntp_attempts += 1
+        if not self.ntp_reachable:
+            raise OSError("ETIMEDOUT")
+        return int(self.true)
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+
+    class RTC:
+        def datetime(self, t):
+            clock.rtc = calendar.timegm((t[0], t[1], t[2], t[4], t[5], t[6], 0, 0, 0))
+
+    utime = types.SimpleNamespace(
+        time=lambda: int(clock.rtc),
+        ticks_ms=lambda: int(clock.true * 1000),
+        ticks_diff=lambda end, start: end - start,
+        gmtime=lambda seconds=None: time.gmtime(int(clock.rtc) if seconds is None else seconds),
+        mktime=lambda t: calendar.timegm(tuple(t[:6]) + (0, 0, 0)),
+    )
+    monkeypatch.setattr(time_sync_module, "utime", utime)
+    monkeypatch.setattr(time_sync_module, "machine", types.SimpleNamespace(RTC=RTC))
+    monkeypatch.setattr(time_sync_module, "ntptime", types.SimpleNamespace(time=clock.ntp_time))
+    return clock
+
+def poll_for(clock, sync, days, interval=60):
+    """What API.get_timer_for_device does every poll. Returns the largest RTC error after the first sync."""
+    worst = 0
+    for _ in range(int(days * 24 * 60 * 60 / interval)):
+        sync.sync_if_needed()
+        sync.apply_http_date(clock.date_header())
+        if sync.synced:
+            worst = max(worst, abs(clock.true - clock.rtc))
+        clock.advance(interval)
+    return worst
+
+def test_ntp_keeps_running_alongside_http_dates(clock):
+    sync = TimeSync()
+    worst = poll_for(clock, sync, days=3)
+
+    # The estimate passes 2 s every few hours, and the daily sync is due anyway
+    assert sync.ntp_syncs >= 4
+    assert sync.drift_ppm != Config.TIME_SYNC_DEFAULT_DRIFT_PPM
+    assert worst <= 2
+
+def test_blocked_ntp_is_only_retried_after_a_while(clock):
+    # Slow enough that the Date header rarely moves the RTC, so the error estimate alone says sync
+    clock.ppm = 20
+    clock.ntp_reachable = False
+    sync = TimeSync()
+    worst = poll_for(clock, sync, days=1)
+
+    retry_limit = 24 * 60 * 60 // Config.TIME_SYNC_RETRY_SEC + 1
+    assert clock.ntp_attempts <= retry_limit
+    assert sync.ntp_syncs == 0
+    # The Date header keeps the RTC right meanwhile
+    assert sync.synced
+    assert worst <= 2
+
+def test_http_dates_keep_the_estimate_down_while_ntp_fails(clock):
+    clock.ppm = 20
+    sync = TimeSync()
+    sync.sync_if_needed()
+    clock.ntp_reachable = False
+    poll_for(clock, sync, days=1)
+
+    assert sync.estimated_error() <= Config.TIME_SYNC_MAX_ERROR_SEC
+    assert clock.ntp_attempts <= 24 * 60 * 60 // Config.TIME_SYNC_RETRY_SEC + 2
+
+def test_ntp_is_used_again_once_it_is_reachable(clock):
+    clock.ntp_reachable = False
+    sync = TimeSync()
+    poll_for(clock, sync, days=1)
+    clock.ntp_reachable = True
+    poll_for(clock, sync, days=1)
+
+    assert sync.ntp_syncs >= 1
+    assert sync.ntp_failed_ticks is None
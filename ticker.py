@@ -0,0 +1,103 @@
+"""
+Deadline-based ticker for the countdown display.
+
+Sleeping for a fixed second after doing the tick's work makes every iteration last 1 s plus the work,
+so the display drifts and eventually skips a second. The Ticker instead keeps an absolute ticks_ms
+deadline aligned to the RTC's second edge and sleeps until it. After a stall it fires once
+straight away and skips the missed deadlines, so the grid never shifts.
+
+Lateness (how long after the deadline the tick actually ran) is recorded so the jitter can be checked.
+
+Example usage:
+
+    ticker = Ticker(1000)
+    while True:
+        await ticker.wait()
+        do_tick()
+"""
+import utime
+import uasyncio as asyncio
+from array import array
+from config import Config
+
+def rtc_second_edge():
+    """
+    Return (epoch_seconds, ticks_ms) for the start of the current RTC second,
+    so that a ticks_ms-based clock can be lined up with the RTC.
+    """
+    ticks = utime.ticks_ms()
+    try:
+        now_ms = utime.time_ns() // 1000000
+    except AttributeError:
+        # Ports without time_ns: the sub-second phase is unknown, treat now as the edge
+        return utime.time(), ticks
+    return now_ms // 1000, utime.ticks_add(ticks, -(now_ms % 1000))
+
+class Ticker:
+    def __init__(self, period_ms=1000, sample_count=Config.TICKER_JITTER_SAMPLES):
+        self.period_ms = period_ms
+        self.deadline = 0
+        self.tick_count = 0
+        self.skipped_ticks = 0
+
+        # Lateness statistics. Samples are kept in a preallocated ring so waiting never allocates.
+        self._samples = array('i', [0] * sample_count)
+        self._sample_index = 0
+        self._sample_total = 0
+        self._lateness_total = 0
+        self._lateness_max = 0
+        self.align()
+
+    def align(self):
+        """Line the next deadline up with the RTC second edge (the first period boundary still in the future)"""
+        _, edge_ticks = rtc_second_edge()
+        periods = utime.ticks_diff(utime.ticks_ms(), edge_ticks) // self.period_ms + 1
+        self.deadline = utime.ticks_add(edge_ticks, periods * self.period_ms + Config.TICKER_EDGE_OFFSET_MS)
+
+    async def wait(self):
+        """Sleep until the next deadline, record how late we woke, then advance to the following deadline"""
+        delay = utime.ticks_diff(self.deadline, utime.ticks_ms())
+        if delay > 0:
+            await asyncio.sleep_ms(delay)
+        lateness = utime.ticks_diff(utime.ticks_ms(), self.deadline)
+        self._record(lateness)
+        self.tick_count += 1
+
+        if lateness >= self.period_ms:
+            # Stalled past one or more deadlines: skip them rather than firing a burst of catch-up ticks
+            missed = lateness // self.period_ms
+            self.skipped_ticks += missed
+            self.deadline = utime.ticks_add(self.deadline, missed * self.period_ms)
+        self.deadline = utime.ticks_add(self.deadline, self.period_ms)
+
+        if self.tick_count % Config.TICKER_REALIGN_INTERVAL_TICKS == 0:
+            # ticks_ms and the RTC run off different clocks, so re-align now and then
+            self.align()
+
+    def _record(self, lateness):
+        if lateness < 0:
+            lateness = 0
+        self._samples[self._sample_index] = lateness
+        self._sample_index = (self._sample_index + 1) % len(self._samples)
+        self._sample_total += 1
+        self._lateness_total += lateness
+        if lateness > self._lateness_max:
+            self._lateness_max = lateness
+
+    def stats(self):
+        """Return lateness statistics in ms: mean and max over all ticks, p99 over the recent samples"""
+        count = min(self._sample_total, len(self._samples))
+        if not count:
+            return {"ticks": 0, "mean_ms": 0, "p99_ms": 0, "max_ms": 0, "skipped": 0}
+        recent = sorted(self._samples[:count])
+        return {
+            "ticks": self._sample_total,
+            "mean_ms": self._lateness_total / self._sample_total,
+            "p99_ms": recent[min(count - 1, (count * 99) // 100)],
+            "max_ms": self._lateness_max,
+            "skipped": self.skipped_ticks,
+        }
+
+    def print_stats(self):
+        stats = self.stats()
+        print(f"[TICKER] ticks={stats['ticks']} lateness mean={stats['mean_ms']:.1f}ms p99={stats['p99_ms']}ms max={stats['max_ms']}ms skipped={stats['skipped']}")
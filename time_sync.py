@@ -0,0 +1,174 @@
+"""
+Keeps the RTC in sync with real time without an NTP round trip before every API call.
+
+The RTC is synced over NTP at boot and afterwards only when the estimated error grows past
+Config.TIME_SYNC_MAX_ERROR_SEC, or at least every Config.TIME_SYNC_MAX_INTERVAL_SEC. The estimate is
+the error left after the last sync plus the drift rate multiplied by the time since then; the drift
+rate is measured between NTP syncs. The server's HTTP `Date` header is used as a free (1 s resolution)
+sample on API responses, which corrects the RTC if it has drifted by more than a second.
+A failed NTP attempt isn't retried for Config.TIME_SYNC_RETRY_SEC, so a network that blocks NTP doesn't
+cost a timeout on every poll; meanwhile HTTP `Date` samples keep the error estimate in check.
+
+This is only about time. Whether we are online is a separate question, see API.is_online().
+
+Example usage:
+
+    time_sync.sync_if_needed()              # blocking NTP request, only when the estimate is too poor
+    time_sync.apply_http_date(response_date_header)
+    time_sync.print_status()
+"""
+import machine
+import ntptime
+import utime
+from config import Config
+
+_MONTHS = ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec')
+
+def parse_http_date(value):
+    """Parse an RFC 7231 date such as 'Tue, 19 Nov 2024 10:33:20 GMT' into seconds since the epoch"""
+    parts = value.split()
+    hour, minute, second = parts[4].split(':')
+    return utime.mktime((
+        int(parts[3]),
+        _MONTHS.index(parts[2]) + 1,
+        int(parts[1]),
+        int(hour),
+        int(minute),
+        int(second),
+        0, 0
+    ))
+
+class TimeSync:
+    def __init__(self):
+        self.synced = False
+        # When the RTC was last set (or confirmed over NTP) and how accurate that was: the error estimate grows from here
+        self.last_sync_time = 0
+        self.last_sync_error = 0
+        self.last_sync_source = None
+        # The last NTP sync (or the first sync of any kind, until NTP has worked), which the drift is
+        # measured against, and how far HTTP Date samples have moved the RTC since then
+        self.ntp_anchor_time = 0
+        self.ntp_anchor_adjustment = 0
+        self.drift_ppm = Config.TIME_SYNC_DEFAULT_DRIFT_PPM
+        self.ntp_syncs = 0
+        self.http_date_syncs = 0
+        # Bumped whenever the RTC is set, so anything lined up with its second edge can tell it moved
+        self.rtc_sets = 0
+        # ticks_ms of the last failed NTP attempt, None once NTP has worked again
+        self.ntp_failed_ticks = None
+        self.ntp_failures = 0
+
+    def sync_age(self):
+        """Seconds since the RTC was last synced over NTP, or None if it has never been synced"""
+        if not self.synced:
+            return None
+        return utime.time() - self.ntp_anchor_time
+
+    def estimated_error(self):
+        """Estimated RTC error in seconds, or None if it has never been synced"""
+        if not self.synced:
+            return None
+        return self.last_sync_error + abs(self.drift_ppm) * (utime.time() - self.last_sync_time) / 1000000
+
+    def needs_sync(self):
+        if not self.synced:
+            return True
+        if self.sync_age() >= Config.TIME_SYNC_MAX_INTERVAL_SEC:
+            return True
+        return self.estimated_error() > Config.TIME_SYNC_MAX_ERROR_SEC
+
+    def rtc_is_set(self):
+        """False while the RTC still holds its power-on default, i.e. nothing has set it since power was lost"""
+        return utime.gmtime()[0] >= Config.TIME_SYNC_MIN_VALID_YEAR
+
+    def sync_if_needed(self):
+        """
+        Sync over NTP if the RTC can no longer be trusted. Returns True if the RTC is considered in sync.
+        After a failed attempt NTP isn't tried again for Config.TIME_SYNC_RETRY_SEC.
+        """
+        if not self.needs_sync():
+            return True
+        if self.ntp_failed_ticks is not None and utime.ticks_diff(utime.ticks_ms(), self.ntp_failed_ticks) < Config.TIME_SYNC_RETRY_SEC * 1000:
+            return False
+        return self.sync_ntp()
+
+    def sync_ntp(self):
+        """Blocking NTP sync. Returns True if successful, False if failed."""
+        try:
+            server_time = ntptime.time()
+        except Exception as e:
+            self.ntp_failed_ticks = utime.ticks_ms()
+            self.ntp_failures += 1
+            print(f"[TIME] Failed to sync time over NTP ({self.ntp_failures} failures): {e}")
+            return False
+        self.ntp_failed_ticks = None
+        self._apply(server_time, Config.TIME_SYNC_NTP_ERROR_SEC, "ntp")
+        self.ntp_syncs += 1
+        return True
+
+    def apply_http_date(self, date_header):
+        """
+        Use the Date header of an HTTP response as a time sample. It only counts as a sync if it moves
+        the RTC: one that agrees with the RTC to within its 1 s resolution tells us nothing new, so the
+        error estimate keeps growing until NTP is due. While NTP is failing, though, such a sample is
+        the best there is, so it brings the error estimate down to 1 s.
+        """
+        if not date_header:
+            return
+        try:
+            server_time = parse_http_date(date_header)
+        except Exception as e:
+            print(f"[TIME] Could not parse Date header '{date_header}': {e}")
+            return
+        # A 1 s resolution sample can't improve on a recent NTP sync
+        error = self.estimated_error()
+        if error is not None and error <= Config.TIME_SYNC_HTTP_DATE_ERROR_SEC:
+            return
+        if self._apply(server_time, Config.TIME_SYNC_HTTP_DATE_ERROR_SEC, "http"):
+            self.http_date_syncs += 1
+
+    def _apply(self, server_time, sample_error, source):
+        """
+        Set the RTC if it is off by more than the sample's error. NTP samples also update the drift model,
+        from the offset built up since the last NTP sync. Returns True if the RTC was set.
+        """
+        rtc_time = utime.time()
+        offset = server_time - rtc_time
+        is_ntp = source == "ntp"
+        if is_ntp and self.synced:
+            elapsed = server_time - self.ntp_anchor_time
+            if elapsed >= Config.TIME_SYNC_MIN_DRIFT_SAMPLE_SEC:
+                # Include what HTTP Date samples corrected in between, it is drift all the same
+                measured_ppm = (offset + self.ntp_anchor_adjustment) * 1000000 / elapsed
+                # Smooth, since each sample is only accurate to about a second
+                self.drift_ppm = (self.drift_ppm + measured_ppm) / 2
+
+        moved = abs(offset) > sample_error
+        if moved:
+            self._set_rtc(server_time)
+            print(f"[TIME] RTC adjusted by {offset}s ({source}), drift estimate {self.drift_ppm:.0f}ppm")
+        if is_ntp or not self.synced:
+            self.ntp_anchor_time = server_time
+            self.ntp_anchor_adjustment = 0
+        elif moved:
+            self.ntp_anchor_adjustment += offset
+        if moved or is_ntp or not self.synced or self.ntp_failed_ticks is not None:
+            self.last_sync_time = server_time
+            self.last_sync_error = sample_error
+            self.last_sync_source = source
+        self.synced = True
+        return moved
+
+    def _set_rtc(self, timestamp):
+        tm = utime.gmtime(timestamp)
+        machine.RTC().datetime((tm[0], tm[1], tm[2], tm[6] + 1, tm[3], tm[4], tm[5], 0))
+        self.rtc_sets += 1
+
+    def print_status(self):
+        if not self.synced:
+            print("[TIME] RTC has never been synced")
+            return
+        print(f"[TIME] Last NTP sync {self.sync_age()}s ago, last set via {self.last_sync_source}, estimated error {self.estimated_error():.2f}s, drift {self.drift_ppm:.0f}ppm, NTP syncs {self.ntp_syncs}, NTP failures {self.ntp_failures}, HTTP Date syncs {self.http_date_syncs}")
+
+# Global time sync instance
+time_sync = TimeSync()
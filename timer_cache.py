@@ -0,0 +1,95 @@
+"""
+In-memory copy of the timer state, written to flash behind the scenes.
+
+Every reader and writer of the timer goes through this cache, so it is the single source of truth. An
+update only marks the cache dirty if the content actually changed. Dirty state is written to the
+KV store once it has been idle for Config.TIMER_CACHE_FLUSH_IDLE_MS, so a burst of updates costs one
+flash write. It is also written before the countdown stops (e.g. on a WiFi reset) and when the device is
+registered.
+
+Example usage:
+
+    timer_cache.get()                  # from RAM
+    timer_cache.update(timer_data)     # marks dirty only if it differs
+    asyncio.create_task(timer_cache.run_flusher())
+    timer_cache.flush()                # write now, e.g. before a reset
+    timer_cache.print_stats()
+"""
+import utime
+import uasyncio as asyncio
+from config import Config
+from kv_store import kv_store
+
+class TimerCache:
+    def __init__(self):
+        self.data = None
+        self.dirty = False
+        self._loaded = False
+        self._last_change_ticks = 0
+        self.uptime_ms = 0
+        self.reads = 0
+        self.updates = 0
+        self.unchanged_updates = 0
+        self.writes = 0
+
+    def _load(self):
+        if not self._loaded:
+            self._loaded = True
+            self.data = kv_store.get("timer")
+
+    def get(self):
+        """The cached timer dict, or None. Treat it as read-only and pass a copy to update()."""
+        self._load()
+        self.reads += 1
+        return self.data
+
+    def update(self, timer_data, preserve_short_code=False):
+        """Replace the timer state. Returns True if it changed (and so will be written)."""
+        self._load()
+        self.updates += 1
+        if preserve_short_code and self.data and "short_code" in self.data:
+            timer_data["short_code"] = self.data["short_code"]
+        if timer_data == self.data:
+            self.unchanged_updates += 1
+            return False
+        self.data = timer_data
+        self.dirty = True
+        self._last_change_ticks = utime.ticks_ms()
+        return True
+
+    def clear(self):
+        self.data = None
+        self.dirty = False
+        self._loaded = True
+        kv_store.delete("timer")
+
+    def flush(self):
+        """Write the timer state to flash if it has changed since the last write"""
+        if not self.dirty:
+            return
+        self.dirty = False
+        try:
+            kv_store.set("timer", self.data)
+            self.writes += 1
+        except Exception as e:
+            self.dirty = True
+            print(f"[CACHE] Error writing timer state: {e}")
+
+    async def run_flusher(self):
+        """Flush once the state has stopped changing for TIMER_CACHE_FLUSH_IDLE_MS"""
+        last = utime.ticks_ms()
+        while True:
+            await asyncio.sleep_ms(Config.TIMER_CACHE_FLUSH_IDLE_MS)
+            now = utime.ticks_ms()
+            self.uptime_ms += utime.ticks_diff(now, last)
+            last = now
+            if self.dirty and utime.ticks_diff(now, self._last_change_ticks) >= Config.TIMER_CACHE_FLUSH_IDLE_MS:
+                self.flush()
+
+    def print_stats(self):
+        hours = max(self.uptime_ms, 1) / 3600000
+        writes_avoided = self.updates - self.writes
+        print(f"[CACHE] Timer state: flash reads avoided {self.reads} ({self.reads / hours:.0f}/h), writes {self.writes}, writes avoided {writes_avoided} ({writes_avoided / hours:.0f}/h, {self.unchanged_updates} unchanged)")
+
+# Global timer state cache
+timer_cache = TimerCache()
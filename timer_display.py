@@ -4,13 +4,17 @@ class TimerDisplay:
     def __init__(self):
         self.timer_data = None
 
-    def update_time(self, time_data):
-        self.timer_data = time_data
+    def update_time(self, time_record):
+        """time_record is a countdown_engine.TimeRecord; its `changed` bits say which fields need redrawing"""
+        if not time_record.changed:
+            return
+        self.timer_data = time_record
         self.display_timer()
 
     def display_timer(self):
         """Show the time left on the LED display (todo)"""
-        print(f"[DISPLAY] Time left: {self.timer_data}")
+        t = self.timer_data
+        print(f"[DISPLAY] Time {t.type}: {t.days}d {t.hours:02d}:{t.minutes:02d}:{t.seconds:02d}")
 
 
 
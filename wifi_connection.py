@@ -1,123 +1,380 @@
 import network
 import time
-import json
-import os
+import binascii
+import random
 from config import Config
 from event_bus import event_bus, Events
-from machine import Timer
+from network_worker import network_worker
+from kv_store import kv_store
+from boot_timeline import boot_timeline
+from micropython import const
+import uasyncio as asyncio
+
+# wlan.status() values that mean an attempt has failed and waiting longer won't help
+_FAILED_STATUSES = tuple(getattr(network, name) for name in (
+    "STAT_WRONG_PASSWORD", "STAT_NO_AP_FOUND", "STAT_CONNECT_FAIL", "STAT_ASSOC_FAIL", "STAT_HANDSHAKE_TIMEOUT"
+) if hasattr(network, name))
+
+class WifiState:
+    """States of the WiFi connection"""
+    IDLE = const(0)
+    ASSOCIATING = const(1)
+    DHCP = const(2)
+    CONNECTED = const(3)
+    BACKOFF = const(4)
+
+    NAMES = ('IDLE', 'ASSOCIATING', 'DHCP', 'CONNECTED', 'BACKOFF')
 
 class WifiConnection:
-    def __init__(self, credentials_file):
-        self.credentials_file = credentials_file
+    """
+    Keeps the station connected as a state machine:
+
+        IDLE -> ASSOCIATING -> DHCP -> CONNECTED
+          ^          |           |         |
+          +-- BACKOFF <----------+         | (link lost)
+          +--------------------------------+
+
+    connect_and_monitor_connection() drives it from the uasyncio scheduler, polling the link instead of
+    sleeping in blocking loops, and backs off exponentially (with jitter) between failed attempts.
+    WIFI_CONNECTED and WIFI_DISCONNECTED are published once per transition into and out of CONNECTED.
+    connect() runs the same attempt synchronously, for provisioning.
+    """
+    def __init__(self):
         self.wlan = None
-        self.wifi_ssid = None 
+        self.wifi_ssid = None
         self.wifi_pass = None
-        self.reconnect_timer = None
+        # Saved networks, most recently connected first: [{"ssid", "password", "last_success"}]
+        self.networks = []
+        self._scan_results = None
+        self._scan_ticks = 0
+        self.monitoring = False
+        self.state = WifiState.IDLE
+        self.backoff_ms = Config.WIFI_MIN_BACKOFF_MS
+        self.connect_attempts = 0
+        self.connect_ms = None
+        self._connected_via = None
+        # Whether a static IP config has been applied since DHCP was last running
+        self._static_ifconfig = False
         self._subscribe()
 
     def _subscribe(self):
-        event_bus.subscribe(Events.FACTORY_RESET_BUTTON_PRESSED, self._reset)
-        event_bus.subscribe(Events.SOFT_RESET_BUTTON_PRESSED, self._reset)
+        event_bus.subscribe(Events.FACTORY_RESET_BUTTON_PRESSED, self._factory_reset)
+        event_bus.subscribe(Events.SOFT_RESET_BUTTON_PRESSED, self._soft_reset)
 
     def has_saved_credentials(self):
-        try:
-            os.stat(self.credentials_file)
-            return True
-        except OSError:
-            return False
+        return "wifi" in kv_store
 
     def load_credentials(self):
-        try:
-            with open(self.credentials_file, 'r') as f:
-                creds = json.load(f)
-                self.wifi_ssid = creds['ssid']
-                self.wifi_pass = creds['password']
-                return True
-        except:
+        creds = kv_store.get("wifi")
+        if not creds:
+            return False
+        if "networks" in creds:
+            self.networks = creds["networks"]
+        else:
+            # Saved by a firmware that only knew one network
+            self.networks = [{"ssid": creds['ssid'], "password": creds['password'], "last_success": 0}]
+        if not self.networks:
             return False
+        self.wifi_ssid = self.networks[0]["ssid"]
+        self.wifi_pass = self.networks[0]["password"]
+        return True
 
     def save_credentials(self):
+        """Add the current network to the saved ones, or update its password"""
+        self._remember(self.wifi_ssid, self.wifi_pass, 0)
+
+    def _remember(self, ssid, password, last_success):
+        """Move a network to the front of the saved networks, dropping the oldest beyond WIFI_MAX_NETWORKS"""
+        for known in self.networks:
+            if known["ssid"] == ssid:
+                self.networks.remove(known)
+                last_success = last_success or known.get("last_success", 0)
+                break
+        self.networks.insert(0, {"ssid": ssid, "password": password, "last_success": last_success})
+        del self.networks[Config.WIFI_MAX_NETWORKS:]
         try:
-            with open(self.credentials_file, 'w') as f:
-                json.dump({
-                    'ssid': self.wifi_ssid,
-                    'password': self.wifi_pass
-                }, f)
+            kv_store.set("wifi", {"networks": self.networks})
         except Exception as e:
             print(f"Error saving credentials: {e}")
 
-    def connect_and_monitor_connection(self):
+    def _set_state(self, state):
+        previous = self.state
+        if state == previous:
+            return
+        self.state = state
+        print(f"[WIFI] {WifiState.NAMES[previous]} -> {WifiState.NAMES[state]}")
+        if state == WifiState.CONNECTED:
+            boot_timeline.mark("wifi connected")
+            event_bus.publish_deferred(Events.WIFI_CONNECTED)
+        elif previous == WifiState.CONNECTED:
+            event_bus.publish_deferred(Events.WIFI_DISCONNECTED)
+
+    async def connect_and_monitor_connection(self):
+        """
+        Connect using the saved credentials and keep the connection up until disconnect() is called.
+        Runs as a uasyncio task; only the access point scan is handed to the network worker thread.
+        """
         self.load_credentials()
-        self.connect()
-        self._monitor_connection()
+        self.monitoring = True
+        self.backoff_ms = Config.WIFI_MIN_BACKOFF_MS
+        while self.monitoring and self.networks:
+            if self.state == WifiState.CONNECTED:
+                await asyncio.sleep_ms(Config.WIFI_LINK_CHECK_INTERVAL_MS)
+                if self.monitoring and not self.wlan.isconnected():
+                    print("[WIFI] Wifi has been disconnected, reconnecting...")
+                    self._set_state(WifiState.IDLE)
+                continue
+
+            if await self._connect_async():
+                self.backoff_ms = Config.WIFI_MIN_BACKOFF_MS
+                continue
+
+            # Anywhere between half and all of the backoff, so devices on one router don't retry in step
+            delay_ms = self.backoff_ms // 2 + random.randint(0, self.backoff_ms // 2)
+            print(f"[WIFI] Retrying in {delay_ms}ms")
+            self._set_state(WifiState.BACKOFF)
+            await asyncio.sleep_ms(delay_ms)
+            self.backoff_ms = min(self.backoff_ms * 2, Config.WIFI_MAX_BACKOFF_MS)
+            self._set_state(WifiState.IDLE)
 
     def connect(self, ssid=None, password=None):
+        """
+        Blocking connect, to the given network or else to the best of the saved ones. Goes straight to the
+        access point that worked last time (its BSSID and IP lease are saved) and only falls back to a
+        scan if that fails.
+        """
         if ssid:
             self.wifi_ssid = ssid
             self.wifi_pass = password
-            
-        if not self.wifi_ssid or not self.wifi_pass:
-            return False
+            networks = [{"ssid": ssid, "password": password}]
+        else:
+            networks = self.networks
 
-        print(f"[WIFI] Connecting to WiFi with SSID: {self.wifi_ssid} and password: {self.wifi_pass}")
+        if not networks:
+            return False
 
         if self.wlan and self.wlan.isconnected():
             return True
-            
+
         try:
-            self.wlan = network.WLAN(network.STA_IF)
-            self.wlan.active(True)
-            self.wlan.connect(self.wifi_ssid, self.wifi_pass)
-            
-            # Wait for connection with timeout
-            retry_count = 0
-            while not self.wlan.isconnected() and retry_count < Config.WIFI_RETRY_COUNT:
-                time.sleep(Config.WIFI_RETRY_DELAY_SEC)
-                retry_count += 1
-            
-            if self.wlan.isconnected():
-                print(f"[WIFI] Connected to WiFi: {self.wlan.ifconfig()}")
-                event_bus.publish(Events.WIFI_CONNECTED)
-                return True
-            else:
-                print("[WIFI] Failed to connect to WiFi")
-                self.wlan = None
-                return False
+            start = self._activate()
+            candidate = self._fast_path_candidate(networks)
+            if candidate and self._attempt("fast", candidate, Config.WIFI_FAST_CONNECT_TIMEOUT_MS):
+                return self._connected(start)
+            for candidate in self._ranked_candidates(networks, self._scan()):
+                if self._attempt("full", candidate, Config.WIFI_CONNECT_TIMEOUT_MS):
+                    return self._connected(start)
         except Exception as e:
             print(f"[WIFI] Error connecting to WiFi: {e}")
-            self.wlan = None
+        return self._failed()
+
+    async def _connect_async(self):
+        """The same as connect() for the saved networks, but waits for the link without blocking the scheduler"""
+        networks = self.networks
+        try:
+            start = self._activate()
+            candidate = self._fast_path_candidate(networks)
+            if candidate and await self._attempt_async("fast", candidate, Config.WIFI_FAST_CONNECT_TIMEOUT_MS):
+                return self._connected(start)
+            scan = await network_worker.call(self._scan)
+            for candidate in self._ranked_candidates(networks, scan):
+                if await self._attempt_async("full", candidate, Config.WIFI_CONNECT_TIMEOUT_MS):
+                    return self._connected(start)
+        except Exception as e:
+            print(f"[WIFI] Error connecting to WiFi: {e}")
+        return self._failed()
+
+    def _activate(self):
+        self.wlan = network.WLAN(network.STA_IF)
+        self.wlan.active(True)
+        try:
+            # Reconnecting is the state machine's job, not the driver's
+            self.wlan.config(reconnects=0)
+        except (OSError, ValueError):
+            pass
+        return time.ticks_ms()
+
+    def _connected(self, start):
+        self.connect_ms = time.ticks_diff(time.ticks_ms(), start)
+        print(f"[WIFI] Connected to {self.wifi_ssid} in {self.connect_ms}ms: {self.wlan.ifconfig()}")
+        self._save_access_point()
+        if any(known["ssid"] == self.wifi_ssid for known in self.networks):
+            self._remember(self.wifi_ssid, self.wifi_pass, time.time())
+        self._set_state(WifiState.CONNECTED)
+        return True
+
+    def _failed(self):
+        print("[WIFI] Failed to connect to WiFi")
+        self.wlan = None
+        self._set_state(WifiState.IDLE)
+        return False
+
+    def _attempt(self, path, candidate, timeout_ms):
+        """
+        One blocking association attempt, polling for the link every WIFI_POLL_INTERVAL_MS until timeout_ms.
+        candidate is (network, bssid, channel, ifconfig); bssid, channel and ifconfig may be None.
+        """
+        start = self._begin_attempt(*candidate)
+        result = self._poll_attempt(start, timeout_ms)
+        while result is None:
+            time.sleep_ms(Config.WIFI_POLL_INTERVAL_MS)
+            result = self._poll_attempt(start, timeout_ms)
+        return self._end_attempt(path, start, candidate, result)
+
+    async def _attempt_async(self, path, candidate, timeout_ms):
+        start = self._begin_attempt(*candidate)
+        result = self._poll_attempt(start, timeout_ms)
+        while result is None:
+            await asyncio.sleep_ms(Config.WIFI_POLL_INTERVAL_MS)
+            result = self._poll_attempt(start, timeout_ms)
+        return self._end_attempt(path, start, candidate, result)
+
+    def _begin_attempt(self, known, bssid, channel, ifconfig):
+        wlan = self.wlan
+        self.connect_attempts += 1
+        self._set_state(WifiState.ASSOCIATING)
+        print(f"[WIFI] Connecting to WiFi with SSID: {known['ssid']} and password: {known['password']}")
+        # The channel isn't applied: connect() only takes a BSSID, and the driver still scans every
+        # channel for it. It is kept for the logs.
+        if ifconfig:
+            try:
+                wlan.ifconfig(ifconfig)
+                self._static_ifconfig = True
+            except (OSError, ValueError) as e:
+                print(f"[WIFI] Could not apply the cached IP settings: {e}")
+        elif self._static_ifconfig:
+            # Starting the DHCP client raises if it is already running, so only do it after a static config
+            try:
+                wlan.ifconfig("dhcp")
+                self._static_ifconfig = False
+            except (OSError, ValueError) as e:
+                print(f"[WIFI] Could not switch back to DHCP: {e}")
+        if bssid:
+            wlan.connect(known["ssid"], known["password"], bssid=bssid)
+        else:
+            wlan.connect(known["ssid"], known["password"])
+        return time.ticks_ms()
+
+    def _poll_attempt(self, start, timeout_ms):
+        """True once connected, False if the attempt has failed or timed out, None while still in progress"""
+        wlan = self.wlan
+        if wlan.isconnected():
+            return True
+        if time.ticks_diff(time.ticks_ms(), start) >= timeout_ms or wlan.status() in _FAILED_STATUSES:
             return False
+        if self.state == WifiState.ASSOCIATING and self._is_associated():
+            self._set_state(WifiState.DHCP)
+        return None
 
-    def _reset(self):
-        """Reset the WiFi connection and clear credentials file"""
-        self.disconnect()
-        self.wifi_ssid = None
-        self.wifi_pass = None
+    def _is_associated(self):
+        """Associated with the access point, though perhaps still waiting for an address"""
         try:
-            os.remove(self.credentials_file)
-        except:
+            self.wlan.status("rssi")
+            return True
+        except (OSError, ValueError):
+            return False
+
+    def _end_attempt(self, path, start, candidate, connected):
+        known, bssid, channel, ifconfig = candidate
+        elapsed = time.ticks_diff(time.ticks_ms(), start)
+        if connected:
+            self.wifi_ssid = known["ssid"]
+            self.wifi_pass = known["password"]
+            self._connected_via = (bssid, channel)
+            print(f"[WIFI] {path} connect #{self.connect_attempts} succeeded in {elapsed}ms (channel {channel}, {'static IP' if ifconfig else 'DHCP'})")
+            return True
+        print(f"[WIFI] {path} connect #{self.connect_attempts} to {known['ssid']} failed after {elapsed}ms (status {self.wlan.status()})")
+        self.wlan.disconnect()
+        return False
+
+    def _scan(self):
+        """[(ssid, bssid, channel, rssi)] for every access point in range. A scan is reused for WIFI_SCAN_CACHE_MS."""
+        now = time.ticks_ms()
+        if self._scan_results is not None and time.ticks_diff(now, self._scan_ticks) < Config.WIFI_SCAN_CACHE_MS:
+            return self._scan_results
+        results = [(ssid.decode(), bssid, channel, rssi) for ssid, bssid, channel, rssi, _, _ in self.wlan.scan()]
+        self._scan_ticks = time.ticks_ms()
+        print(f"[WIFI] Scan found {len(results)} access points in {time.ticks_diff(self._scan_ticks, now)}ms")
+        self._scan_results = results
+        return results
+
+    def _ranked_candidates(self, networks, scan):
+        """
+        Attempts for the known networks that are in range, strongest signal first. Signals are compared in
+        fixed 10 dB bands (-41 to -50 dBm, -51 to -60 dBm, ...), and within a band the most recently
+        connected network goes first. So -51 and -60 tie, while -50 and -51 don't.
+        """
+        strongest = {}
+        for ssid, bssid, channel, rssi in scan:
+            if ssid not in strongest or rssi > strongest[ssid][2]:
+                strongest[ssid] = (bssid, channel, rssi)
+        ranked = []
+        for known in networks:
+            access_point = strongest.get(known["ssid"])
+            if access_point:
+                bssid, channel, rssi = access_point
+                ranked.append(((rssi // 10, known.get("last_success", 0)), (known, bssid, channel, Config.WIFI_STATIC_IFCONFIG)))
+        ranked.sort(key=lambda entry: entry[0], reverse=True)
+        candidates = [candidate for _, candidate in ranked]
+        if not candidates:
+            # None of them are visible, but a hidden network doesn't show up in scans
+            candidates.append((networks[0], None, None, Config.WIFI_STATIC_IFCONFIG))
+        return candidates
+
+    def _fast_path_candidate(self, networks):
+        """The attempt at the access point that worked last time, or None if it isn't one of these networks"""
+        access_point = kv_store.get("wifi_ap")
+        if not access_point:
+            return None
+        for known in networks:
+            if known["ssid"] == access_point["ssid"]:
+                bssid = access_point["bssid"]
+                return known, bssid and binascii.unhexlify(bssid), access_point["channel"], self._cached_ifconfig(access_point)
+        return None
+
+    def _cached_ifconfig(self, access_point):
+        if Config.WIFI_STATIC_IFCONFIG:
+            return Config.WIFI_STATIC_IFCONFIG
+        if Config.WIFI_REUSE_DHCP_LEASE and access_point.get("ifconfig"):
+            return tuple(access_point["ifconfig"])
+        return None
+
+    def _save_access_point(self):
+        """Remember the access point and lease that worked, for the fast path next time"""
+        bssid, channel = self._connected_via
+        try:
+            channel = self.wlan.config("channel")
+        except (OSError, ValueError):
             pass
-        event_bus.publish(Events.WIFI_RESET)
+        kv_store.set("wifi_ap", {
+            "ssid": self.wifi_ssid,
+            "bssid": binascii.hexlify(bssid).decode() if bssid else None,
+            "channel": channel,
+            "ifconfig": self.wlan.ifconfig(),
+        })
 
-    def _monitor_connection(self):
-        """ Start a periodic timer to check if the WiFi connection is lost and attempt to reconnect """
-        self.reconnect_timer = Timer(1)
-        self.reconnect_timer.init(period=30000, mode=Timer.PERIODIC, callback=self._try_reconnect)
+    def _soft_reset(self):
+        """
+        Reset the WiFi connection for re-provisioning. The saved networks are kept, so the network
+        provisioned next is added to them; only the cached access point is forgotten.
+        """
+        self.disconnect()
+        kv_store.delete("wifi_ap")
+        event_bus.publish(Events.WIFI_RESET)
 
-    def _try_reconnect(self, timer):
-        """Attempt to reconnect to WiFi if disconnected"""
-        if not self._is_connected() and self.wifi_ssid and self.wifi_pass:
-            print("[WIFI] Wifi has been disconnected, attempting to reconnect...")
-            if self.connect():
-                event_bus.publish(Events.WIFI_CONNECTED)
+    def _factory_reset(self):
+        """Reset the WiFi connection and clear all the saved networks"""
+        self.disconnect()
+        self.wifi_ssid = None
+        self.wifi_pass = None
+        self.networks = []
+        kv_store.delete("wifi")
+        kv_store.delete("wifi_ap")
+        event_bus.publish(Events.WIFI_RESET)
 
     def disconnect(self):
-        if self.reconnect_timer:
-            self.reconnect_timer.deinit()
+        self.monitoring = False
         if self.wlan:
             self.wlan.disconnect()
             self.wlan = None
-
-    def _is_connected(self):
-        """Check if there is an active WiFi connection"""
-        return self.wlan is not None and self.wlan.isconnected()
+        self._set_state(WifiState.IDLE)